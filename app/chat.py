@@ -1,16 +1,32 @@
 # app/chat.py
 from pathlib import Path
 
-from core.infer import load_model_npz, generate
+from core.infer import InferenceSession, LogitCache
+from core.registry import ModelRegistry
+from core.result_cache import default_result_cache
+from core.stop import StopSequences, unescape_stop
 
 ARTIFACTS_DIR = Path("data/artifacts")
 
+# Models kept loaded at once when switching with /model.
+RESIDENT_MODELS = 4
+
+# Next-token logits kept for repeated 16-byte contexts (shared by all models).
+LOGIT_CACHE_MB = 64
+
+# Replies are deterministic (fixed SEED), so repeated prompts are answered
+# from the on-disk result cache (core.result_cache); False always decodes.
+USE_RESULT_CACHE = True
+
 # Generation defaults (kept fixed for reproducibility)
 MAX_NEW_TOKENS = 300
 TEMPERATURE = 0.9
 TOP_K = 80
 SEED = 123
 
+# A summary is complete at "###" / "<END_OUTPUT>"; /stop changes these.
+STOP_SEQUENCES = ("###", "<END_OUTPUT>")
+
 
 def list_models() -> list[Path]:
     """Return available .npz model files."""
@@ -19,28 +35,47 @@ def list_models() -> list[Path]:
     return sorted(ARTIFACTS_DIR.glob("*.npz"))
 
 
-def main() -> None:
-    models = list_models()
-    if not models:
-        raise SystemExit("[ERR] No .npz models found in data/artifacts")
-
+def _print_models(models: list[Path]) -> None:
     print("\nAvailable models:")
     for i, p in enumerate(models, 1):
         print(f"  {i:02d}) {p.name}")
 
+
+def _pick(models: list[Path], text: str) -> Path | None:
     try:
-        idx = int(input("\nSelect model number: ").strip()) - 1
+        idx = int(text.strip()) - 1
     except ValueError:
-        raise SystemExit("[ERR] Invalid selection")
+        return None
+    return models[idx] if 0 <= idx < len(models) else None
+
 
-    if not 0 <= idx < len(models):
-        raise SystemExit("[ERR] Out of range")
+def _parse_stops(text: str) -> tuple[str, ...]:
+    # "/stop off" clears; otherwise space-separated sequences, with \n-style escapes.
+    text = text.strip()
+    if text == "off":
+        return ()
+    return tuple(unescape_stop(t) for t in text.split())
 
-    chosen = models[idx]
-    model = load_model_npz(str(chosen))
+
+def main() -> None:
+    registry = ModelRegistry(ARTIFACTS_DIR.as_posix(), capacity=RESIDENT_MODELS)
+    models = list_models()
+    if not models:
+        raise SystemExit("[ERR] No .npz models found in data/artifacts")
+
+    _print_models(models)
+    chosen = _pick(models, input("\nSelect model number: "))
+    if chosen is None:
+        raise SystemExit("[ERR] Invalid selection")
+
+    cache = LogitCache(LOGIT_CACHE_MB)
+    results = default_result_cache(chosen.as_posix()) if USE_RESULT_CACHE else None
+    session = InferenceSession(registry.get(chosen.as_posix()), cache=cache, results=results)
+    stops = StopSequences(STOP_SEQUENCES)
 
     print(f"\n[OK] Loaded: {chosen.name}")
-    print("Type your prompt. Empty line quits.\n")
+    print("Type your prompt. Empty line quits; Ctrl-C stops a reply; /model N switches model;")
+    print("/stop SEQ... sets stop sequences (/stop off disables); /cache shows logit cache stats.\n")
 
     while True:
         try:
@@ -52,17 +87,66 @@ def main() -> None:
         if not prompt.strip():
             break
 
-        out = generate(
-            model,
-            prompt=prompt,
+        if prompt.startswith("/model"):
+            models = list_models()
+            nxt = _pick(models, prompt[len("/model") :])
+            if nxt is None:
+                _print_models(models)
+                print()
+                continue
+            chosen = nxt
+            session = InferenceSession(registry.get(chosen.as_posix()), cache=cache, results=results)
+            print(f"[OK] Using: {chosen.name}\n")
+            continue
+
+        if prompt.strip() == "/cache":
+            c = cache.info()
+            print(
+                f"[OK] Logit cache: {c['entries']} contexts, {c['bytes'] / 1e6:.1f}/{c['max_bytes'] / 1e6:.0f} MB, "
+                f"hits={c['hits']} misses={c['misses']} ({100 * c['hit_rate']:.1f}%)"
+            )
+            if results is not None:
+                r = results.info()
+                print(
+                    f"[OK] Result cache: {r['entries']} replies, {r['bytes'] / 1e6:.2f}/{r['max_bytes'] / 1e6:.0f} MB, "
+                    f"hits={r['hits']} misses={r['misses']} ({r['path']})"
+                )
+            print()
+            continue
+
+        if prompt.startswith("/stop"):
+            arg = prompt[len("/stop") :]
+            if arg.strip():
+                seqs = _parse_stops(arg)
+                stops = StopSequences(seqs) if seqs else None
+            shown = ", ".join(repr(s.decode("utf-8", errors="replace")) for s in stops.stops) if stops else "off"
+            print(f"[OK] Stop sequences: {shown}\n")
+            continue
+
+        # The registry reloads the artifact if it changed on disk since the last prompt.
+        model = registry.get(chosen.as_posix())
+        if model is not session.model:
+            session = InferenceSession(model, cache=cache, results=results)
+            print(f"[OK] Reloaded: {chosen.name}")
+
+        print("Model> ", end="", flush=True)
+        pieces = session.stream(
+            prompt,
             max_new_tokens=MAX_NEW_TOKENS,
             temperature=TEMPERATURE,
             top_k=TOP_K,
             seed=SEED,
+            stop=stops,
         )
-
-        print("Model>", out)
-        print()
+        try:
+            for piece in pieces:
+                print(piece, end="", flush=True)
+        except KeyboardInterrupt:
+            # Cancels only this reply; the session keeps going.
+            pieces.close()
+            print(" [stopped]", end="")
+
+        print("\n")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,156 @@
+# app/client.py
+from __future__ import annotations
+
+import argparse
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_URL = "http://127.0.0.1:8765"
+
+
+def request(url: str, path: str, payload: dict | None = None, timeout: float = 300.0) -> dict:
+    data = None if payload is None else json.dumps(payload).encode("utf-8")
+    req = urllib.request.Request(
+        url.rstrip("/") + path,
+        data=data,
+        method="GET" if payload is None else "POST",
+        headers={"Content-Type": "application/json"},
+    )
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as r:
+            return json.loads(r.read().decode("utf-8"))
+    except urllib.error.HTTPError as e:
+        body = e.read().decode("utf-8", errors="replace")
+        raise SystemExit(f"[ERR] {path} -> HTTP {e.code}: {body}") from None
+    except urllib.error.URLError as e:
+        raise SystemExit(f"[ERR] Cannot reach {url}: {e.reason}") from None
+
+
+def generate(prompt: str, url: str = DEFAULT_URL, **params) -> dict:
+    # params: max_new_tokens, temperature, top_k, seed, stop (server defaults when omitted).
+    return request(url, "/generate", {"prompt": prompt, **params})
+
+
+def score(text: str, url: str = DEFAULT_URL, prefix: str = "") -> dict:
+    return request(url, "/score", {"text": text, "prefix": prefix})
+
+
+def metrics(url: str = DEFAULT_URL) -> dict:
+    return request(url, "/metrics")
+
+
+def _concurrent(fn, payloads: list, concurrency: int) -> list:
+    with ThreadPoolExecutor(max_workers=concurrency) as ex:
+        return list(ex.map(fn, payloads))
+
+
+def selftest(model_path: str, n: int, concurrency: int, max_new_tokens: int) -> None:
+    # Starts a server in this process on a free localhost port, fires concurrent
+    # requests at it and checks each reply against core.infer.generate.
+    import asyncio
+
+    from app.server import InferenceServer
+    from core.infer import generate as local_generate
+    from core.infer import load_model_npz
+
+    model = load_model_npz(model_path)
+    # Result caches off on both sides, so every reply is actually decoded.
+    server = InferenceServer(model, model_path)
+    ready = threading.Event()
+    thread = threading.Thread(target=lambda: asyncio.run(server.serve("127.0.0.1", 0, ready=ready.set)), daemon=True)
+    thread.start()
+    if not ready.wait(timeout=30):
+        raise SystemExit("[ERR] Server did not start")
+    url = f"http://127.0.0.1:{server.port}"
+
+    try:
+        prompts = [f"Net sales for fiscal {2000 + i} increased" for i in range(n)]
+        params = [
+            {"max_new_tokens": max_new_tokens, "temperature": (0.0, 0.7, 1.0)[i % 3], "top_k": (0, 40, 80)[i % 3], "seed": i}
+            for i in range(n)
+        ]
+        for i in range(1, n, 4):
+            params[i]["stop"] = [" the", "\n"]
+
+        t0 = time.perf_counter()
+        replies = _concurrent(lambda i: generate(prompts[i], url=url, **params[i]), list(range(n)), concurrency)
+        wall = time.perf_counter() - t0
+
+        for i, r in enumerate(replies):
+            ref = local_generate(model, prompts[i], **params[i])
+            if r["text"] != ref:
+                raise SystemExit(f"[FAIL] request {i}: server output differs from core.infer.generate")
+        print(f"[OK] {n} generate replies match core.infer.generate ({wall:.2f}s wall)")
+
+        s = _concurrent(lambda t: score(t, url=url), prompts[:concurrency], concurrency)
+        if any(not (x["ppl"] > 0 and x["n_tokens"] == len(p.encode("utf-8")) + 1) for x, p in zip(s, prompts)):
+            raise SystemExit("[FAIL] score replies look wrong")
+        print(f"[OK] {len(s)} score replies, ppl of the first: {s[0]['ppl']:.2f}")
+
+        m = metrics(url)["endpoints"]
+        for name, e in m.items():
+            print(
+                f"{name:>8}: requests={e['requests']} batches={e['batches']} "
+                f"mean_batch={e['mean_batch']:.1f} max_batch={e['max_batch']} "
+                f"p50={e['latency_ms'].get('p50', 0):.1f}ms p99={e['latency_ms'].get('p99', 0):.1f}ms"
+            )
+        if concurrency > 1 and m["generate"]["max_batch"] < 2:
+            raise SystemExit("[FAIL] concurrent requests were never batched")
+    finally:
+        server.close()
+        thread.join(timeout=10)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Client for app.server")
+    ap.add_argument("--url", type=str, default=DEFAULT_URL)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("generate")
+    p.add_argument("prompt", type=str)
+    p.add_argument("--max_new_tokens", type=int, default=None)
+    p.add_argument("--temperature", type=float, default=None)
+    p.add_argument("--top_k", type=int, default=None)
+    p.add_argument("--seed", type=int, default=None)
+    p.add_argument("--stop", type=str, nargs="+", default=None, help="Stop sequences")
+    p.add_argument("--n", type=int, default=1, help="Send N concurrent copies (seeds seed, seed+1, ...)")
+
+    p = sub.add_parser("score")
+    p.add_argument("text", type=str)
+    p.add_argument("--prefix", type=str, default="", help="Conditioning text, not scored")
+
+    sub.add_parser("metrics")
+
+    p = sub.add_parser("selftest", help="Start a server in-process and check it end to end")
+    p.add_argument("--model", type=str, default="data/artifacts/filingpt_mlp_financial_v1.npz")
+    p.add_argument("--n", type=int, default=32)
+    p.add_argument("--concurrency", type=int, default=16)
+    p.add_argument("--max_new_tokens", type=int, default=120)
+
+    args = ap.parse_args()
+
+    if args.cmd == "generate":
+        params = {
+            k: getattr(args, k)
+            for k in ("max_new_tokens", "temperature", "top_k", "seed", "stop")
+            if getattr(args, k) is not None
+        }
+        base_seed = params.get("seed", 123)
+        payloads = [{**params, "seed": base_seed + i} for i in range(args.n)]
+        replies = _concurrent(lambda p: generate(args.prompt, url=args.url, **p), payloads, max(1, args.n))
+        for r in replies:
+            print(f"[{r['latency_ms']:.1f} ms, batch {r['batch_size']}] {r['text']}")
+    elif args.cmd == "score":
+        print(json.dumps(score(args.text, url=args.url, prefix=args.prefix), indent=2))
+    elif args.cmd == "metrics":
+        print(json.dumps(metrics(args.url), indent=2))
+    else:
+        selftest(args.model, args.n, args.concurrency, args.max_new_tokens)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,418 @@
+# app/server.py
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import math
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from typing import Callable
+
+import numpy as np
+
+from core.infer import generate_batch, load_model_npz, score_batch
+from core.result_cache import ResultCache, default_result_cache
+
+DEFAULT_MODEL = "data/artifacts/filingpt_mlp_financial_v1.npz"
+
+# Request defaults match app.chat.
+MAX_NEW_TOKENS = 300
+TEMPERATURE = 0.9
+TOP_K = 80
+SEED = 123
+
+MAX_TOKENS_LIMIT = 4096
+MAX_SCORE_BYTES = 1 << 20
+MAX_STOP_SEQUENCES = 8
+MAX_STOP_BYTES = 64
+MAX_BODY_BYTES = 2 << 20
+SCORE_MEMORY_MB = 64
+
+LATENCY_WINDOW = 1024
+
+
+class RequestError(Exception):
+    """Bad request payload; reported to the client as HTTP 400."""
+
+
+def _gen_params(obj: dict) -> dict:
+    prompt = obj.get("prompt")
+    if not isinstance(prompt, str):
+        raise RequestError("'prompt' must be a string")
+
+    try:
+        p = {
+            "prompt": prompt,
+            "max_new_tokens": int(obj.get("max_new_tokens", MAX_NEW_TOKENS)),
+            "temperature": float(obj.get("temperature", TEMPERATURE)),
+            "top_k": int(obj.get("top_k", TOP_K)),
+            "seed": int(obj.get("seed", SEED)),
+        }
+    except (TypeError, ValueError) as e:
+        raise RequestError(f"bad parameter: {e}") from None
+
+    if not 0 <= p["max_new_tokens"] <= MAX_TOKENS_LIMIT:
+        raise RequestError(f"'max_new_tokens' must be in [0, {MAX_TOKENS_LIMIT}]")
+    if not math.isfinite(p["temperature"]) or p["temperature"] < 0:
+        raise RequestError("'temperature' must be a finite number >= 0")
+    if p["top_k"] < 0:
+        raise RequestError("'top_k' must be >= 0")
+    if p["seed"] < 0:
+        raise RequestError("'seed' must be >= 0")
+
+    stop = obj.get("stop", [])
+    if isinstance(stop, str):
+        stop = [stop]
+    if not isinstance(stop, list) or not all(isinstance(x, str) for x in stop):
+        raise RequestError("'stop' must be a string or a list of strings")
+    if len(stop) > MAX_STOP_SEQUENCES or any(len(x.encode("utf-8", errors="replace")) > MAX_STOP_BYTES for x in stop):
+        raise RequestError(f"'stop' allows {MAX_STOP_SEQUENCES} sequences of at most {MAX_STOP_BYTES} bytes")
+    p["stop"] = tuple(sorted(set(x for x in stop if x)))
+    return p
+
+
+def _score_params(obj: dict) -> dict:
+    text = obj.get("text")
+    if not isinstance(text, str):
+        raise RequestError("'text' must be a string")
+    prefix = obj.get("prefix", "")
+    if not isinstance(prefix, str):
+        raise RequestError("'prefix' must be a string")
+    # Byte length as scored; text_to_tokens replaces lone surrogates the same way.
+    size = len(text.encode("utf-8", errors="replace")) + len(prefix.encode("utf-8", errors="replace"))
+    if size > MAX_SCORE_BYTES:
+        raise RequestError(f"'prefix' + 'text' is {size} UTF-8 bytes; the limit is {MAX_SCORE_BYTES}")
+    return {"text": text, "prefix": prefix}
+
+
+def run_generate(
+    model: dict[str, np.ndarray], reqs: list[dict], result_cache: ResultCache | None = None
+) -> list[dict]:
+    # generate_batch shares one stop automaton per call, so requests are grouped by stop set.
+    groups: dict[tuple[str, ...], list[int]] = {}
+    for i, r in enumerate(reqs):
+        groups.setdefault(r["stop"], []).append(i)
+
+    out: list[dict] = [{} for _ in reqs]
+    for stop, idx in groups.items():
+        texts = generate_batch(
+            model,
+            [reqs[i]["prompt"] for i in idx],
+            max_new_tokens=[reqs[i]["max_new_tokens"] for i in idx],
+            temperature=[reqs[i]["temperature"] for i in idx],
+            top_k=[reqs[i]["top_k"] for i in idx],
+            seed=[reqs[i]["seed"] for i in idx],
+            stop=stop or None,
+            result_cache=result_cache,
+        )
+        for i, t in zip(idx, texts):
+            out[i] = {"text": t}
+    return out
+
+
+def run_score(model: dict[str, np.ndarray], reqs: list[dict]) -> list[dict]:
+    # Each text is scored as its own document, [BOS, prefix, bytes..., EOS], like the gold corpus.
+    scores = score_batch(
+        model, [r["text"] for r in reqs], prefix=[r["prefix"] for r in reqs], memory_mb=SCORE_MEMORY_MB
+    )
+    return [{"n_tokens": s["n_tokens"], "loss": s["loss"], "ppl": s["ppl"]} for s in scores]
+
+
+class Batcher:
+    """Coalesces concurrent requests into one batched call.
+
+    The first queued request opens a window of `window_ms`; everything that
+    arrives before it closes (up to `max_batch`) goes to `fn` as one list,
+    run on the shared executor so the event loop keeps accepting requests.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        fn: Callable[[list[dict]], list[dict]],
+        executor: ThreadPoolExecutor,
+        window_ms: float,
+        max_batch: int,
+    ):
+        self.name = name
+        self.fn = fn
+        self.executor = executor
+        self.window = window_ms / 1e3
+        self.max_batch = int(max_batch)
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+        self.requests = 0
+        self.errors = 0
+        self.batches = 0
+        self.batched_rows = 0
+        self.max_seen_batch = 0
+        self.in_flight = 0
+        self.busy_s = 0.0
+        self.latencies: deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def submit(self, params: dict) -> tuple[dict, float, int]:
+        fut = asyncio.get_running_loop().create_future()
+        t0 = time.perf_counter()
+        self.requests += 1
+        await self.queue.put((params, fut))
+        result, batch_size = await fut
+        latency = time.perf_counter() - t0
+        self.latencies.append(latency)
+        return result, latency, batch_size
+
+    async def _loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await self.queue.get()]
+            deadline = loop.time() + self.window
+            while len(items) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    items.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            self.batches += 1
+            self.batched_rows += len(items)
+            self.max_seen_batch = max(self.max_seen_batch, len(items))
+            self.in_flight = len(items)
+
+            t0 = time.perf_counter()
+            try:
+                results = await loop.run_in_executor(self.executor, self.fn, [p for p, _ in items])
+            except (Exception, SystemExit) as e:  # one failure fails the whole batch
+                self.errors += len(items)
+                for _, fut in items:
+                    if not fut.done():
+                        fut.set_exception(e)
+            else:
+                for (_, fut), r in zip(items, results):
+                    if not fut.done():
+                        fut.set_result((r, len(items)))
+            finally:
+                self.busy_s += time.perf_counter() - t0
+                self.in_flight = 0
+
+    def metrics(self) -> dict:
+        lat = np.asarray(self.latencies, dtype=np.float64) * 1e3
+        pct = {}
+        if lat.size:
+            p50, p95, p99 = np.percentile(lat, [50, 95, 99])
+            pct = {"p50": float(p50), "p95": float(p95), "p99": float(p99), "max": float(lat.max())}
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "queue_depth": self.queue.qsize(),
+            "in_flight": self.in_flight,
+            "batches": self.batches,
+            "mean_batch": self.batched_rows / self.batches if self.batches else 0.0,
+            "max_batch": self.max_seen_batch,
+            "busy_s": self.busy_s,
+            "latency_ms": pct,
+        }
+
+
+class InferenceServer:
+    """Minimal HTTP/1.1 JSON service over core.infer (stdlib asyncio only).
+
+    POST /generate  {"prompt", "max_new_tokens"?, "temperature"?, "top_k"?, "seed"?, "stop"?}
+    POST /score     {"text", "prefix"?}
+    GET  /metrics   per-endpoint queue depth, batch sizes and latency percentiles
+    GET  /health
+    """
+
+    def __init__(
+        self,
+        model: dict[str, np.ndarray],
+        model_name: str,
+        window_ms: float = 5.0,
+        max_batch: int = 64,
+        result_cache: ResultCache | None = None,
+    ):
+        self.model = model
+        self.model_name = model_name
+        self.result_cache = result_cache
+        self.window_ms = float(window_ms)
+        self.max_batch = int(max_batch)
+        self.port: int | None = None
+        self.generated_bytes = 0
+
+        self._t_start = time.perf_counter()
+        self._server: asyncio.AbstractServer | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="infer")
+        self._batchers: dict[str, Batcher] = {}
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8765, ready: Callable[[], None] | None = None) -> None:
+        self._batchers = {
+            "generate": Batcher(
+                "generate",
+                lambda r: run_generate(self.model, r, self.result_cache),
+                self._executor,
+                self.window_ms,
+                self.max_batch,
+            ),
+            "score": Batcher("score", lambda r: run_score(self.model, r), self._executor, self.window_ms, self.max_batch),
+        }
+        for b in self._batchers.values():
+            b.start()
+
+        self._loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._handle, host, port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        print(f"[OK] Serving {self.model_name} on http://{host}:{self.port}")
+        if ready is not None:
+            ready()
+
+        try:
+            async with self._server:
+                await self._server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            for b in self._batchers.values():
+                await b.stop()
+            self._executor.shutdown(wait=True)
+
+    def close(self) -> None:
+        # Safe to call from another thread.
+        if self._loop is not None and self._server is not None:
+            self._loop.call_soon_threadsafe(self._server.close)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                parts = line.decode("latin-1").split()
+                if len(parts) != 3:
+                    await self._respond(writer, HTTPStatus.BAD_REQUEST, {"error": "malformed request line"}, close=True)
+                    break
+                method, path, _ = parts
+
+                headers: dict[str, str] = {}
+                while True:
+                    h = await reader.readline()
+                    if h in (b"\r\n", b"\n", b""):
+                        break
+                    k, _, v = h.decode("latin-1").partition(":")
+                    headers[k.strip().lower()] = v.strip()
+
+                try:
+                    n = int(headers.get("content-length", "0") or 0)
+                except ValueError:
+                    n = -1
+                if n < 0:
+                    await self._respond(writer, HTTPStatus.BAD_REQUEST, {"error": "invalid Content-Length"}, close=True)
+                    break
+                if n > MAX_BODY_BYTES:
+                    await self._respond(writer, HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {"error": "body too large"}, close=True)
+                    break
+                body = await reader.readexactly(n) if n else b""
+
+                status, payload = await self._route(method, path.split("?", 1)[0], body)
+                close = headers.get("connection", "").lower() == "close"
+                await self._respond(writer, status, payload, close=close)
+                if close:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, writer: asyncio.StreamWriter, status: HTTPStatus, payload: dict, close: bool) -> None:
+        data = json.dumps(payload).encode("utf-8")
+        head = (
+            f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Connection: {'close' if close else 'keep-alive'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + data)
+        await writer.drain()
+
+    async def _route(self, method: str, path: str, body: bytes) -> tuple[HTTPStatus, dict]:
+        if method == "GET" and path == "/health":
+            return HTTPStatus.OK, {"status": "ok", "model": self.model_name}
+        if method == "GET" and path == "/metrics":
+            return HTTPStatus.OK, self.metrics()
+
+        if method != "POST" or path not in ("/generate", "/score"):
+            return HTTPStatus.NOT_FOUND, {"error": f"no route for {method} {path}"}
+
+        try:
+            obj = json.loads(body.decode("utf-8") or "{}")
+            if not isinstance(obj, dict):
+                raise RequestError("body must be a JSON object")
+            params = _gen_params(obj) if path == "/generate" else _score_params(obj)
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            return HTTPStatus.BAD_REQUEST, {"error": "body is not valid JSON"}
+        except RequestError as e:
+            return HTTPStatus.BAD_REQUEST, {"error": str(e)}
+
+        name = path[1:]
+        try:
+            result, latency, batch_size = await self._batchers[name].submit(params)
+        except (Exception, SystemExit) as e:
+            return HTTPStatus.INTERNAL_SERVER_ERROR, {"error": f"{type(e).__name__}: {e}"}
+
+        if name == "generate":
+            self.generated_bytes += len(result["text"].encode("utf-8"))
+        return HTTPStatus.OK, {**result, "latency_ms": latency * 1e3, "batch_size": batch_size}
+
+    def metrics(self) -> dict:
+        uptime = time.perf_counter() - self._t_start
+        return {
+            "model": self.model_name,
+            "uptime_s": uptime,
+            "window_ms": self.window_ms,
+            "max_batch": self.max_batch,
+            "generated_bytes": self.generated_bytes,
+            "endpoints": {k: b.metrics() for k, b in self._batchers.items()},
+        }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Local HTTP inference server with dynamic batching")
+    ap.add_argument("--model", type=str, default=DEFAULT_MODEL)
+    ap.add_argument("--host", type=str, default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--window_ms", type=float, default=5.0, help="How long a batch waits for more requests")
+    ap.add_argument("--max_batch", type=int, default=64)
+    ap.add_argument("--no_result_cache", action="store_true", help="Always decode; skip the on-disk result cache")
+    args = ap.parse_args()
+
+    model = load_model_npz(args.model)
+    server = InferenceServer(
+        model,
+        args.model,
+        window_ms=args.window_ms,
+        max_batch=args.max_batch,
+        result_cache=None if args.no_result_cache else default_result_cache(args.model),
+    )
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        print("\n[OK] Server stopped.")
+
+
+if __name__ == "__main__":
+    main()
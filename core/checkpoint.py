@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import json
+import os
+import queue
+import threading
+from pathlib import Path
+
+import numpy as np
+
+_META_KEY = "__meta__"
+_LOSSES_KEY = "__losses__"
+
+
+def checkpoint_path(ckpt_dir: str, step: int) -> Path:
+    return Path(ckpt_dir) / f"ckpt_{int(step):08d}.npz"
+
+
+def list_checkpoints(ckpt_dir: str) -> list[Path]:
+    d = Path(ckpt_dir)
+    if not d.is_dir():
+        return []
+    return sorted(d.glob("ckpt_*.npz"))
+
+
+def clear_checkpoints(ckpt_dir: str) -> int:
+    # Removes every checkpoint in ckpt_dir; returns how many there were.
+    found = list_checkpoints(ckpt_dir)
+    for p in found:
+        p.unlink(missing_ok=True)
+    return len(found)
+
+
+def save_checkpoint(
+    path: str,
+    model: dict[str, np.ndarray],
+    meta: dict,
+    losses: np.ndarray | None = None,
+) -> None:
+    # Written to a temp file and renamed, so a crash mid-write never leaves a
+    # truncated "latest" checkpoint behind.
+    p = Path(path)
+    p.parent.mkdir(parents=True, exist_ok=True)
+    tmp = p.with_name(p.name + ".tmp")
+
+    arrays = dict(model)
+    arrays[_META_KEY] = np.array(json.dumps(meta))
+    if losses is not None:
+        arrays[_LOSSES_KEY] = np.asarray(losses, dtype=np.float64)
+
+    with tmp.open("wb") as f:
+        np.savez(f, **arrays)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, p)
+
+
+def load_checkpoint(path: str) -> tuple[dict[str, np.ndarray], dict, np.ndarray]:
+    """Load a checkpoint file, or the latest checkpoint if `path` is a directory."""
+    p = Path(path)
+    if p.is_dir():
+        found = list_checkpoints(p.as_posix())
+        if not found:
+            raise SystemExit(f"[ERR] No checkpoints in {p.as_posix()}")
+        p = found[-1]
+    if not p.exists():
+        raise SystemExit(f"[ERR] Missing checkpoint: {p.as_posix()}")
+
+    with np.load(p, allow_pickle=False) as d:
+        meta = json.loads(str(d[_META_KEY]))
+        losses = d[_LOSSES_KEY] if _LOSSES_KEY in d.files else np.zeros((0,), dtype=np.float64)
+        model = {k: d[k] for k in d.files if k not in (_META_KEY, _LOSSES_KEY)}
+
+    meta["path"] = p.as_posix()
+    return model, meta, losses
+
+
+class CheckpointWriter:
+    """Writes checkpoints on a background thread.
+
+    submit() snapshots the weights and loss history (a memcpy) and returns;
+    serialization and fsync happen off the training thread. At most one
+    snapshot is pending: if the disk falls behind, submit() blocks rather than
+    queueing unbounded copies.
+    """
+
+    def __init__(self, ckpt_dir: str, keep: int = 3):
+        self.ckpt_dir = ckpt_dir
+        self.keep = max(1, int(keep))
+        self._queue: queue.Queue = queue.Queue(maxsize=1)
+        self._error: BaseException | None = None
+        self._thread = threading.Thread(target=self._run, name="checkpoint-writer", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            model, meta, losses = item
+            try:
+                save_checkpoint(checkpoint_path(self.ckpt_dir, meta["step"]).as_posix(), model, meta, losses)
+                for old in list_checkpoints(self.ckpt_dir)[: -self.keep]:
+                    old.unlink(missing_ok=True)
+            except BaseException as e:
+                self._error = e
+
+    def submit(self, model: dict[str, np.ndarray], meta: dict, losses: list[float] | None = None) -> None:
+        if self._error is not None:
+            raise SystemExit(f"[ERR] Checkpoint write failed: {self._error}")
+
+        snapshot = {k: np.array(v, copy=True) for k, v in model.items()}
+        loss_arr = np.asarray(losses, dtype=np.float64) if losses is not None else None
+        self._queue.put((snapshot, dict(meta), loss_arr))
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._thread.join()
+        if self._error is not None:
+            raise SystemExit(f"[ERR] Checkpoint write failed: {self._error}")
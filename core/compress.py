@@ -0,0 +1,383 @@
+from __future__ import annotations
+
+import argparse
+import json
+import time
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+
+from core.model import CTX_LEN
+
+# Low-rank artifacts store W ~= W_u @ W_v for these weights (see expand_low_rank).
+# This only shrinks the file: the factors are multiplied back on load.
+LOW_RANK_KEYS = ("W1", "W2")
+
+# Rows of profiling windows run per chunk; bounds the [rows, H] and [rows, V] scratch.
+PROFILE_CHUNK = 4096
+
+
+def expand_low_rank(model: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+    # Multiplies stored factors back into dense weights; other arrays pass through.
+    # Decoding reads W1 through the position tables, and at H <= 128 two thin
+    # matmuls for W2 do not beat one dense [H, V] matmul, so nothing runs factored.
+    out = dict(model)
+    for name in LOW_RANK_KEYS:
+        u, v = f"{name}_u", f"{name}_v"
+        if name not in out and u in out and v in out:
+            out[name] = (out.pop(u).astype(np.float64) @ out.pop(v).astype(np.float64)).astype(np.float32)
+    return out
+
+
+def profile_windows(src_path: str, n_rows: int, seed: int = 0, val_frac: float = 0.1) -> np.ndarray:
+    # [n_rows, CTX_LEN] contexts sampled uniformly from the chunks of tokens.jsonl
+    # outside val(val_frac), so the compression report is measured on unseen text.
+    from core.stream import TokenStream
+    from core.train import is_heldout
+
+    docs = []
+    with open(src_path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            r = json.loads(line)
+            tokens = r.get("tokens")
+            if not isinstance(tokens, list) or len(tokens) < 2:
+                continue
+            if is_heldout(str(r.get("sample_id")), int(r.get("chunk_id", -1)), val_frac):
+                continue
+            docs.append(np.asarray(tokens, dtype=np.uint16))
+    if not docs:
+        raise SystemExit(f"[ERR] No profiling chunks outside val({val_frac:g}) in {src_path}")
+
+    offsets = np.zeros((len(docs) + 1,), dtype=np.int64)
+    np.cumsum([d.shape[0] for d in docs], out=offsets[1:])
+    ts = TokenStream(np.concatenate(docs), offsets)
+    x_ctx, _ = ts.sample(np.random.default_rng(seed), n_rows)
+    return x_ctx
+
+
+def hidden_activations(model: dict[str, np.ndarray], x_ctx: np.ndarray) -> np.ndarray:
+    # ReLU hidden layer [B, H] in float64, via the same position tables as decoding.
+    from core.infer import inference_weights
+
+    w = inference_weights(model)
+    tables = w["tables"]
+    k, v, hidden = tables.shape
+    flat = tables.reshape(-1, hidden)
+    rows = np.asarray(x_ctx, dtype=np.int64) + np.arange(0, k * v, v)
+    h = np.take(flat, rows[:, 0], axis=0).astype(np.float64)
+    for j in range(1, k):
+        h += np.take(flat, rows[:, j], axis=0)
+    h += w["b1"]
+    return np.maximum(h, 0, out=h)
+
+
+def activation_profile(model: dict[str, np.ndarray], x_ctx: np.ndarray, chunk: int = PROFILE_CHUNK) -> dict:
+    """Per-unit statistics of the hidden layer over `x_ctx`.
+
+    impact[j] = std(h_j) * ||W2[j]||: how much unit j moves the logits around
+    their mean. A unit's mean contribution, mean[j] * W2[j], is a constant
+    that pruning folds into b2, so a dead or constant unit has impact 0 and
+    removing it changes no logits.
+    """
+    n = x_ctx.shape[0]
+    hidden = model["b1"].shape[0]
+    s1 = np.zeros((hidden,), dtype=np.float64)
+    s2 = np.zeros((hidden,), dtype=np.float64)
+    active = np.zeros((hidden,), dtype=np.int64)
+    for lo in range(0, n, chunk):
+        h = hidden_activations(model, x_ctx[lo : lo + chunk])
+        s1 += h.sum(axis=0)
+        s2 += (h * h).sum(axis=0)
+        active += np.count_nonzero(h, axis=0)
+
+    mean = s1 / n
+    std = np.sqrt(np.maximum(s2 / n - mean * mean, 0.0))
+    return {
+        "n_rows": int(n),
+        "mean": mean,
+        "std": std,
+        "active_frac": active / n,
+        "impact": std * np.linalg.norm(model["W2"].astype(np.float64), axis=1),
+    }
+
+
+def select_units(profile: dict, keep: int | None = None, min_active: float = 0.0) -> np.ndarray:
+    # Drops units active on fewer than `min_active` of the rows, then the
+    # lowest-impact ones until at most `keep` remain. Returns sorted indices.
+    idx = np.flatnonzero(profile["active_frac"] > min_active)
+    if keep is not None and keep < idx.size:
+        if keep < 1:
+            raise SystemExit("[ERR] keep must be >= 1")
+        order = np.argsort(-profile["impact"][idx], kind="stable")
+        idx = idx[order[:keep]]
+    return np.sort(idx)
+
+
+def prune_hidden(model: dict[str, np.ndarray], keep_idx: np.ndarray, profile: dict) -> dict[str, np.ndarray]:
+    drop = np.setdiff1d(np.arange(model["b1"].shape[0]), keep_idx)
+    w2 = model["W2"].astype(np.float64)
+    b2 = model["b2"].astype(np.float64) + profile["mean"][drop] @ w2[drop]
+    out = dict(model)
+    out["W1"] = np.ascontiguousarray(model["W1"][:, keep_idx])
+    out["b1"] = np.ascontiguousarray(model["b1"][keep_idx])
+    out["W2"] = np.ascontiguousarray(model["W2"][keep_idx])
+    out["b2"] = b2.astype(np.float32)
+    return out
+
+
+def refit_output(
+    ref: dict[str, np.ndarray],
+    pruned: dict[str, np.ndarray],
+    x_ctx: np.ndarray,
+    ridge: float = 1e-4,
+    chunk: int = PROFILE_CHUNK,
+) -> dict[str, np.ndarray]:
+    """Least-squares W2/b2 of the pruned model that best reproduce ref's logits.
+
+    The remaining hidden units are unchanged, so this is a linear regression
+    from their activations (plus a bias column) onto the reference logits,
+    solved from normal equations accumulated chunk by chunk.
+    """
+    hidden = pruned["b1"].shape[0]
+    v = ref["b2"].shape[0]
+    gram = np.zeros((hidden + 1, hidden + 1), dtype=np.float64)
+    cross = np.zeros((hidden + 1, v), dtype=np.float64)
+    w2 = ref["W2"].astype(np.float64)
+    b2 = ref["b2"].astype(np.float64)
+    for lo in range(0, x_ctx.shape[0], chunk):
+        ctx = x_ctx[lo : lo + chunk]
+        z = hidden_activations(ref, ctx) @ w2 + b2
+        h = np.concatenate([hidden_activations(pruned, ctx), np.ones((ctx.shape[0], 1))], axis=1)
+        gram += h.T @ h
+        cross += h.T @ z
+
+    n = x_ctx.shape[0]
+    reg = ridge * n * np.eye(hidden + 1)
+    reg[-1, -1] = 0.0  # the bias is not shrunk
+    sol = np.linalg.solve(gram + reg, cross)
+    out = dict(pruned)
+    out["W2"] = sol[:hidden].astype(np.float32)
+    out["b2"] = sol[hidden].astype(np.float32)
+    return out
+
+
+def low_rank(model: dict[str, np.ndarray], ranks: dict[str, int]) -> dict[str, np.ndarray]:
+    # Truncated SVD: W ~= (U_r * S_r) @ Vt_r, stored as W_u / W_v when that is smaller.
+    out = dict(model)
+    for name, r in ranks.items():
+        if name not in LOW_RANK_KEYS or r <= 0:
+            continue
+        w = model[name].astype(np.float64)
+        if r * (w.shape[0] + w.shape[1]) >= w.size:
+            continue
+        u, s, vt = np.linalg.svd(w, full_matrices=False)
+        del out[name]
+        out[f"{name}_u"] = (u[:, :r] * s[:r]).astype(np.float32)
+        out[f"{name}_v"] = vt[:r].astype(np.float32)
+    return out
+
+
+def compress_model(
+    model: dict[str, np.ndarray],
+    x_ctx: np.ndarray,
+    keep: int | None = None,
+    min_active: float = 0.0,
+    refit: bool = True,
+    rank_w1: int = 0,
+    rank_w2: int = 0,
+) -> tuple[dict[str, np.ndarray], dict]:
+    from core.quantize import is_quantized
+
+    if is_quantized(model):
+        raise SystemExit("[ERR] Compress the float artifact, then quantize the result")
+
+    profile = activation_profile(model, x_ctx)
+    keep_idx = select_units(profile, keep=keep, min_active=min_active)
+    out = prune_hidden(model, keep_idx, profile)
+    if refit and keep_idx.size < model["b1"].shape[0]:
+        out = refit_output(model, out, x_ctx)
+    out = low_rank(out, {"W1": rank_w1, "W2": rank_w2})
+
+    summary = {
+        "profile_rows": profile["n_rows"],
+        "hidden_before": int(model["b1"].shape[0]),
+        "hidden_after": int(keep_idx.size),
+        "dead_units": int(np.count_nonzero(profile["active_frac"] == 0)),
+        "active_frac_min": float(profile["active_frac"].min()),
+        "active_frac_median": float(np.median(profile["active_frac"])),
+        "dropped_impact_share": float(
+            np.delete(profile["impact"], keep_idx).sum() / max(profile["impact"].sum(), 1e-12)
+        ),
+        "low_rank": {k: int(k + "_u" in out and out[k + "_u"].shape[1]) for k in LOW_RANK_KEYS},
+    }
+    return out, summary
+
+
+def default_compressed_path(npz_path: str, hidden: int, rank_w1: int = 0, rank_w2: int = 0) -> Path:
+    p = Path(npz_path)
+    tag = f"h{hidden}"
+    if rank_w1:
+        tag += f"r1-{rank_w1}"
+    if rank_w2:
+        tag += f"r2-{rank_w2}"
+    return p.with_name(f"{p.stem}.{tag}.npz")
+
+
+def compress_artifact(
+    npz_path: str,
+    out_path: str | None = None,
+    tokens_path: str = "data/training/tokens.jsonl",
+    profile_rows: int = 200_000,
+    keep: int | None = None,
+    min_active: float = 0.0,
+    refit: bool = True,
+    rank_w1: int = 0,
+    rank_w2: int = 0,
+    seed: int = 0,
+    val_frac: float = 0.1,
+) -> tuple[Path, dict]:
+    from core.infer import load_model_npz
+
+    model = load_model_npz(npz_path)
+    x_ctx = profile_windows(tokens_path, profile_rows, seed=seed, val_frac=val_frac)
+    out_model, summary = compress_model(
+        model, x_ctx, keep=keep, min_active=min_active, refit=refit, rank_w1=rank_w1, rank_w2=rank_w2
+    )
+
+    out = Path(out_path) if out_path else default_compressed_path(
+        npz_path, summary["hidden_after"], summary["low_rank"]["W1"], summary["low_rank"]["W2"]
+    )
+    out.parent.mkdir(parents=True, exist_ok=True)
+    np.savez(out, **out_model)
+    print(f"[OK] Saved compressed model (hidden {summary['hidden_before']} -> {summary['hidden_after']}) -> {out.as_posix()}")
+    return out, summary
+
+
+def interleaved_median_us(fns: dict[str, Callable[[], object]], repeat: int, rounds: int = 9) -> dict[str, float]:
+    # Median over `rounds` of the mean call time, alternating between the functions
+    # every round so drift in machine load hits all of them alike.
+    for fn in fns.values():
+        fn()  # warm-up
+    times: dict[str, list[float]] = {name: [] for name in fns}
+    for _ in range(rounds):
+        for name, fn in fns.items():
+            t0 = time.perf_counter()
+            for _ in range(repeat):
+                fn()
+            times[name].append((time.perf_counter() - t0) / repeat * 1e6)
+    return {name: float(np.median(t)) for name, t in times.items()}
+
+
+def _latency_us(models: dict[str, dict[str, np.ndarray]], batch: int = 256, repeat: int = 200) -> dict[str, dict]:
+    # Single-token logits (decoding) and batched forward per row (scoring), timed
+    # interleaved across the models.
+    from core.infer import InferenceSession, batch_logits_fn
+
+    x = np.random.default_rng(0).integers(0, 256, size=(batch, CTX_LEN))
+    token_fns, batch_fns = {}, {}
+    for name, model in models.items():
+        session = InferenceSession(model)
+        session.reset("Net sales increased")
+        logits_fn = batch_logits_fn(model)
+        token_fns[name] = session.logits
+        batch_fns[name] = lambda fn=logits_fn: fn(x)
+    token = interleaved_median_us(token_fns, repeat)
+    rows = interleaved_median_us(batch_fns, max(1, repeat // 20))
+    return {name: {"token_us": token[name], f"batch{batch}_row_us": rows[name] / batch} for name in models}
+
+
+def compression_report(float_path: str, comp_path: str, source: str = "val", val_frac: float = 0.1) -> dict:
+    # Held-out perplexity, size and latency of the original and compressed artifacts.
+    from core.evaluate import evaluate_model, is_held_out, load_corpus
+    from core.infer import load_model_npz
+
+    corpus = load_corpus(source, "data/training/batches.jsonl", val_frac)
+    held_out = is_held_out(float_path, source, val_frac)
+    rows, models = {}, {}
+    for name, path in (("original", float_path), ("compressed", comp_path)):
+        model = models[name] = load_model_npz(path)
+        r = evaluate_model(model, corpus)
+        with np.load(path, allow_pickle=False) as d:
+            stored = sum(d[k].size for k in d.files)
+        rows[name] = {
+            "hidden": int(model["b1"].shape[0]),
+            "params": int(stored),
+            "file_bytes": Path(path).stat().st_size,
+            "loss": r["loss"],
+            "ppl": r["ppl"],
+        }
+    for name, lat in _latency_us(models).items():
+        rows[name].update(lat)
+    ref, got = rows["original"], rows["compressed"]
+    return {
+        "corpus": r["corpus"],
+        "n_tokens": r["n_tokens"],
+        "held_out": held_out,
+        **rows,
+        "ppl_change_pct": 100.0 * (got["ppl"] / ref["ppl"] - 1.0),
+        "token_speedup": ref["token_us"] / got["token_us"],
+        "batch_speedup": ref["batch256_row_us"] / got["batch256_row_us"],
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Prune hidden units / low-rank factorize an .npz artifact")
+    ap.add_argument("model", type=str, help="Float .npz artifact")
+    ap.add_argument("--out", type=str, default="", help="Output path (default: <stem>.h<H>[r...].npz)")
+    ap.add_argument("--tokens", type=str, default="data/training/tokens.jsonl", help="Profiling corpus")
+    ap.add_argument("--profile_rows", type=int, default=200_000)
+    ap.add_argument("--keep", type=int, default=0, help="Hidden units to keep (0: all but dead ones)")
+    ap.add_argument("--min_active", type=float, default=0.0, help="Drop units active on <= this fraction")
+    ap.add_argument("--no_refit", action="store_true", help="Skip the least-squares W2/b2 refit")
+    ap.add_argument("--rank_w1", type=int, default=0, help="Truncated SVD rank for W1 (0: dense); shrinks the file only")
+    ap.add_argument("--rank_w2", type=int, default=0, help="Truncated SVD rank for W2 (0: dense); shrinks the file only")
+    ap.add_argument("--source", choices=("val", "gold"), default="val")
+    ap.add_argument("--val_frac", type=float, default=0.1, help="Held-out split, excluded from profiling")
+    ap.add_argument("--report", type=str, default="", help="Optional JSON path for the report")
+    args = ap.parse_args()
+
+    out, summary = compress_artifact(
+        args.model,
+        args.out or None,
+        tokens_path=args.tokens,
+        profile_rows=args.profile_rows,
+        keep=args.keep or None,
+        min_active=args.min_active,
+        refit=not args.no_refit,
+        rank_w1=args.rank_w1,
+        rank_w2=args.rank_w2,
+        val_frac=args.val_frac,
+    )
+    print(
+        f"  profile: {summary['profile_rows']} windows, dead units={summary['dead_units']}, "
+        f"active fraction min={summary['active_frac_min']:.3f} median={summary['active_frac_median']:.3f}, "
+        f"dropped impact share={100 * summary['dropped_impact_share']:.1f}%"
+    )
+
+    r = compression_report(args.model, out.as_posix(), source=args.source, val_frac=args.val_frac)
+    print(f"\n{r['corpus']}{'' if r['held_out'] else ' (in-sample)'}: tokens={r['n_tokens']}")
+    for name in ("original", "compressed"):
+        s = r[name]
+        print(
+            f"  {name:>10}  hidden={s['hidden']:>3}  params={s['params']:>7}  file={s['file_bytes'] / 1024:.0f}KB  "
+            f"ppl={s['ppl']:.3f}  token={s['token_us']:.1f}us  batch={s['batch256_row_us']:.2f}us/row"
+        )
+    print(
+        f"  ppl change {r['ppl_change_pct']:+.2f}%, decode {r['token_speedup']:.2f}x, "
+        f"batched {r['batch_speedup']:.2f}x"
+    )
+    r["summary"] = summary
+
+    if args.report:
+        p = Path(args.report)
+        p.parent.mkdir(parents=True, exist_ok=True)
+        p.write_text(json.dumps(r, indent=2), encoding="utf-8")
+        print(f"\n[OK] Wrote {p.as_posix()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+from __future__ import annotations
+
+import argparse
+import json
+import math
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from core.infer import load_model_npz, text_to_tokens
+from core.model import CTX_LEN, forward
+from core.quantize import forward_quantized, is_quantized
+from core.stream import TokenStream
+from core.train import is_heldout
+
+BOS = 256
+EOS = 257
+
+GOLD_DIR = Path("data/gold")
+MANIFEST_PATH = Path("data/training/manifest.jsonl")
+
+# Target position within its document/window: [0,16) has BOS-padded context.
+POSITION_BUCKETS = (CTX_LEN, 64, 256, 1024)
+
+DEFAULT_MEMORY_MB = 64
+
+
+class EvalCorpus:
+    """Documents to score, flattened into one token stream.
+
+    Every position except the first of each doc is a target. `groups[i]` names
+    the group (company) of doc i for the breakdown.
+    """
+
+    def __init__(self, docs: list[np.ndarray], groups: list[str], name: str):
+        if not docs:
+            raise SystemExit(f"[ERR] Empty evaluation corpus: {name}")
+
+        offsets = np.zeros((len(docs) + 1,), dtype=np.int64)
+        np.cumsum([d.shape[0] for d in docs], out=offsets[1:])
+        tokens = np.concatenate(docs).astype(np.uint16)
+
+        self.name = name
+        self.stream = TokenStream(tokens, offsets)
+        self.group_names = sorted(set(groups))
+        index = {g: i for i, g in enumerate(self.group_names)}
+        self.doc_group = np.asarray([index[g] for g in groups], dtype=np.int64)
+
+    @property
+    def n_targets(self) -> int:
+        return self.stream.n_targets
+
+
+def _company(source_file: str) -> str:
+    return source_file.split("_", 1)[0]
+
+
+def _load_manifest() -> dict[str, str]:
+    if not MANIFEST_PATH.exists():
+        return {}
+    out: dict[str, str] = {}
+    with MANIFEST_PATH.open("r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                r = json.loads(line)
+                out[r["sample_id"]] = _company(r["source_file"])
+    return out
+
+
+def load_val_corpus(batches_path: str, val_frac: float = 0.1) -> EvalCorpus:
+    # Rows of batches.jsonl whose chunk falls in the held-out split (core.train.is_heldout).
+    p = Path(batches_path)
+    if not p.exists():
+        raise SystemExit(f"[ERR] Missing: {p.as_posix()}")
+
+    companies = _load_manifest()
+    docs: list[np.ndarray] = []
+    groups: list[str] = []
+
+    with p.open("r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+
+            r = json.loads(line)
+            x = r.get("x")
+            y = r.get("y")
+            if not isinstance(x, list) or not isinstance(y, list) or not x or len(x) != len(y):
+                continue
+            if not is_heldout(str(r.get("sample_id")), int(r.get("chunk_id", -1)), val_frac):
+                continue
+
+            docs.append(np.asarray(x + [y[-1]], dtype=np.int64))
+            groups.append(companies.get(str(r.get("sample_id")), "unknown"))
+
+    return EvalCorpus(docs, groups, name=f"val({val_frac:g})")
+
+
+def load_gold_corpus(gold_dir: str = GOLD_DIR.as_posix()) -> EvalCorpus:
+    files = sorted(Path(gold_dir).glob("*.txt"))
+    if not files:
+        raise SystemExit(f"[ERR] No .txt files in {gold_dir}")
+
+    docs = [np.asarray([BOS, *text_to_tokens(f.read_text(encoding="utf-8")), EOS]) for f in files]
+    groups = [_company(f.name) for f in files]
+    return EvalCorpus(docs, groups, name="gold")
+
+
+def chunk_rows(model: dict[str, np.ndarray], memory_mb: float) -> int:
+    # Rough per-row footprint of forward + log-softmax: ids, embeddings, hidden, logits (f32 + f64).
+    d = model["W_embed_q" if is_quantized(model) else "W_embed"].shape[1]
+    hidden = model["b1"].shape[0]
+    v = model["b2"].shape[0]
+    per_row = 4 * CTX_LEN * (2 + d) + 4 * 2 * hidden + 4 * v + 8 * 2 * v
+    return max(1, int(memory_mb * 1024 * 1024) // per_row)
+
+
+def token_nll(model: dict[str, np.ndarray], x_ctx: np.ndarray, targets: np.ndarray) -> np.ndarray:
+    # Exact per-row negative log-likelihood in float64.
+    logits = forward_quantized(model, x_ctx) if is_quantized(model) else forward(model, x_ctx)[0]
+    z = logits.astype(np.float64)
+    z -= z.max(axis=1, keepdims=True)
+    lse = np.log(np.exp(z).sum(axis=1))
+    return lse - z[np.arange(z.shape[0]), targets]
+
+
+def _bucket_labels() -> list[str]:
+    edges = (0, *POSITION_BUCKETS)
+    labels = [f"{lo}-{hi - 1}" for lo, hi in zip(edges[:-1], edges[1:])]
+    return labels + [f"{edges[-1]}+"]
+
+
+def _group_stats(nll_sum: np.ndarray, count: np.ndarray, names: list[str]) -> dict[str, dict]:
+    out: dict[str, dict] = {}
+    for name, s, n in zip(names, nll_sum, count):
+        if n == 0:
+            continue
+        loss = float(s / n)
+        out[name] = {"n_tokens": int(n), "loss": loss, "ppl": float(math.exp(loss))}
+    return out
+
+
+def evaluate_model(
+    model: dict[str, np.ndarray],
+    corpus: EvalCorpus,
+    memory_mb: float = DEFAULT_MEMORY_MB,
+) -> dict:
+    ts = corpus.stream
+    rows = chunk_rows(model, memory_mb)
+
+    n_groups = len(corpus.group_names)
+    n_buckets = len(POSITION_BUCKETS) + 1
+    g_sum = np.zeros((n_groups,), dtype=np.float64)
+    g_cnt = np.zeros((n_groups,), dtype=np.int64)
+    b_sum = np.zeros((n_buckets,), dtype=np.float64)
+    b_cnt = np.zeros((n_buckets,), dtype=np.int64)
+
+    # Walk every target position in order, `rows` at a time.
+    for lo in range(0, ts.n_targets, rows):
+        u = np.arange(lo, min(lo + rows, ts.n_targets), dtype=np.int64)
+        doc = np.searchsorted(ts.target_offsets, u, side="right") - 1
+        rel = u - ts.target_offsets[doc]
+        pos = ts.offsets[doc] + 1 + rel
+
+        x_ctx, targets = ts.windows(pos)
+        nll = token_nll(model, x_ctx, targets)
+
+        grp = corpus.doc_group[doc]
+        bkt = np.searchsorted(np.asarray(POSITION_BUCKETS), rel, side="right")
+        g_sum += np.bincount(grp, weights=nll, minlength=n_groups)
+        g_cnt += np.bincount(grp, minlength=n_groups)
+        b_sum += np.bincount(bkt, weights=nll, minlength=n_buckets)
+        b_cnt += np.bincount(bkt, minlength=n_buckets)
+
+    n = int(g_cnt.sum())
+    loss = float(g_sum.sum() / n)
+    return {
+        "corpus": corpus.name,
+        "n_tokens": n,
+        "loss": loss,
+        "ppl": float(math.exp(loss)),
+        "by_company": _group_stats(g_sum, g_cnt, corpus.group_names),
+        "by_position": _group_stats(b_sum, b_cnt, _bucket_labels()),
+    }
+
+
+def load_corpus(source: str, batches_path: str, val_frac: float) -> EvalCorpus:
+    if source == "val":
+        return load_val_corpus(batches_path, val_frac=val_frac)
+    if source == "gold":
+        return load_gold_corpus()
+    raise SystemExit(f"[ERR] Unknown eval source: {source}")
+
+
+def artifact_holdout(model_path: str) -> float | None:
+    # Holdout fraction recorded in the training history (<stem>.json or <stem>.history.json).
+    # Derived artifacts (<stem>.int8.npz, <stem>.h96.npz) share their source's history.
+    p = Path(model_path)
+    stem = p.name.split(".")[0]
+    for suffix in (".json", ".history.json"):
+        h = p.with_name(stem + suffix)
+        if h.exists():
+            return float(json.loads(h.read_text(encoding="utf-8")).get("holdout", 0.0))
+    return None
+
+
+def is_held_out(model_path: str, source: str, val_frac: float) -> bool:
+    # Whether the artifact never trained on the `source` corpus; warns when it did.
+    name = Path(model_path).name
+    if source == "gold":
+        # prep/00_build_dataset builds the training samples from the gold MD&A files.
+        print(f"[WARN] {name}: gold documents are training data; gold results are in-sample")
+        return False
+    holdout = artifact_holdout(model_path)
+    if holdout is None:
+        print(f"[WARN] {name}: no training history; cannot confirm val({val_frac:g}) is held out")
+        return False
+    if holdout < val_frac:
+        # is_heldout splits are nested: val(f) is held out whenever f <= the training holdout.
+        print(f"[WARN] {name} was trained with holdout={holdout:g}; val({val_frac:g}) results are in-sample")
+        return False
+    return True
+
+
+def _evaluate_job(model_path: str, source: str, batches_path: str, val_frac: float, memory_mb: float) -> dict:
+    model = load_model_npz(model_path)
+    corpus = load_corpus(source, batches_path, val_frac)
+    result = evaluate_model(model, corpus, memory_mb=memory_mb)
+    result["artifact"] = Path(model_path).name
+    result["held_out"] = is_held_out(model_path, source, val_frac)
+    return result
+
+
+def evaluate_artifacts(
+    model_paths: list[str],
+    source: str = "val",
+    batches_path: str = "data/training/batches.jsonl",
+    val_frac: float = 0.1,
+    memory_mb: float = DEFAULT_MEMORY_MB,
+    jobs: int = 1,
+) -> list[dict]:
+    # memory_mb is the budget per job; jobs > 1 evaluates artifacts in parallel processes.
+    args = [(p, source, batches_path, val_frac, memory_mb) for p in model_paths]
+    if jobs <= 1 or len(model_paths) <= 1:
+        return [_evaluate_job(*a) for a in args]
+
+    with ProcessPoolExecutor(max_workers=min(jobs, len(model_paths))) as ex:
+        futures = [ex.submit(_evaluate_job, *a) for a in args]
+        return [f.result() for f in futures]
+
+
+def _print_result(r: dict) -> None:
+    tag = "" if r["held_out"] else " (in-sample)"
+    print(f"\n{r['artifact']} on {r['corpus']}{tag}: tokens={r['n_tokens']} loss={r['loss']:.4f} ppl={r['ppl']:.2f}")
+    for title, key in (("company", "by_company"), ("position", "by_position")):
+        for name, s in r[key].items():
+            print(f"  {title:>8} {name:>10}  n={s['n_tokens']:>7}  loss={s['loss']:.4f}  ppl={s['ppl']:.2f}")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Exact held-out loss/perplexity for .npz artifacts")
+    ap.add_argument("models", nargs="*", help="Model .npz paths (default: every data/artifacts/*.npz)")
+    ap.add_argument("--source", choices=("val", "gold"), default="val")
+    ap.add_argument("--batches", type=str, default="data/training/batches.jsonl")
+    ap.add_argument("--val_frac", type=float, default=0.1)
+    ap.add_argument("--memory_mb", type=float, default=DEFAULT_MEMORY_MB)
+    ap.add_argument("--jobs", type=int, default=1)
+    ap.add_argument("--out", type=str, default="", help="Optional JSON output path")
+    args = ap.parse_args()
+
+    models = args.models or [p.as_posix() for p in sorted(Path("data/artifacts").glob("*.npz"))]
+    if not models:
+        raise SystemExit("[ERR] No .npz models to evaluate")
+
+    results = evaluate_artifacts(
+        models,
+        source=args.source,
+        batches_path=args.batches,
+        val_frac=args.val_frac,
+        memory_mb=args.memory_mb,
+        jobs=args.jobs,
+    )
+    for r in results:
+        _print_result(r)
+
+    if args.out:
+        out = Path(args.out)
+        out.parent.mkdir(parents=True, exist_ok=True)
+        out.write_text(json.dumps(results, indent=2), encoding="utf-8")
+        print(f"\n[OK] Wrote {out.as_posix()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,64 @@
 # core/infer.py
 from __future__ import annotations
 
+import codecs
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
 from pathlib import Path
+from typing import Callable, Iterator, Sequence
 
 import numpy as np
 
+from core.compress import expand_low_rank
 from core.model import CTX_LEN, VOCAB_SIZE, forward
+from core.ngram import NGramDraft
+from core.quantize import QUANT_AXES, dequantize_model, forward_quantized, is_quantized
+from core.result_cache import ResultCache, result_key
+from core.sampling import SamplingWorkspace
+from core.stop import StopSequences, stop_sequences
 
 BOS = 256
 EOS = 257
 
+# Output scaffold of prep/00_build_dataset.format_output, as decoding segments:
+# ("text", s) is appended without a forward, ("line",) is one sampled line,
+# ("bullets", lo, hi) is lo..hi "- " lines then a blank line, ("choice", opts)
+# samples one of opts restricted byte by byte.
+SUMMARY_TONES = ("positive", "negative", "mixed")
+SUMMARY_TEMPLATE: tuple[tuple, ...] = (
+    ("text", "<BEGIN_OUTPUT>\nBusiness:\n"),
+    ("line",),
+    ("text", "\nHighlights:\n"),
+    ("bullets", 1, 3),
+    ("text", "Risks:\n"),
+    ("bullets", 1, 2),
+    ("text", "Tone: "),
+    ("choice", SUMMARY_TONES),
+    ("text", "\n###\n\n<END_OUTPUT>\n"),
+)
+
+_NL = 10
+
 _REQUIRED_KEYS = {"W_embed", "W1", "b1", "W2", "b2"}
+_REQUIRED_QUANT_KEYS = {"b1", "b2"} | {f"{k}_{s}" for k in QUANT_AXES for s in ("q", "scale")}
+
+# Batch size from which forward_tables gathers position by position.
+_GATHER_LOOP_ROWS = 128
+
+# Working-set budget of one score_batch chunk (windows, hidden rows, logits).
+SCORE_MEMORY_MB = 64
+
+# id(model) -> _ModelEntry; a few models at most are live at once. Entries hold weak
+# references to the weight arrays, so a dropped model is not kept alive by the cache.
+_TABLE_CACHE: OrderedDict[int, "_ModelEntry"] = OrderedDict()
+_TABLE_LOCK = threading.Lock()
+# ids whose arrays were garbage collected; purged on the next lookup.
+_TABLE_DEAD: list[int] = []
+# Elements sampled from each writeable array to notice in-place weight updates.
+_STAMP_SAMPLES = 256
+_TABLE_CACHE_SIZE = 8
 
 
 def load_model_npz(path: str) -> dict[str, np.ndarray]:
@@ -19,15 +67,187 @@ def load_model_npz(path: str) -> dict[str, np.ndarray]:
         raise SystemExit(f"[ERR] Missing model: {p.as_posix()}")
 
     with np.load(p, allow_pickle=False) as d:
-        model = {k: d[k].astype(np.float32, copy=False) for k in d.files}
+        # int8 weights of a quantized artifact (core.quantize) stay int8.
+        model = {k: d[k] if k.endswith("_q") else d[k].astype(np.float32, copy=False) for k in d.files}
 
-    missing = _REQUIRED_KEYS.difference(model.keys())
+    # Low-rank artifacts (core.compress) store W1/W2 as factors; decoding uses them dense.
+    model = expand_low_rank(model)
+
+    required = _REQUIRED_QUANT_KEYS if is_quantized(model) else _REQUIRED_KEYS
+    missing = required.difference(model.keys())
     if missing:
         raise SystemExit(f"[ERR] model missing key(s): {sorted(missing)}")
 
+    if not is_quantized(model):
+        _check_shapes(model, p)
+    # Read-only, so an in-place update fails loudly instead of leaving cached tables stale.
+    for v in model.values():
+        v.setflags(write=False)
     return model
 
 
+def _check_shapes(model: dict[str, np.ndarray], p: Path) -> None:
+    # Hidden width may differ from HIDDEN_DIM (pruned artifacts); the rest must line up.
+    v, d = model["W_embed"].shape
+    h = model["b1"].shape[0]
+    expected = {"W1": (CTX_LEN * d, h), "b1": (h,), "W2": (h, v), "b2": (v,)}
+    bad = [f"{k}{model[k].shape}!={shape}" for k, shape in expected.items() if model[k].shape != shape]
+    if bad:
+        raise SystemExit(f"[ERR] inconsistent weight shapes in {p.as_posix()}: {', '.join(bad)}")
+
+
+def model_fingerprint(model: dict[str, np.ndarray], keys: tuple[str, ...] | None = None) -> str:
+    # Content hash of the weights (not of the file), so in-place updates change it.
+    h = hashlib.blake2b(digest_size=16)
+    for k in sorted(keys if keys is not None else model.keys()):
+        v = np.ascontiguousarray(model[k])
+        h.update(k.encode("utf-8"))
+        h.update(str((v.dtype.str, v.shape)).encode("utf-8"))
+        h.update(memoryview(v).cast("B"))
+    return h.hexdigest()
+
+
+def build_position_tables(model: dict[str, np.ndarray]) -> np.ndarray:
+    # x @ W1 over the concatenated context splits into one [V, H] table per position:
+    # tables[k] = W_embed @ W1[k*D:(k+1)*D], so h_pre = sum_k tables[k, ctx[k]] + b1.
+    w_embed = model["W_embed"]
+    w1 = model["W1"]
+    d = w_embed.shape[1]
+    k = w1.shape[0] // d
+    w1_pos = w1.reshape(k, d, w1.shape[1])
+    return np.matmul(w_embed[None, :, :], w1_pos).astype(np.float32, copy=False)  # [K, V, H]
+
+
+def build_inference_weights(model: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+    # The output layer runs in float64 and is rounded back to float32: BLAS gives
+    # slightly different float32 sums for a [1, H] and a [B, H] matmul, and the
+    # rounding keeps batched and single-sequence logits bit-identical. int8
+    # artifacts are dequantized once here, so decoding never converts int8 per step.
+    if is_quantized(model):
+        model = dequantize_model(model)
+    return {
+        "tables": build_position_tables(model),
+        "b1": model["b1"].copy(),
+        "W2": model["W2"].astype(np.float64),
+        "b2": model["b2"].astype(np.float64),
+    }
+
+
+def inference_weights(model: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+    """Position tables and float64 output layer, rebuilt only when the weights change.
+
+    Lookups are keyed by id(model) and checked against a cheap stamp of the
+    weights: the array objects, their buffers and, for writeable arrays, a
+    strided sample of their values (load_model_npz returns read-only arrays).
+    An update the sample cannot see needs invalidate_tables().
+    """
+    entry = _model_entry(model)
+    if entry.weights is None:
+        entry.weights = build_inference_weights(model)
+    return entry.weights
+
+
+def weights_fingerprint(model: dict[str, np.ndarray]) -> str:
+    # Content hash keying the logit and result caches, recomputed only when the stamp changes.
+    entry = _model_entry(model)
+    if entry.fingerprint is None:
+        entry.fingerprint = model_fingerprint(model, keys=entry.keys)
+    return entry.fingerprint
+
+
+def invalidate_tables(model: dict[str, np.ndarray]) -> None:
+    # Forget the derived arrays and fingerprint of a model whose weights changed in place.
+    with _TABLE_LOCK:
+        _TABLE_CACHE.pop(id(model), None)
+
+
+def _weights_keys(model: dict[str, np.ndarray]) -> tuple[str, ...]:
+    return tuple(sorted(model.keys() if is_quantized(model) else _REQUIRED_KEYS))
+
+
+def _weights_stamp(model: dict[str, np.ndarray], keys: tuple[str, ...]) -> tuple:
+    stamp = []
+    for k in keys:
+        a = model[k]
+        item = (k, a.__array_interface__["data"][0], a.shape, a.dtype.str, a.flags.writeable)
+        if a.flags.writeable:
+            flat = a.reshape(-1)
+            item += (flat[:: max(1, flat.size // _STAMP_SAMPLES)].tobytes(),)
+        stamp.append(item)
+    return tuple(stamp)
+
+
+class _ModelEntry:
+    __slots__ = ("keys", "refs", "stamp", "weights", "fingerprint")
+
+    def __init__(self, model: dict[str, np.ndarray], key: int):
+        self.keys = _weights_keys(model)
+        self.refs = [weakref.ref(model[k], lambda _, key=key: _TABLE_DEAD.append(key)) for k in self.keys]
+        self.stamp = _weights_stamp(model, self.keys)
+        self.weights: dict[str, np.ndarray] | None = None
+        self.fingerprint: str | None = None
+
+    def matches(self, model: dict[str, np.ndarray]) -> bool:
+        # A reused id holds other array objects; an in-place update changes the stamp.
+        if self.keys != _weights_keys(model):
+            return False
+        if any(r() is not model[k] for r, k in zip(self.refs, self.keys)):
+            return False
+        return _weights_stamp(model, self.keys) == self.stamp
+
+
+def _model_entry(model: dict[str, np.ndarray]) -> _ModelEntry:
+    key = id(model)
+    with _TABLE_LOCK:
+        while _TABLE_DEAD:
+            dead = _TABLE_DEAD.pop()
+            hit = _TABLE_CACHE.get(dead)
+            if hit is not None and any(r() is None for r in hit.refs):
+                del _TABLE_CACHE[dead]
+
+        hit = _TABLE_CACHE.get(key)
+        if hit is not None and hit.matches(model):
+            _TABLE_CACHE.move_to_end(key)
+            return hit
+        entry = _ModelEntry(model, key)
+        _TABLE_CACHE[key] = entry
+        _TABLE_CACHE.move_to_end(key)
+        while len(_TABLE_CACHE) > _TABLE_CACHE_SIZE:
+            _TABLE_CACHE.popitem(last=False)
+        return entry
+
+
+def position_tables(model: dict[str, np.ndarray]) -> np.ndarray:
+    return inference_weights(model)["tables"]
+
+
+def forward_tables(weights: dict[str, np.ndarray], token_ids: np.ndarray) -> np.ndarray:
+    # Same logits as core.model.forward via CTX_LEN row gathers instead of the W1 matmul.
+    tables = weights["tables"]
+    k, v, hidden = tables.shape
+    flat = tables.reshape(-1, hidden)
+    rows = np.asarray(token_ids) + np.arange(0, k * v, v)
+    if rows.shape[0] < _GATHER_LOOP_ROWS:
+        h = np.take(flat, rows, axis=0).sum(axis=1)  # [B, H]
+    else:
+        # One [B, H] gather per position, accumulated in the same order as the
+        # sum above, without the cache-unfriendly [B, CTX_LEN, H] temporary.
+        h = np.take(flat, rows[:, 0], axis=0)
+        for j in range(1, k):
+            h += np.take(flat, rows[:, j], axis=0)
+    h += weights["b1"]
+    np.maximum(h, 0, out=h)
+    z = h.astype(np.float64) @ weights["W2"]
+    z += weights["b2"]
+    return z.astype(np.float32)
+
+
+def batch_logits_fn(model: dict[str, np.ndarray]) -> Callable[[np.ndarray], np.ndarray]:
+    # [B, CTX_LEN] -> [B, V] float32 logits whose rows do not depend on B.
+    weights = inference_weights(model)
+    return lambda ctx: forward_tables(weights, ctx)
+
+
 def text_to_tokens(text: str) -> list[int]:
     # Byte-level UTF-8 encoding (0..255).
     b = text.replace("\r\n", "\n").replace("\r", "\n").encode("utf-8", errors="replace")
@@ -40,50 +260,548 @@ def tokens_to_text(tokens: list[int]) -> str:
     return bb.decode("utf-8", errors="replace")
 
 
-def _softmax(logits: np.ndarray) -> np.ndarray:
-    z = logits - logits.max()
-    expz = np.exp(z)
-    return expz / (expz.sum() + 1e-12)
+def _prompt_bytes(prompt: str) -> bytes:
+    # Same normalization as text_to_tokens, without materializing a token list.
+    return prompt.replace("\r\n", "\n").replace("\r", "\n").encode("utf-8", errors="replace")
 
 
-def _sample_from_probs(probs: np.ndarray, rng: np.random.Generator) -> int:
-    return int(rng.choice(probs.shape[0], p=probs))
+class LogitCache:
+    """Bounded LRU of next-token logits keyed by (model fingerprint, context).
 
+    The model is a pure function of its CTX_LEN-token window, so a cached row
+    is exactly the forward it replaces and decoding output does not change.
+    One cache can be shared by sessions of different models: the key carries
+    the weights' content hash. Least recently used rows are evicted once the
+    estimated footprint exceeds `max_mb`.
+    """
 
-def _top_k_filter(probs: np.ndarray, k: int) -> np.ndarray:
-    v = probs.shape[0]
-    if k <= 0 or k >= v:
-        return probs
+    # Per-entry bookkeeping beyond the logits and key bytes: ndarray header,
+    # key tuple and OrderedDict slot.
+    ENTRY_OVERHEAD = 256
 
-    idx = np.argpartition(probs, -k)[-k:]
-    out = np.zeros_like(probs)
-    out[idx] = probs[idx]
+    def __init__(self, max_mb: float = 64.0):
+        if max_mb <= 0:
+            raise SystemExit("[ERR] LogitCache max_mb must be > 0")
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._rows: OrderedDict[tuple[str, bytes], np.ndarray] = OrderedDict()
+        self._lock = threading.Lock()
 
-    s = out.sum()
-    return probs if s <= 0 else (out / s)
+    def __len__(self) -> int:
+        return len(self._rows)
 
+    def get(self, model_key: str, ctx_key: bytes) -> np.ndarray | None:
+        with self._lock:
+            row = self._rows.get((model_key, ctx_key))
+            if row is None:
+                self.misses += 1
+                return None
+            self._rows.move_to_end((model_key, ctx_key))
+            self.hits += 1
+            return row
 
-def _next_token(
-    model: dict[str, np.ndarray],
-    ctx_tokens: list[int],
-    temperature: float,
-    top_k: int,
-    rng: np.random.Generator,
-) -> int:
-    x = np.array([ctx_tokens], dtype=np.int32)
-    logits, _ = forward(model, x)
+    def put(self, model_key: str, ctx_key: bytes, logits: np.ndarray) -> None:
+        row = np.array(logits, dtype=np.float32)
+        size = row.nbytes + len(ctx_key) + self.ENTRY_OVERHEAD
+        with self._lock:
+            old = self._rows.pop((model_key, ctx_key), None)
+            if old is not None:
+                self.bytes -= old.nbytes + len(ctx_key) + self.ENTRY_OVERHEAD
+            self._rows[(model_key, ctx_key)] = row
+            self.bytes += size
+            while self.bytes > self.max_bytes and self._rows:
+                (_, key), dropped = self._rows.popitem(last=False)
+                self.bytes -= dropped.nbytes + len(key) + self.ENTRY_OVERHEAD
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._rows.clear()
+            self.bytes = 0
+
+    def info(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._rows),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+class InferenceSession:
+    """Reusable decoding state for one model.
+
+    Holds the position tables, a CTX_LEN ring-buffer context and preallocated
+    scratch arrays, so decoding a token does not build lists or new
+    activation/probability arrays. The ring is stored twice back to back,
+    which keeps the current window a contiguous view: ring[pos:pos + CTX_LEN].
+    With a LogitCache, logits() looks the window up before running a forward;
+    with a ResultCache, generate() and stream() return stored texts for
+    repeated requests.
+    """
+
+    def __init__(
+        self,
+        model: dict[str, np.ndarray],
+        use_tables: bool = True,
+        cache: LogitCache | None = None,
+        results: ResultCache | None = None,
+    ):
+        # use_tables=False runs the reference forward (forward_quantized for int8 models).
+        self.model = model
+        self.cache = cache
+        self.results = results
+        self.quantized = is_quantized(model)
+        self.weights = inference_weights(model) if use_tables else None
+        # Content hash keying the logit and result caches, hashed at most once per model.
+        self.fingerprint = weights_fingerprint(model) if cache is not None or results is not None else None
+        self.tables = self.weights["tables"] if use_tables else None
+
+        k = CTX_LEN
+        hidden = model["b1"].shape[0]
+        v = model["b2"].shape[0]
+
+        self._ring = np.full((2 * k,), BOS, dtype=np.int32)
+        self._pos = 0
+
+        if self.tables is not None:
+            self._flat_tables = self.tables.reshape(-1, hidden)
+            self._row_base = np.arange(k, dtype=np.int64) * self.tables.shape[1]
+            self._row_idx = np.empty((k,), dtype=np.int64)
+            self._rows = np.empty((k, hidden), dtype=np.float32)
+            self._h64 = np.empty((hidden,), dtype=np.float64)
+        self._h = np.empty((hidden,), dtype=np.float32)
+        self._logits = np.empty((v,), dtype=np.float32)
+        self._scores = np.empty((v,), dtype=np.float64)
+        self._sampler = SamplingWorkspace(v)
+        if self.weights is not None:
+            self._batch_logits = lambda ctx: forward_tables(self.weights, ctx)
+        elif self.quantized:
+            self._batch_logits = lambda ctx: forward_quantized(model, ctx)
+        else:
+            self._batch_logits = lambda ctx: forward(model, ctx)[0]
+
+    def reset(self, prompt: str = "") -> None:
+        # Only the last CTX_LEN prompt bytes can influence the next token.
+        self._ring.fill(BOS)
+        self._pos = 0
+        for t in _prompt_bytes(prompt)[-CTX_LEN:]:
+            self.push(t)
+
+    def push(self, token: int) -> None:
+        k = CTX_LEN
+        self._ring[self._pos] = token
+        self._ring[self._pos + k] = token
+        self._pos = (self._pos + 1) % k
+
+    def context(self) -> np.ndarray:
+        return self._ring[self._pos : self._pos + CTX_LEN]
+
+    def logits(self) -> np.ndarray:
+        if self.cache is None:
+            return self._forward_row(self.context())
+
+        ctx = self.context()
+        key = ctx.tobytes()
+        row = self.cache.get(self.fingerprint, key)
+        if row is not None:
+            np.copyto(self._logits, row)
+            return self._logits
+        logits = self._forward_row(ctx)
+        self.cache.put(self.fingerprint, key, logits)
+        return logits
+
+    def _forward_row(self, ctx: np.ndarray) -> np.ndarray:
+        if self.tables is None and self.quantized:
+            self._logits[...] = forward_quantized(self.model, ctx[None, :])[0]
+            return self._logits
+        if self.tables is None:
+            logits, _ = forward(self.model, ctx[None, :])
+            self._logits[...] = logits[0]
+            return self._logits
+
+        np.add(self._row_base, ctx, out=self._row_idx)
+        np.take(self._flat_tables, self._row_idx, axis=0, out=self._rows)
+        np.sum(self._rows, axis=0, out=self._h)
+        self._h += self.weights["b1"]
+        np.maximum(self._h, 0, out=self._h)
+        np.copyto(self._h64, self._h)
+        np.matmul(self._h64, self.weights["W2"], out=self._scores)
+        self._scores += self.weights["b2"]
+        np.copyto(self._logits, self._scores, casting="same_kind")
+        return self._logits
+
+    def next_token(self, temperature: float, top_k: int, rng: np.random.Generator) -> int:
+        scores = self._scores
+        np.copyto(scores, self.logits())
+        scores[BOS] = -1e9
+        return self._sampler.sample_row(scores, float(temperature), int(top_k), rng)
+
+    def generate(
+        self,
+        prompt: str,
+        max_new_tokens: int = 300,
+        temperature: float = 0.9,
+        top_k: int = 80,
+        seed: int = 123,
+        stop: StopSequences | Sequence[str] | str | None = None,
+    ) -> str:
+        # Decoding also ends when the output ends with a stop sequence, which
+        # is not included in the returned text.
+        rng = np.random.default_rng(seed)
+        matcher = stop_sequences(stop)
+        key = self._result_key(prompt, max_new_tokens, temperature, top_k, seed, matcher)
+        if key is not None:
+            hit = self.results.get(key)
+            if hit is not None:
+                return hit
+        self.reset(prompt)
+
+        out = bytearray()
+        if matcher is None:
+            for _ in range(max_new_tokens):
+                nxt = self.next_token(temperature, top_k, rng)
+                if nxt == EOS:
+                    break
+                out.append(nxt)
+                self.push(nxt)
+            return self._store_result(key, out.decode("utf-8", errors="replace"))
+
+        delta, match_len = matcher.delta, matcher.match_len
+        state = 0
+        for _ in range(max_new_tokens):
+            nxt = self.next_token(temperature, top_k, rng)
+            if nxt == EOS:
+                break
+            out.append(nxt)
+            state = delta[state][nxt]
+            if match_len[state]:
+                del out[-match_len[state] :]
+                break
+            self.push(nxt)
+
+        return self._store_result(key, out.decode("utf-8", errors="replace"))
+
+    def _result_key(
+        self,
+        prompt: str,
+        max_new_tokens: int,
+        temperature: float,
+        top_k: int,
+        seed: int,
+        matcher: StopSequences | None,
+    ) -> str | None:
+        if self.results is None:
+            return None
+        return result_key(
+            self.fingerprint,
+            _prompt_bytes(prompt)[-CTX_LEN:],
+            max_new_tokens,
+            temperature,
+            top_k,
+            seed,
+            stops=matcher.stops if matcher is not None else None,
+            use_tables=self.tables is not None,
+        )
+
+    def _store_result(self, key: str | None, text: str) -> str:
+        if key is not None:
+            self.results.put(key, text)
+        return text
+
+    def stream(
+        self,
+        prompt: str,
+        max_new_tokens: int = 300,
+        temperature: float = 0.9,
+        top_k: int = 80,
+        seed: int = 123,
+        stop: StopSequences | Sequence[str] | str | None = None,
+    ) -> Iterator[str]:
+        # Yields text as soon as it decodes; bytes of an unfinished multi-byte
+        # character, and bytes that may still begin a stop sequence, are held
+        # back. "".join(...) equals generate() for the same args. A stored
+        # result comes back as one piece; a reply closed early is not stored.
+        matcher = stop_sequences(stop)
+        key = self._result_key(prompt, max_new_tokens, temperature, top_k, seed, matcher)
+        pieces = self._stream(prompt, max_new_tokens, temperature, top_k, seed, matcher)
+        if key is None:
+            yield from pieces
+            return
+
+        hit = self.results.get(key)
+        if hit is not None:
+            if hit:
+                yield hit
+            return
+        done: list[str] = []
+        for piece in pieces:
+            done.append(piece)
+            yield piece
+        self.results.put(key, "".join(done))
+
+    def _stream(
+        self,
+        prompt: str,
+        max_new_tokens: int,
+        temperature: float,
+        top_k: int,
+        seed: int,
+        matcher: StopSequences | None,
+    ) -> Iterator[str]:
+        rng = np.random.default_rng(seed)
+        self.reset(prompt)
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+        if matcher is None:
+            for _ in range(max_new_tokens):
+                nxt = self.next_token(temperature, top_k, rng)
+                if nxt == EOS:
+                    break
+                self.push(nxt)
+                piece = decoder.decode(bytes((nxt,)))
+                if piece:
+                    yield piece
+        else:
+            delta, match_len, pending = matcher.delta, matcher.match_len, matcher.pending
+            state = 0
+            held = bytearray()
+            for _ in range(max_new_tokens):
+                nxt = self.next_token(temperature, top_k, rng)
+                if nxt == EOS:
+                    break
+                held.append(nxt)
+                state = delta[state][nxt]
+                if match_len[state]:
+                    del held[-match_len[state] :]
+                    break
+                self.push(nxt)
+                ready = len(held) - pending[state]
+                if ready > 0:
+                    piece = decoder.decode(bytes(held[:ready]))
+                    del held[:ready]
+                    if piece:
+                        yield piece
+            if held:
+                piece = decoder.decode(bytes(held))
+                if piece:
+                    yield piece
+
+        tail = decoder.decode(b"", final=True)
+        if tail:
+            yield tail
 
-    # forward returns [B, V]; here B=1
-    scores = logits[0].astype(np.float64, copy=False)
-    scores[BOS] = -1e9
+    def speculative(
+        self,
+        prompt: str,
+        draft: NGramDraft,
+        max_new_tokens: int = 300,
+        temperature: float = 0.9,
+        top_k: int = 80,
+        seed: int = 123,
+        draft_len: int = 4,
+        min_share: float = 0.5,
+    ) -> tuple[str, dict]:
+        """Draft-and-verify decoding with a cheap proposer (core.ngram).
 
-    if temperature <= 0:
-        return int(np.argmax(scores))
+        Each step takes up to `draft_len` guesses from the draft and scores the
+        current window plus every drafted prefix in one batched forward. Guess d
+        is accepted with probability p(d) (the draft is a point mass, so
+        min(1, p/q) = p); on rejection the token is drawn from p with d removed,
+        and if all guesses pass one more token is sampled from the last row.
+        Every emitted token therefore has exactly the generate() distribution,
+        and greedy decoding (temperature <= 0) returns generate()'s text. With
+        sampling the random stream differs, so the text for a seed does not.
+        Guesses whose n-gram share is below `min_share` are not proposed.
+        """
+        logits_fn = self._batch_logits
+        sampler = self._sampler
+        rng = np.random.default_rng(seed)
+        k = CTX_LEN
 
-    scores = scores / float(temperature)
-    probs = _softmax(scores)
-    probs = _top_k_filter(probs, top_k)
-    return _sample_from_probs(probs, rng)
+        data = _prompt_bytes(prompt)
+        history = list(data[-draft.order :])
+        seq = np.full((k + max(0, draft_len),), BOS, dtype=np.int64)  # window, then the drafts
+        tail = data[-k:]
+        if tail:
+            seq[k - len(tail) : k] = list(tail)
+
+        # Row i of seq[win[:g + 1]] is the window after the first i drafts.
+        win = np.arange(k)[None, :] + np.arange(max(0, draft_len) + 1)[:, None]
+
+        out = bytearray()
+        first_token = None
+        forwards = proposed = accepted = 0
+        done = False
+        while not done and len(out) < max_new_tokens:
+            n = min(draft_len, max_new_tokens - len(out) - 1)
+            drafts = draft.propose(history, n, stop=EOS, min_share=min_share)
+            g = len(drafts)
+            seq[k : k + g] = drafts
+            scores = logits_fn(seq[win[: g + 1]]).astype(np.float64)
+            scores[:, BOS] = -1e9
+            forwards += 1
+            proposed += g
+
+            best = scores.argmax(axis=1).tolist() if temperature <= 0 else None
+            emitted: list[int] = []
+            for i in range(g + 1):
+                row = scores[i]
+                if best is not None:
+                    t = best[i]
+                elif i == g:
+                    t = sampler.sample_row(row, temperature, top_k, rng)
+                else:
+                    p = sampler.probs_row(row, temperature, top_k)
+                    if rng.random() < p[drafts[i]]:
+                        t = drafts[i]
+                    else:
+                        p[drafts[i]] = 0.0
+                        t = sampler.draw_row(p, rng)
+
+                emitted.append(t)
+                hit = i < g and t == drafts[i]
+                accepted += hit
+                if t == EOS or (i < g and not hit):
+                    break
+
+            if first_token is None:
+                first_token = emitted[0]
+            for t in emitted:
+                if t == EOS:
+                    done = True
+                    break
+                out.append(t)
+                history.append(t)
+            del history[0 : max(0, len(history) - draft.order)]
+            window = np.concatenate([seq[:k], np.asarray([t for t in emitted if t != EOS], dtype=np.int64)])
+            seq[:k] = window[-k:]
+
+        stats = {
+            "tokens": len(out),
+            "forwards": forwards,
+            "proposed": proposed,
+            "accepted": accepted,
+            "acceptance_rate": accepted / proposed if proposed else 0.0,
+            "tokens_per_forward": len(out) / forwards if forwards else 0.0,
+            "first_token": first_token,
+        }
+        return out.decode("utf-8", errors="replace"), stats
+
+    def constrained(
+        self,
+        prompt: str,
+        template: Sequence[tuple] = SUMMARY_TEMPLATE,
+        temperature: float = 0.9,
+        top_k: int = 80,
+        seed: int = 123,
+        max_line_tokens: int = 400,
+    ) -> tuple[str, dict]:
+        """Decode into a fixed scaffold (SUMMARY_TEMPLATE by default).
+
+        Scaffold bytes are pushed into the context without a forward, so each
+        one saves a model call. Sampled positions only allow bytes the
+        scaffold permits: free lines cannot contain BOS/EOS or start empty,
+        and a choice (bullet vs. blank line, the Tone value) masks every byte
+        that does not extend one of its options; a byte left with no
+        alternative is forced too. Lines stop at `max_line_tokens` bytes. If
+        the prompt already ends with the start of the scaffold (e.g.
+        "<BEGIN_OUTPUT>\n"), that part is not repeated.
+        """
+        rng = np.random.default_rng(seed)
+        sampler = self._sampler
+        scores = self._scores
+        temperature, top_k = float(temperature), int(top_k)
+        self.reset(prompt)
+
+        out = bytearray()
+        forwards = 0
+
+        def emit(t: int) -> None:
+            out.append(t)
+            self.push(t)
+
+        def sample(allowed: np.ndarray | None, banned: tuple[int, ...]) -> int:
+            nonlocal forwards
+            forwards += 1
+            np.copyto(scores, self.logits())
+            if allowed is not None:
+                keep = scores[allowed]
+                scores.fill(-1e9)
+                scores[allowed] = keep
+            for b in banned:
+                scores[b] = -1e9
+            return sampler.sample_row(scores, temperature, top_k, rng)
+
+        def line() -> None:
+            for i in range(max_line_tokens):
+                t = sample(None, (BOS, EOS, _NL) if i == 0 else (BOS, EOS))
+                emit(t)
+                if t == _NL:
+                    return
+            emit(_NL)
+
+        def choose(options: Sequence[bytes]) -> bytes:
+            picked = b""
+            live = [o for o in options if o]
+            while not any(o == picked for o in live):
+                nxt = sorted({o[len(picked)] for o in live})
+                t = nxt[0] if len(nxt) == 1 else sample(np.asarray(nxt, dtype=np.int64), ())
+                emit(t)
+                picked += bytes((t,))
+                live = [o for o in live if o.startswith(picked)]
+            return picked
+
+        segments = list(template)
+        skip = 0
+        if segments and segments[0][0] == "text":
+            # Longest prompt suffix that is a prefix of the first scaffold text.
+            head = _prompt_bytes(segments[0][1])
+            data = _prompt_bytes(prompt)
+            skip = next((n for n in range(min(len(head), len(data)), 0, -1) if data.endswith(head[:n])), 0)
+
+        choice = None
+        for i, seg in enumerate(segments):
+            kind = seg[0]
+            if kind == "text":
+                for t in _prompt_bytes(seg[1])[skip if i == 0 else 0 :]:
+                    emit(t)
+            elif kind == "line":
+                line()
+            elif kind == "bullets":
+                lo, hi = int(seg[1]), int(seg[2])
+                for j in range(hi):
+                    if j >= lo and choose((b"- ", b"\n")) == b"\n":
+                        break
+                    if j < lo:
+                        for t in b"- ":
+                            emit(t)
+                    line()
+                else:
+                    emit(_NL)
+            elif kind == "choice":
+                choice = choose([_prompt_bytes(o) for o in seg[1]]).decode("utf-8", errors="replace")
+            else:
+                raise SystemExit(f"[ERR] Unknown template segment: {kind!r}")
+
+        # Every byte not produced by a forward was forced, i.e. one forward saved.
+        forced = len(out) - forwards
+        stats = {
+            "tokens": len(out),
+            "forwards": forwards,
+            "forced": forced,
+            "forwards_saved": forced,
+            "saved_share": forced / len(out) if out else 0.0,
+            "choice": choice,
+        }
+        return out.decode("utf-8", errors="replace"), stats
 
 
 def generate(
@@ -93,21 +811,283 @@ def generate(
     temperature: float = 0.9,
     top_k: int = 80,
     seed: int = 123,
+    use_tables: bool = True,
+    stop: StopSequences | Sequence[str] | str | None = None,
+    result_cache: ResultCache | None = None,
 ) -> str:
-    rng = np.random.default_rng(seed)
+    # result_cache: an on-disk ResultCache (core.result_cache) to answer repeated requests from.
+    session = InferenceSession(model, use_tables=use_tables, results=result_cache or None)
+    return session.generate(
+        prompt, max_new_tokens=max_new_tokens, temperature=temperature, top_k=top_k, seed=seed, stop=stop
+    )
+
+
+def stream_generate(
+    model: dict[str, np.ndarray],
+    prompt: str,
+    max_new_tokens: int = 300,
+    temperature: float = 0.9,
+    top_k: int = 80,
+    seed: int = 123,
+    use_tables: bool = True,
+    stop: StopSequences | Sequence[str] | str | None = None,
+    result_cache: ResultCache | None = None,
+) -> Iterator[str]:
+    # result_cache: an on-disk ResultCache (core.result_cache) to answer repeated requests from.
+    session = InferenceSession(model, use_tables=use_tables, results=result_cache or None)
+    return session.stream(
+        prompt, max_new_tokens=max_new_tokens, temperature=temperature, top_k=top_k, seed=seed, stop=stop
+    )
+
+
+def _per_row(value, n: int, name: str) -> list:
+    # A scalar applies to every prompt; a sequence gives one value per prompt.
+    if isinstance(value, (list, tuple, np.ndarray)):
+        if len(value) != n:
+            raise SystemExit(f"[ERR] {name} has {len(value)} values for {n} prompts")
+        return list(value)
+    return [value] * n
+
+
+def generate_batch(
+    model: dict[str, np.ndarray],
+    prompts: Sequence[str],
+    max_new_tokens: int | Sequence[int] = 300,
+    temperature: float | Sequence[float] = 0.9,
+    top_k: int | Sequence[int] = 80,
+    seed: int | Sequence[int] = 123,
+    stop: StopSequences | Sequence[str] | str | None = None,
+    result_cache: ResultCache | None = None,
+) -> list[str]:
+    """Decode several prompts together, one [B, CTX_LEN] forward per step.
+
+    Every argument after `prompts` except `stop` is a scalar or one value per
+    prompt; `stop` applies to every row. Each row samples from its own
+    Generator(seed), so output i equals generate(model, prompts[i], ...) with
+    the same per-row settings. Rows that emit EOS, end with a stop sequence
+    or reach their token budget are dropped from the batch. Rows found in
+    the result cache (same keys as generate()) are not decoded at all.
+    """
+    n = len(prompts)
+    budgets = [int(x) for x in _per_row(max_new_tokens, n, "max_new_tokens")]
+    temps = np.asarray(_per_row(temperature, n, "temperature"), dtype=np.float64)
+    ks = np.asarray(_per_row(top_k, n, "top_k"), dtype=np.int64)
+    seeds = [int(s) for s in _per_row(seed, n, "seed")]
+    rngs = [np.random.default_rng(s) for s in seeds]
+    matcher = stop_sequences(stop)
+
+    results = result_cache or None
+    keys: list[str] = []
+    cached: dict[int, str] = {}
+    if results is not None:
+        fp = weights_fingerprint(model)
+        stops = matcher.stops if matcher is not None else None
+        for i, p in enumerate(prompts):
+            keys.append(
+                result_key(
+                    fp,
+                    _prompt_bytes(p)[-CTX_LEN:],
+                    budgets[i],
+                    temps[i],
+                    ks[i],
+                    seeds[i],
+                    stops=stops,
+                    use_tables=True,
+                )
+            )
+            hit = results.get(keys[i])
+            if hit is not None:
+                cached[i] = hit
+
+    logits_fn = batch_logits_fn(model)
+    k, v = CTX_LEN, model["b2"].shape[0]
+
+    # Same double ring as InferenceSession, with every row's window starting
+    # at column 0; all live rows advance one token per step, so the write
+    # position is shared by the whole batch.
+    ring = np.full((n, 2 * k), BOS, dtype=np.int64)
+    for i, p in enumerate(prompts):
+        tail = _prompt_bytes(p)[-k:]
+        if tail:
+            ring[i, k - len(tail) : k] = list(tail)
+    ring[:, k:] = ring[:, :k]
+    pos = 0
 
-    prompt_tokens = text_to_tokens(prompt)
+    out = [bytearray() for _ in range(n)]
+    active = np.asarray([i for i in range(n) if budgets[i] > 0 and i not in cached], dtype=np.int64)
+    ring = ring[active]
+    budget = np.asarray(budgets, dtype=np.int64)[active]
+    temps, ks = temps[active], ks[active]
+    rngs = [rngs[i] for i in active]
+    state = np.zeros((active.size,), dtype=np.int32)
 
-    ctx: list[int] = [BOS] * CTX_LEN
-    for t in prompt_tokens:
-        ctx = (ctx + [int(t)])[-CTX_LEN:]
+    sampler = SamplingWorkspace(v, active.size)
+    steps = 0
+    while active.size:
+        scores = logits_fn(ring[:, pos : pos + k]).astype(np.float64)
+        scores[:, BOS] = -1e9
 
-    gen_tokens: list[int] = []
-    for _ in range(max_new_tokens):
-        nxt = _next_token(model, ctx, temperature=temperature, top_k=top_k, rng=rng)
-        if nxt == EOS:
-            break
-        gen_tokens.append(nxt)
-        ctx = (ctx + [nxt])[-CTX_LEN:]
+        nxt = sampler.sample(scores, temps, ks, rngs)
 
-    return tokens_to_text(gen_tokens)
\ No newline at end of file
+        steps += 1
+        alive = (nxt != EOS) & (steps < budget)
+        for j in np.flatnonzero(nxt != EOS):
+            out[int(active[j])].append(int(nxt[j]))
+        if matcher is not None:
+            state = matcher.table[state, nxt]
+            matched = matcher.match[state]
+            for j in np.flatnonzero(matched):
+                del out[int(active[j])][-int(matched[j]) :]
+            alive &= matched == 0
+
+        ring[:, pos] = nxt
+        ring[:, pos + k] = nxt
+        pos = (pos + 1) % k
+
+        if not alive.all():
+            active = active[alive]
+            ring = ring[alive]
+            budget = budget[alive]
+            state = state[alive]
+            temps, ks = temps[alive], ks[alive]
+            rngs = [r for r, keep in zip(rngs, alive) if keep]
+
+    texts = [cached[i] if i in cached else o.decode("utf-8", errors="replace") for i, o in enumerate(out)]
+    if results is not None:
+        for i, t in enumerate(texts):
+            if i not in cached:
+                results.put(keys[i], t)
+    return texts
+
+
+def speculative_generate(
+    model: dict[str, np.ndarray],
+    prompt: str,
+    draft: NGramDraft,
+    max_new_tokens: int = 300,
+    temperature: float = 0.9,
+    top_k: int = 80,
+    seed: int = 123,
+    draft_len: int = 4,
+    min_share: float = 0.5,
+) -> tuple[str, dict]:
+    session = InferenceSession(model)
+    return session.speculative(
+        prompt,
+        draft,
+        max_new_tokens=max_new_tokens,
+        temperature=temperature,
+        top_k=top_k,
+        seed=seed,
+        draft_len=draft_len,
+        min_share=min_share,
+    )
+
+
+def score_rows(model: dict[str, np.ndarray], memory_mb: float = SCORE_MEMORY_MB) -> int:
+    # Per-row bytes: int64 window and row ids, hidden rows (float32 + float64),
+    # logits (float32 + two float64 copies).
+    hidden = model["b1"].shape[0]
+    v = model["b2"].shape[0]
+    per_row = 16 * CTX_LEN + 16 * hidden + 4 * v + 8 * 2 * v
+    return max(1, int(memory_mb * 1024 * 1024) // per_row)
+
+
+def score_batch(
+    model: dict[str, np.ndarray],
+    texts: Sequence[str],
+    prefix: str | Sequence[str] = "",
+    add_eos: bool = True,
+    memory_mb: float = SCORE_MEMORY_MB,
+) -> list[dict]:
+    """Log-likelihood of each text under the model.
+
+    Each text is scored as its own document, like the gold corpus: the
+    context starts as CTX_LEN BOS tokens, `prefix` (scalar or one per text)
+    conditions the text without being scored, and EOS is scored after the
+    last byte when `add_eos` is set. Windows of all texts are cut from one
+    token array and run together in chunks of score_rows(model, memory_mb)
+    rows, so memory stays bounded by the chunk size plus the token arrays.
+    Returns per text: logprobs (float64, one per scored token), n_tokens,
+    nll (sum), loss (mean) and ppl.
+    """
+    n = len(texts)
+    prefixes = _per_row(prefix, n, "prefix")
+    k = CTX_LEN
+
+    # One uint16 stream: [BOS x CTX_LEN, prefix, text, (EOS)] per document.
+    parts: list[np.ndarray] = []
+    starts = np.zeros((n + 1,), dtype=np.int64)
+    first = np.zeros((n,), dtype=np.int64)
+    for i, (text, pre) in enumerate(zip(texts, prefixes)):
+        head = np.frombuffer(_prompt_bytes(pre), dtype=np.uint8)
+        body = np.frombuffer(_prompt_bytes(text), dtype=np.uint8)
+        doc = np.full((k + head.size + body.size + int(add_eos),), BOS, dtype=np.uint16)
+        doc[k : k + head.size] = head
+        doc[k + head.size : k + head.size + body.size] = body
+        if add_eos:
+            doc[-1] = EOS
+        parts.append(doc)
+        first[i] = k + head.size
+        starts[i + 1] = starts[i] + doc.size
+    stream = np.concatenate(parts) if parts else np.zeros((0,), dtype=np.uint16)
+    del parts
+
+    # Global target positions; the window of target t is stream[t - k : t].
+    counts = starts[1:] - starts[:-1] - first
+    offsets = np.zeros((n + 1,), dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    total = int(offsets[-1])
+    logprobs = np.empty((total,), dtype=np.float64)
+
+    logits_fn = batch_logits_fn(model)
+    cols = np.arange(-k, 0, dtype=np.int64)
+    rows = score_rows(model, memory_mb)
+    for lo in range(0, total, rows):
+        hi = min(total, lo + rows)
+        idx = np.arange(lo, hi, dtype=np.int64)
+        d = np.searchsorted(offsets, idx, side="right") - 1
+        pos = starts[d] + first[d] + (idx - offsets[d])
+
+        ctx = stream[pos[:, None] + cols].astype(np.int64)
+        targets = stream[pos].astype(np.int64)
+
+        z = logits_fn(ctx).astype(np.float64)
+        z -= z.max(axis=1, keepdims=True)
+        picked = z[np.arange(z.shape[0]), targets]
+        np.exp(z, out=z)
+        logprobs[lo:hi] = picked - np.log(z.sum(axis=1))
+
+    out = []
+    for i in range(n):
+        lp = logprobs[offsets[i] : offsets[i + 1]]
+        m = int(lp.size)
+        nll = float(-lp.sum())
+        loss = nll / m if m else 0.0
+        out.append({"logprobs": lp, "n_tokens": m, "nll": nll, "loss": loss, "ppl": float(np.exp(loss))})
+    return out
+
+
+def score_text(
+    model: dict[str, np.ndarray],
+    text: str,
+    prefix: str = "",
+    add_eos: bool = True,
+    memory_mb: float = SCORE_MEMORY_MB,
+) -> dict:
+    return score_batch(model, [text], prefix=prefix, add_eos=add_eos, memory_mb=memory_mb)[0]
+
+
+def constrained_generate(
+    model: dict[str, np.ndarray],
+    prompt: str,
+    template: Sequence[tuple] = SUMMARY_TEMPLATE,
+    temperature: float = 0.9,
+    top_k: int = 80,
+    seed: int = 123,
+    max_line_tokens: int = 400,
+) -> tuple[str, dict]:
+    session = InferenceSession(model)
+    return session.constrained(
+        prompt, template, temperature=temperature, top_k=top_k, seed=seed, max_line_tokens=max_line_tokens
+    )
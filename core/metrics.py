@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import json
+import math
+import time
+from pathlib import Path
+
+import numpy as np
+
+METRICS_FORMAT = "filingpt-metrics-v1"
+
+_BASE_FIELDS = [("step", "<u4"), ("loss", "<f4"), ("wall", "<f4"), ("tok_s", "<f4")]
+
+
+def sidecar_path(path: str) -> Path:
+    return Path(path).with_suffix(".json")
+
+
+def metrics_dtype(extra: tuple[str, ...] = ()) -> np.dtype:
+    return np.dtype(_BASE_FIELDS + [(k, "<f4") for k in extra])
+
+
+class MetricsWriter:
+    """Append-only binary metrics stream: one fixed-size record per step.
+
+    Records ([step, loss, wall, tok_s, *extra], 16 bytes + 4 per extra column)
+    are buffered in a preallocated array and appended to `path` every
+    `flush_every` steps, so memory stays flat however long the run is. A small
+    JSON sidecar (same name, .json suffix) holds the record dtype and a running
+    summary, rewritten on every flush.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        tokens_per_step: int,
+        flush_every: int = 1000,
+        extra: tuple[str, ...] = (),
+        info: dict | None = None,
+        resume_records: int | None = None,
+        wall_offset: float = 0.0,
+    ):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.extra = tuple(extra)
+        self.dtype = metrics_dtype(self.extra)
+        self.info = dict(info or {})
+        self.tokens_per_step = int(tokens_per_step)
+
+        self._buf = np.zeros((max(1, int(flush_every)),), dtype=self.dtype)
+        self._n_buf = 0
+        self.n_records = 0
+
+        self.first_loss: float | None = None
+        self.final_loss: float | None = None
+        self.min_loss = math.inf
+        self.loss_sum = 0.0
+
+        if resume_records is None:
+            self.path.write_bytes(b"")
+        else:
+            # Drop anything written after the checkpoint we resume from.
+            with self.path.open("r+b") as f:
+                f.truncate(int(resume_records) * self.dtype.itemsize)
+            for rec in iter_metrics(self.path.as_posix(), self.dtype):
+                self._update_summary(rec["loss"])
+            self.n_records = int(resume_records)
+
+        self._t0 = time.perf_counter() - float(wall_offset)
+        self._t_last = time.perf_counter()
+        self._f = self.path.open("ab")
+
+    def _update_summary(self, loss: np.ndarray) -> None:
+        if loss.size == 0:
+            return
+        if self.first_loss is None:
+            self.first_loss = float(loss[0])
+        self.final_loss = float(loss[-1])
+        self.min_loss = min(self.min_loss, float(loss.min()))
+        self.loss_sum += float(loss.astype(np.float64).sum())
+
+    @property
+    def wall(self) -> float:
+        return time.perf_counter() - self._t0
+
+    def log(self, step: int, loss: float, **extra: float) -> None:
+        now = time.perf_counter()
+        dt = now - self._t_last
+        self._t_last = now
+
+        rec = self._buf[self._n_buf]
+        rec["step"] = step
+        rec["loss"] = loss
+        rec["wall"] = now - self._t0
+        rec["tok_s"] = self.tokens_per_step / dt if dt > 0 else 0.0
+        for k, v in extra.items():
+            rec[k] = v
+        self._n_buf += 1
+
+        if self._n_buf == self._buf.shape[0]:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._n_buf:
+            chunk = self._buf[: self._n_buf]
+            self._f.write(chunk.tobytes())
+            self._update_summary(chunk["loss"])
+            self.n_records += self._n_buf
+            self._n_buf = 0
+        self._f.flush()
+        self.write_sidecar()
+
+    def summary(self) -> dict:
+        n = self.n_records
+        wall = self.wall
+        return {
+            "n_records": int(n),
+            "first_loss": self.first_loss,
+            "final_loss": self.final_loss,
+            "min_loss": None if n == 0 else float(self.min_loss),
+            "mean_loss": None if n == 0 else float(self.loss_sum / n),
+            "wall_s": float(wall),
+            "tokens_per_s": float(n * self.tokens_per_step / wall) if wall > 0 else 0.0,
+        }
+
+    def write_sidecar(self) -> None:
+        meta = {
+            "format": METRICS_FORMAT,
+            "records": self.path.name,
+            "dtype": [[name, self.dtype[name].str] for name in self.dtype.names],
+            "summary": self.summary(),
+            "info": self.info,
+        }
+        sidecar_path(self.path.as_posix()).write_text(json.dumps(meta, indent=2), encoding="utf-8")
+
+    def close(self) -> None:
+        self.flush()
+        self._f.close()
+
+
+def iter_metrics(path: str, dtype: np.dtype | None = None, chunk: int = 65536):
+    """Yield record arrays from a metrics stream without loading it whole."""
+    p = Path(path)
+    if dtype is None:
+        meta = json.loads(sidecar_path(path).read_text(encoding="utf-8"))
+        dtype = np.dtype([(name, t) for name, t in meta["dtype"]])
+
+    with p.open("rb") as f:
+        while True:
+            raw = f.read(chunk * dtype.itemsize)
+            if not raw:
+                return
+            n = len(raw) // dtype.itemsize
+            yield np.frombuffer(raw[: n * dtype.itemsize], dtype=dtype)
+
+
+def read_metrics(path: str) -> np.ndarray:
+    meta = json.loads(sidecar_path(path).read_text(encoding="utf-8"))
+    dtype = np.dtype([(name, t) for name, t in meta["dtype"]])
+    return np.fromfile(path, dtype=dtype)
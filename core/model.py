@@ -54,13 +54,50 @@ def embed_forward(w_embed: np.ndarray, token_ids: np.ndarray) -> tuple[np.ndarra
     return e, token_ids
 
 
-def embed_backward(de: np.ndarray, token_ids: np.ndarray, vocab_size: int) -> np.ndarray:
+# Below this many rows np.add.at is cheaper than sorting.
+_EMBED_SCATTER_MAX_ROWS = 64
+
+
+def embed_backward_scatter(
+    de: np.ndarray, token_ids: np.ndarray, vocab_size: int, out: np.ndarray | None = None
+) -> np.ndarray:
     # de: [B, K, D]
-    dw = np.zeros((vocab_size, de.shape[-1]), dtype=de.dtype)
+    dw = np.zeros((vocab_size, de.shape[-1]), dtype=de.dtype) if out is None else out
+    if out is not None:
+        dw.fill(0)
     np.add.at(dw, token_ids.reshape(-1), de.reshape(-1, de.shape[-1]))
     return dw
 
 
+def embed_backward_sorted(
+    de: np.ndarray, token_ids: np.ndarray, vocab_size: int, out: np.ndarray | None = None
+) -> np.ndarray:
+    # Segment reduction: a stable sort groups rows by token id (in original order),
+    # then np.add.reduceat sums each group with one contiguous pass.
+    ids = token_ids.reshape(-1)
+    rows = de.reshape(-1, de.shape[-1])
+
+    counts = np.bincount(ids, minlength=vocab_size)
+    order = np.argsort(ids.astype(np.uint16, copy=False), kind="stable")
+    present = np.flatnonzero(counts)
+    starts = np.cumsum(counts)[present] - counts[present]
+
+    dw = np.zeros((vocab_size, de.shape[-1]), dtype=de.dtype) if out is None else out
+    if out is not None:
+        dw.fill(0)
+    dw[present] = np.add.reduceat(rows[order], starts, axis=0)
+    return dw
+
+
+def embed_backward(
+    de: np.ndarray, token_ids: np.ndarray, vocab_size: int, out: np.ndarray | None = None
+) -> np.ndarray:
+    # de: [B, K, D]
+    if token_ids.size <= _EMBED_SCATTER_MAX_ROWS:
+        return embed_backward_scatter(de, token_ids, vocab_size, out=out)
+    return embed_backward_sorted(de, token_ids, vocab_size, out=out)
+
+
 def forward(model: dict[str, np.ndarray], token_ids: np.ndarray) -> tuple[np.ndarray, dict[str, object]]:
     # token_ids: [B, K]
     e, emb_ids = embed_forward(model["W_embed"], token_ids)
@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import numpy as np
+
+from core.stream import TokenStream, load_token_stream
+
+# Tokens are < 512, so each context byte takes 9 bits of an int64 key.
+_BITS = 9
+
+DEFAULT_ORDER = 6
+
+
+class NGramDraft:
+    """Greedy byte n-gram proposer used as the draft model for speculative decoding.
+
+    For every context length 1..order seen at least `min_count` times in the
+    corpus it keeps the most frequent next token and the share of the
+    context's occurrences it accounts for. next() backs off from the
+    longest context to the shortest; the result is a point-mass guess, so the
+    verifier's acceptance rule only needs p(draft).
+    """
+
+    def __init__(self, stream: TokenStream, order: int = DEFAULT_ORDER, min_count: int = 2):
+        if not 1 <= order <= 6:
+            raise SystemExit("[ERR] NGramDraft order must be in [1, 6]")
+        self.order = int(order)
+        self.min_count = int(min_count)
+
+        tokens = np.asarray(stream.tokens, dtype=np.int64)
+        doc_start = np.repeat(stream.offsets[:-1], np.diff(stream.offsets))
+        t = np.arange(tokens.shape[0], dtype=np.int64)
+
+        self._masks = [(1 << (_BITS * o)) - 1 for o in range(self.order + 1)]
+
+        # tables[o - 1]: context key over the o previous tokens -> (next token, share).
+        self.tables: list[dict[int, tuple[int, float]]] = []
+        key = np.zeros_like(tokens)
+        for o in range(1, self.order + 1):
+            valid = t - o >= doc_start
+            prev = np.where(valid, tokens[np.maximum(t - o, 0)], 0)
+            key = key | (prev << (_BITS * (o - 1)))
+            self.tables.append(self._best_next(key[valid], tokens[valid]))
+
+    def _best_next(self, keys: np.ndarray, nxt: np.ndarray) -> dict[int, tuple[int, float]]:
+        pairs, counts = np.unique((keys << _BITS) | nxt, return_counts=True)
+        ctx = pairs >> _BITS
+        ctx_keys, ctx_idx = np.unique(ctx, return_inverse=True)
+        totals = np.bincount(ctx_idx, weights=counts)[ctx_idx]
+        # Highest count first within each context, then keep the first row per context.
+        order = np.lexsort((-counts, ctx))
+        ctx, pairs, counts, totals = ctx[order], pairs[order], counts[order], totals[order]
+        first = np.ones(ctx.shape[0], dtype=bool)
+        first[1:] = ctx[1:] != ctx[:-1]
+        keep = first & (counts >= self.min_count)
+        best = (pairs[keep] & ((1 << _BITS) - 1)).tolist()
+        share = (counts[keep] / totals[keep]).tolist()
+        return dict(zip(ctx[keep].tolist(), zip(best, share)))
+
+    def _key(self, history: list[int] | bytes) -> tuple[int, int]:
+        # Most recent token in the low bits; returns (key, usable context length).
+        tail = history[-self.order :]
+        key = 0
+        for t in tail:
+            key = (key << _BITS) | t
+        return key, len(tail)
+
+    def _lookup(self, key: int, n: int) -> tuple[int, float] | None:
+        # Longest context first; a context unseen at order o is unseen at every longer order.
+        for o in range(n, 0, -1):
+            hit = self.tables[o - 1].get(key & self._masks[o])
+            if hit is not None:
+                return hit
+        return None
+
+    def next(self, history: list[int] | bytes) -> int | None:
+        hit = self._lookup(*self._key(history))
+        return None if hit is None else hit[0]
+
+    def propose(
+        self, history: list[int] | bytes, n: int, stop: int | None = None, min_share: float = 0.0
+    ) -> list[int]:
+        # Up to n chained guesses. Stops early at an unseen context, at `stop`, or
+        # when the guess followed its context in less than `min_share` of the corpus.
+        key, m = self._key(history)
+        full = self._masks[self.order]
+        out: list[int] = []
+        while len(out) < n:
+            hit = self._lookup(key, m)
+            if hit is None or hit[1] < min_share:
+                break
+            t = hit[0]
+            out.append(t)
+            if t == stop:
+                break
+            key = ((key << _BITS) | t) & full
+            m = min(m + 1, self.order)
+        return out
+
+    def info(self) -> dict:
+        return {"order": self.order, "min_count": self.min_count, "contexts": [len(t) for t in self.tables]}
+
+
+def build_ngram_draft(
+    src_path: str = "data/training/tokens.jsonl", order: int = DEFAULT_ORDER, min_count: int = 2
+) -> NGramDraft:
+    return NGramDraft(load_token_stream(src_path), order=order, min_count=min_count)
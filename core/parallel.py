@@ -0,0 +1,195 @@
+from __future__ import annotations
+
+import multiprocessing as mp
+import traceback
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from core.model import CTX_LEN
+from core.train import TrainWorkspace
+
+# The global batch is split into this many gradient slots whatever the worker
+# count, so each slot's gradient (and the fixed-order sum) is the same for any
+# workers <= GRAD_SLOTS.
+GRAD_SLOTS = 8
+
+
+def _flat_layout(model: dict[str, np.ndarray]) -> tuple[dict[str, tuple[int, tuple[int, ...]]], int]:
+    layout: dict[str, tuple[int, tuple[int, ...]]] = {}
+    offset = 0
+    for k, v in model.items():
+        layout[k] = (offset, tuple(v.shape))
+        offset += int(v.size)
+    return layout, offset
+
+
+def _views(flat: np.ndarray, layout: dict[str, tuple[int, tuple[int, ...]]]) -> dict[str, np.ndarray]:
+    out: dict[str, np.ndarray] = {}
+    for k, (offset, shape) in layout.items():
+        size = int(np.prod(shape, dtype=np.int64))
+        out[k] = flat[offset : offset + size].reshape(shape)
+    return out
+
+
+def _worker(
+    conn,
+    params: np.ndarray,
+    grad_slots: np.ndarray,
+    layout: dict[str, tuple[int, tuple[int, ...]]],
+    x_buf: np.ndarray,
+    t_buf: np.ndarray,
+    slots: list[tuple[int, int]],
+) -> None:
+    # Runs under the fork start method: all arrays are views over shared memory
+    # mapped before the fork, so nothing is pickled per step. grad_slots holds
+    # this worker's rows of the [GRAD_SLOTS, P] buffer, one per (lo, hi) slot.
+    try:
+        model = _views(params, layout)
+        grads = [_views(row, layout) for row in grad_slots]
+        workspaces = {n: TrainWorkspace(model, n) for n in {hi - lo for lo, hi in slots}}
+
+        while conn.recv():
+            losses = []
+            for (lo, hi), dst_grads in zip(slots, grads):
+                ws = workspaces[hi - lo]
+                ws.forward(model, x_buf[lo:hi])
+                loss, dlogits = ws.softmax_cross_entropy(t_buf[lo:hi])
+                g = ws.backward(model, dlogits)
+
+                # softmax_cross_entropy averages over the slot; rescale to the global batch.
+                scale = np.float32((hi - lo) / x_buf.shape[0])
+                for k, dst in dst_grads.items():
+                    np.multiply(g[k], scale, out=dst)
+                losses.append(loss)
+
+            conn.send(losses)
+    except Exception:
+        conn.send(traceback.format_exc())
+    finally:
+        conn.close()
+
+
+class DataParallelStep:
+    """Synchronous data-parallel training step over `workers` forked processes.
+
+    The parent samples the global batch (so the sampling sequence matches
+    single-process training for the same seed) and writes it to shared memory.
+    The batch is cut into GRAD_SLOTS contiguous slots independent of the worker
+    count; each worker runs forward/backward slot by slot on its contiguous
+    range and writes each gradient into that slot's row of a shared
+    [GRAD_SLOTS, P] buffer. The parent sums the rows in slot order in float64
+    and applies the SGD update once, so the weights are bit-identical for any
+    worker count up to GRAD_SLOTS.
+    """
+
+    def __init__(self, model: dict[str, np.ndarray], batch_size: int, workers: int):
+        if workers < 2:
+            raise SystemExit("[ERR] DataParallelStep needs workers >= 2")
+        if batch_size < workers:
+            raise SystemExit(f"[ERR] batch_size={batch_size} is smaller than workers={workers}")
+        if "fork" not in mp.get_all_start_methods():
+            raise SystemExit("[ERR] Data-parallel training needs the 'fork' start method")
+
+        self.layout, n_params = _flat_layout(model)
+        self.batch_size = int(batch_size)
+        self.workers = int(workers)
+        n_slots = max(workers, min(GRAD_SLOTS, batch_size))
+
+        f32 = np.dtype(np.float32)
+        i32 = np.dtype(np.int32)
+        self._shm = [
+            SharedMemory(create=True, size=n_params * f32.itemsize),
+            SharedMemory(create=True, size=n_slots * n_params * f32.itemsize),
+            SharedMemory(create=True, size=batch_size * CTX_LEN * i32.itemsize),
+            SharedMemory(create=True, size=batch_size * i32.itemsize),
+        ]
+        self.params = np.ndarray((n_params,), dtype=f32, buffer=self._shm[0].buf)
+        self.grads = np.ndarray((n_slots, n_params), dtype=f32, buffer=self._shm[1].buf)
+        self.x_buf = np.ndarray((batch_size, CTX_LEN), dtype=i32, buffer=self._shm[2].buf)
+        self.t_buf = np.ndarray((batch_size,), dtype=i32, buffer=self._shm[3].buf)
+
+        self.flat_grad = np.empty((n_params,), dtype=np.float64)
+        self.update = np.empty((n_params,), dtype=f32)
+
+        # Move the caller's weights into shared memory; the dict now holds views.
+        shared = _views(self.params, self.layout)
+        for k, v in shared.items():
+            v[...] = model[k]
+            model[k] = v
+
+        bounds = np.linspace(0, batch_size, n_slots + 1).astype(np.int64)
+        self.slots = [(int(bounds[i]), int(bounds[i + 1])) for i in range(n_slots)]
+        owner = np.linspace(0, n_slots, workers + 1).astype(np.int64)
+
+        ctx = mp.get_context("fork")
+        self._conns = []
+        self._procs = []
+        for i in range(workers):
+            a, b = int(owner[i]), int(owner[i + 1])
+            parent, child = ctx.Pipe()
+            p = ctx.Process(
+                target=_worker,
+                args=(child, self.params, self.grads[a:b], self.layout, self.x_buf, self.t_buf, self.slots[a:b]),
+                daemon=True,
+            )
+            p.start()
+            child.close()
+            self._conns.append(parent)
+            self._procs.append(p)
+
+    def __call__(self, model: dict, x_ctx: np.ndarray, targets: np.ndarray, lr: float, prof=None) -> float:
+        self.x_buf[...] = x_ctx
+        self.t_buf[...] = targets
+
+        for conn in self._conns:
+            conn.send(True)
+        if prof is not None:
+            prof.mark("scatter")
+
+        slot_losses: list[float] = []
+        for conn in self._conns:
+            r = conn.recv()
+            if isinstance(r, str):
+                raise SystemExit(f"[ERR] Data-parallel worker failed:\n{r}")
+            slot_losses.extend(r)
+        loss = 0.0
+        for l, (lo, hi) in zip(slot_losses, self.slots):
+            loss += float(l) * (hi - lo)
+        if prof is not None:
+            prof.mark("workers")
+
+        # Fixed slot order in float64: the sum does not depend on how slots map to workers.
+        self.flat_grad[...] = self.grads[0]
+        for row in self.grads[1:]:
+            self.flat_grad += row
+        if prof is not None:
+            prof.mark("allreduce")
+        np.multiply(self.flat_grad, lr, out=self.update, casting="same_kind")
+        self.params -= self.update
+        if prof is not None:
+            prof.mark("sgd_step")
+        return loss / self.batch_size
+
+    def close(self, model: dict) -> None:
+        for conn in self._conns:
+            try:
+                conn.send(False)
+            except (BrokenPipeError, OSError):
+                pass
+        for p in self._procs:
+            p.join(timeout=5)
+            if p.is_alive():
+                p.terminate()
+        for conn in self._conns:
+            conn.close()
+
+        # Hand private copies back to the caller before releasing shared memory.
+        for k in self.layout:
+            model[k] = np.array(model[k], copy=True)
+
+        del self.params, self.grads, self.x_buf, self.t_buf
+        for shm in self._shm:
+            shm.close()
+            shm.unlink()
+        self._shm = []
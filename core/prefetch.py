@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import queue
+import threading
+
+import numpy as np
+
+_DONE = object()
+
+
+class BatchPrefetcher:
+    """Builds training batches on a background thread into a bounded queue.
+
+    The sampler's draws happen on the producer thread in exactly the order the
+    training loop would make them, so a given seed yields the same batches with
+    or without prefetching. Indices for `chunk` steps are drawn together and
+    their context windows gathered in one vectorized call.
+
+    Because the producer runs ahead, `rng` is not the state the consumer is at;
+    with track_rng=True each batch carries the rng state right after its draws,
+    exposed as `rng_state` once that batch is returned by get().
+    """
+
+    def __init__(
+        self,
+        sampler,
+        rng: np.random.Generator,
+        batch_size: int,
+        steps: int,
+        depth: int = 8,
+        chunk: int = 16,
+        track_rng: bool = False,
+    ):
+        self.sampler = sampler
+        self.rng = rng
+        self.batch_size = int(batch_size)
+        self.steps = int(steps)
+        self.chunk = max(1, int(chunk))
+        self.track_rng = bool(track_rng)
+        self.rng_state: dict | None = None
+
+        self._queue: queue.Queue = queue.Queue(maxsize=max(1, int(depth)))
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._produce, name="batch-prefetch", daemon=True)
+        self._thread.start()
+
+    def _put(self, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self) -> None:
+        try:
+            remaining = self.steps
+            while remaining > 0 and not self._stop.is_set():
+                n = min(self.chunk, remaining)
+                states: list | None = [] if self.track_rng else None
+                xs, ts = self.sampler.sample_many(self.rng, self.batch_size, n, states=states)
+                for i in range(n):
+                    if not self._put((xs[i], ts[i], states[i] if states is not None else None)):
+                        return
+                remaining -= n
+            self._put(_DONE)
+        except BaseException as e:  # surfaced to the consumer in get()
+            self._put(e)
+
+    def get(self) -> tuple[np.ndarray, np.ndarray]:
+        item = self._queue.get()
+        if item is _DONE:
+            raise SystemExit("[ERR] Batch prefetcher exhausted")
+        if isinstance(item, BaseException):
+            raise item
+
+        x_ctx, targets, state = item
+        if state is not None:
+            self.rng_state = state
+        return x_ctx, targets
+
+    def close(self) -> None:
+        self._stop.set()
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+        self._thread.join(timeout=5)
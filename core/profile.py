@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+import math
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+# Log-spaced histogram: 4 bins per decade from 1us to 10s.
+_HIST_MIN_EXP = -6
+_HIST_BINS_PER_DECADE = 4
+_HIST_N_BINS = 7 * _HIST_BINS_PER_DECADE
+
+
+def peak_rss_mb() -> float | None:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS, kilobytes on Linux.
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+class PhaseProfiler:
+    """Per-phase wall-time accounting for the training loop.
+
+    The loop calls begin() at the top of a step, mark(name) after each phase
+    (the time since the previous mark is charged to `name`) and end_step() at
+    the bottom. Callers hold None instead of a profiler when profiling is off,
+    so the disabled cost is one `is not None` check per phase.
+    """
+
+    def __init__(self, tokens_per_step: int, trace_memory: bool = False):
+        self.tokens_per_step = int(tokens_per_step)
+        self.trace_memory = bool(trace_memory)
+
+        self.total: dict[str, float] = {}
+        self.count: dict[str, int] = {}
+        self.max: dict[str, float] = {}
+        self.hist: dict[str, list[int]] = {}
+
+        self.steps = 0
+        self._t = 0.0
+        self._t_start = time.perf_counter()
+        self._win_t = self._t_start
+        self._win_steps = 0
+
+        self._peak_traced = 0
+        self._started_tracing = False
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+    def begin(self) -> None:
+        self._t = time.perf_counter()
+
+    def mark(self, name: str) -> None:
+        now = time.perf_counter()
+        dt = now - self._t
+        self._t = now
+
+        if name not in self.total:
+            self.total[name] = 0.0
+            self.count[name] = 0
+            self.max[name] = 0.0
+            self.hist[name] = [0] * _HIST_N_BINS
+
+        self.total[name] += dt
+        self.count[name] += 1
+        if dt > self.max[name]:
+            self.max[name] = dt
+
+        b = int((math.log10(dt) - _HIST_MIN_EXP) * _HIST_BINS_PER_DECADE) if dt > 0 else 0
+        self.hist[name][min(max(b, 0), _HIST_N_BINS - 1)] += 1
+
+    def end_step(self) -> None:
+        self.steps += 1
+        self._win_steps += 1
+
+    def log_suffix(self) -> str:
+        # Rates over the window since the previous log line.
+        now = time.perf_counter()
+        dt = now - self._win_t
+        sps = self._win_steps / dt if dt > 0 else 0.0
+        self._win_t = now
+        self._win_steps = 0
+
+        parts = [f"steps/s={sps:.1f}", f"tok/s={sps * self.tokens_per_step:.0f}"]
+        step_total = sum(self.total.values())
+        if step_total > 0:
+            parts.append(" ".join(f"{k}={100.0 * v / step_total:.0f}%" for k, v in self.total.items()))
+
+        rss = peak_rss_mb()
+        if rss is not None:
+            parts.append(f"peak_rss={rss:.0f}MB")
+        if self.trace_memory:
+            parts.append(f"peak_py={self._traced_peak() / 2**20:.1f}MB")
+        return " ".join(parts)
+
+    def summary(self) -> dict:
+        wall = time.perf_counter() - self._t_start
+        edges = [
+            10.0 ** (_HIST_MIN_EXP + i / _HIST_BINS_PER_DECADE) for i in range(_HIST_N_BINS + 1)
+        ]
+        phases = {
+            k: {
+                "total_s": self.total[k],
+                "mean_ms": 1e3 * self.total[k] / max(1, self.count[k]),
+                "max_ms": 1e3 * self.max[k],
+                "count": self.count[k],
+                "hist": self.hist[k],
+            }
+            for k in self.total
+        }
+        out = {
+            "steps": self.steps,
+            "wall_s": wall,
+            "steps_per_s": self.steps / wall if wall > 0 else 0.0,
+            "tokens_per_s": self.steps * self.tokens_per_step / wall if wall > 0 else 0.0,
+            "peak_rss_mb": peak_rss_mb(),
+            "hist_edges_s": edges,
+            "phases": phases,
+        }
+        if self.trace_memory:
+            out["peak_traced_mb"] = self._traced_peak() / 2**20
+        return out
+
+    def _traced_peak(self) -> int:
+        if tracemalloc.is_tracing():
+            self._peak_traced = max(self._peak_traced, tracemalloc.get_traced_memory()[1])
+        return self._peak_traced
+
+    def close(self) -> None:
+        if self._started_tracing:
+            self._traced_peak()
+            tracemalloc.stop()
+            self._started_tracing = False
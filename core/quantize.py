@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+import argparse
+import json
+from pathlib import Path
+
+import numpy as np
+
+# Weight -> axis reduced when computing its scales. W1/W2 get one scale per
+# output column; W_embed is a lookup table, so each token row is an output.
+QUANT_AXES = {"W_embed": 1, "W1": 0, "W2": 0}
+
+# Rows of an int8 matrix converted per matmul block; bounds the float scratch.
+BLOCK_ROWS = 256
+
+
+def is_quantized(model: dict[str, np.ndarray]) -> bool:
+    return "W1_q" in model
+
+
+def quantize_weight(w: np.ndarray, axis: int) -> tuple[np.ndarray, np.ndarray]:
+    # Symmetric int8: q = round(w / s), s = max|w| / 127 along `axis`.
+    amax = np.abs(w).max(axis=axis)
+    scale = np.where(amax > 0, amax / 127.0, 1.0).astype(np.float32)
+    s = np.expand_dims(scale, axis)
+    q = np.clip(np.rint(w / s), -127, 127).astype(np.int8)
+    return q, scale
+
+
+def quantize_model(model: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+    out: dict[str, np.ndarray] = {}
+    for k, v in model.items():
+        if k in QUANT_AXES:
+            out[f"{k}_q"], out[f"{k}_scale"] = quantize_weight(v, QUANT_AXES[k])
+        else:
+            out[k] = v.astype(np.float32, copy=False)
+    return out
+
+
+def dequantize_model(qmodel: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+    out: dict[str, np.ndarray] = {}
+    for k, v in qmodel.items():
+        if k.endswith("_q"):
+            name = k[:-2]
+            s = np.expand_dims(qmodel[f"{name}_scale"], QUANT_AXES[name])
+            out[name] = (v.astype(np.float32) * s).astype(np.float32)
+        elif not k.endswith("_scale"):
+            out[k] = v
+    return out
+
+
+def _matmul_blocked(x: np.ndarray, q: np.ndarray, block_rows: int) -> np.ndarray:
+    # x @ q for int8 q, converting `block_rows` rows of q at a time (float32 throughout).
+    n = q.shape[0]
+    out = np.zeros((x.shape[0], q.shape[1]), dtype=np.float32)
+    buf = np.empty((min(block_rows, n), q.shape[1]), dtype=np.float32)
+    for r in range(0, n, block_rows):
+        nb = min(block_rows, n - r)
+        np.copyto(buf[:nb], q[r : r + nb])
+        out += x[:, r : r + nb] @ buf[:nb]
+    return out
+
+
+def forward_quantized(
+    model: dict[str, np.ndarray], x_ctx: np.ndarray, block_rows: int = BLOCK_ROWS
+) -> np.ndarray:
+    """Logits [B, V] from int8 weights, dequantized block by block in float32.
+
+    Per-output-channel scales factor out of each matmul (x @ (Q * s) =
+    (x @ Q) * s), so only the int8 matrices are resident. This is the
+    reference path for scoring; decoding uses the position tables that
+    core.infer builds once from the dequantized weights.
+    """
+    ids = np.asarray(x_ctx)
+    b, k = ids.shape
+    e = model["W_embed_q"][ids].astype(np.float32)
+    e *= model["W_embed_scale"][ids][:, :, None]
+    x = e.reshape(b, k * e.shape[2])
+
+    h = _matmul_blocked(x, model["W1_q"], block_rows)
+    h *= model["W1_scale"]
+    h += model["b1"]
+    np.maximum(h, 0, out=h)
+
+    z = _matmul_blocked(h, model["W2_q"], block_rows)
+    z *= model["W2_scale"]
+    z += model["b2"]
+    return z.astype(np.float32, copy=False)
+
+
+def resident_bytes(model: dict[str, np.ndarray]) -> int:
+    return int(sum(v.nbytes for v in model.values()))
+
+
+def default_quantized_path(npz_path: str) -> Path:
+    p = Path(npz_path)
+    return p.with_name(f"{p.stem}.int8.npz")
+
+
+def quantize_artifact(npz_path: str, out_path: str | None = None) -> Path:
+    from core.infer import load_model_npz
+
+    model = load_model_npz(npz_path)
+    if is_quantized(model):
+        raise SystemExit(f"[ERR] Already quantized: {npz_path}")
+
+    out = Path(out_path) if out_path else default_quantized_path(npz_path)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    np.savez(out, **quantize_model(model))
+    print(f"[OK] Saved int8 model -> {out.as_posix()}")
+    return out
+
+
+def drift_report(float_path: str, quant_path: str, source: str = "val", val_frac: float = 0.1) -> dict:
+    # Held-out loss/perplexity of the float and int8 artifacts on the same corpus.
+    from core.evaluate import evaluate_model, is_held_out, load_corpus
+    from core.infer import load_model_npz
+
+    corpus = load_corpus(source, "data/training/batches.jsonl", val_frac)
+    held_out = is_held_out(float_path, source, val_frac)
+    ref_model = load_model_npz(float_path)
+    q_model = load_model_npz(quant_path)
+    ref = evaluate_model(ref_model, corpus)
+    got = evaluate_model(q_model, corpus)
+
+    by_position = {
+        name: {"float_ppl": s["ppl"], "int8_ppl": got["by_position"][name]["ppl"]}
+        for name, s in ref["by_position"].items()
+    }
+    return {
+        "corpus": ref["corpus"],
+        "n_tokens": ref["n_tokens"],
+        "held_out": held_out,
+        "float": {
+            "loss": ref["loss"],
+            "ppl": ref["ppl"],
+            "file_bytes": Path(float_path).stat().st_size,
+            "resident_bytes": resident_bytes(ref_model),
+        },
+        "int8": {
+            "loss": got["loss"],
+            "ppl": got["ppl"],
+            "file_bytes": Path(quant_path).stat().st_size,
+            "resident_bytes": resident_bytes(q_model),
+        },
+        "ppl_drift_pct": 100.0 * (got["ppl"] / ref["ppl"] - 1.0),
+        "by_position": by_position,
+    }
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Post-training int8 quantization of .npz artifacts")
+    ap.add_argument("model", type=str, help="Float .npz artifact")
+    ap.add_argument("--out", type=str, default="", help="Output path (default: <stem>.int8.npz)")
+    ap.add_argument("--source", choices=("val", "gold"), default="val")
+    ap.add_argument("--val_frac", type=float, default=0.1)
+    ap.add_argument("--report", type=str, default="", help="Optional JSON path for the drift report")
+    args = ap.parse_args()
+
+    out = quantize_artifact(args.model, args.out or None)
+    r = drift_report(args.model, out.as_posix(), source=args.source, val_frac=args.val_frac)
+
+    print(f"\n{r['corpus']}{'' if r['held_out'] else ' (in-sample)'}: tokens={r['n_tokens']}")
+    for name in ("float", "int8"):
+        s = r[name]
+        print(
+            f"  {name:>5}  loss={s['loss']:.4f}  ppl={s['ppl']:.3f}  "
+            f"file={s['file_bytes'] / 1024:.0f}KB  resident={s['resident_bytes'] / 1024:.0f}KB"
+        )
+    print(f"  ppl drift: {r['ppl_drift_pct']:+.2f}%")
+    for name, s in r["by_position"].items():
+        print(f"  position {name:>9}  float={s['float_ppl']:.3f}  int8={s['int8_ppl']:.3f}")
+
+    if args.report:
+        p = Path(args.report)
+        p.parent.mkdir(parents=True, exist_ok=True)
+        p.write_text(json.dumps(r, indent=2), encoding="utf-8")
+        print(f"\n[OK] Wrote {p.as_posix()}")
+
+
+if __name__ == "__main__":
+    main()
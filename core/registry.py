@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+from core.infer import load_model_npz
+from core.stream import source_stamp
+
+ARTIFACTS_DIR = Path("data/artifacts")
+
+_RAW_VERSION = 1
+
+
+def default_raw_dir(npz_path: str) -> Path:
+    src = Path(npz_path)
+    return src.parent / "raw" / src.stem
+
+
+def export_raw_weights(npz_path: str, out_dir: str | None = None) -> Path:
+    """Write each weight of an .npz artifact as its own uncompressed .npy.
+
+    .npy data starts on a 64-byte aligned offset, so np.load(mmap_mode="r")
+    maps the file directly: no zip parsing, no copy, and pages are shared
+    through the OS page cache by every process serving the same artifact.
+    """
+    src = Path(npz_path)
+    model = load_model_npz(src.as_posix())
+
+    out = Path(out_dir) if out_dir else default_raw_dir(npz_path)
+    # A private staging dir per call: concurrent exports of one artifact never share files.
+    out.parent.mkdir(parents=True, exist_ok=True)
+    tmp = Path(tempfile.mkdtemp(prefix=f"{out.name}.", suffix=".tmp", dir=out.parent))
+    os.chmod(tmp, 0o755)
+
+    shapes = {}
+    for k, v in model.items():
+        np.save(tmp / f"{k}.npy", np.ascontiguousarray(v))
+        shapes[k] = list(v.shape)
+
+    meta = source_stamp(src, version=_RAW_VERSION)
+    meta["shapes"] = shapes
+    (tmp / "meta.json").write_text(json.dumps(meta, indent=2), encoding="utf-8")
+
+    # Readers holding maps of the old files keep them; new readers see the new dir.
+    shutil.rmtree(out, ignore_errors=True)
+    try:
+        os.replace(tmp, out)
+    except OSError:
+        # Another export of the same artifact landed between rmtree and replace; keep it.
+        shutil.rmtree(tmp, ignore_errors=True)
+    print(f"[OK] Raw weights: {len(shapes)} arrays -> {out.as_posix()}")
+    return out
+
+
+def load_raw_weights(npz_path: str, cache_dir: str | None = None, rebuild: bool = False) -> dict[str, np.ndarray]:
+    # Read-only memory maps of the exported weights, re-exported when the .npz changes.
+    src = Path(npz_path)
+    out = Path(cache_dir) if cache_dir else default_raw_dir(npz_path)
+    meta_path = out / "meta.json"
+
+    stale = rebuild or not meta_path.exists()
+    if not stale:
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        if src.exists():
+            stamp = source_stamp(src, version=_RAW_VERSION)
+            stale = any(meta.get(k) != v for k, v in stamp.items())
+
+    if stale:
+        export_raw_weights(npz_path, out.as_posix())
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+
+    return {k: np.load(out / f"{k}.npy", mmap_mode="r") for k in meta["shapes"]}
+
+
+class ModelRegistry:
+    """Resident models keyed by artifact path, least recently used evicted first.
+
+    get() stats the .npz on every call and reloads the model when its size or
+    mtime changed, so a retrained artifact is picked up without a restart.
+    Callers that cache per-model state (InferenceSession, position tables)
+    should compare the returned dict by identity: a reload returns a new one.
+    """
+
+    def __init__(self, artifacts_dir: str = ARTIFACTS_DIR.as_posix(), capacity: int = 4, mmap: bool = True):
+        if capacity < 1:
+            raise SystemExit("[ERR] ModelRegistry capacity must be >= 1")
+        self.artifacts_dir = Path(artifacts_dir)
+        self.capacity = int(capacity)
+        self.mmap = bool(mmap)
+
+        self._models: OrderedDict[str, tuple[tuple[int, int], dict[str, np.ndarray]]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.loads = 0
+        self.reloads = 0
+        self.evictions = 0
+
+    def available(self) -> list[Path]:
+        if not self.artifacts_dir.exists():
+            return []
+        return sorted(self.artifacts_dir.glob("*.npz"))
+
+    def _resolve(self, name: str) -> Path:
+        p = Path(name)
+        if not p.exists() and not p.is_absolute():
+            p = self.artifacts_dir / p.name
+        if p.suffix != ".npz":
+            p = p.with_suffix(".npz")
+        if not p.exists():
+            raise SystemExit(f"[ERR] Missing model: {p.as_posix()}")
+        return p
+
+    def get(self, name: str) -> dict[str, np.ndarray]:
+        p = self._resolve(name)
+        key = p.resolve().as_posix()
+        st = p.stat()
+        stamp = (int(st.st_size), int(st.st_mtime_ns))
+
+        with self._lock:
+            hit = self._models.get(key)
+            if hit is not None and hit[0] == stamp:
+                self._models.move_to_end(key)
+                self.hits += 1
+                return hit[1]
+
+            model = load_raw_weights(p.as_posix()) if self.mmap else load_model_npz(p.as_posix())
+            if hit is not None:
+                self.reloads += 1
+            else:
+                self.loads += 1
+
+            self._models[key] = (stamp, model)
+            self._models.move_to_end(key)
+            while len(self._models) > self.capacity:
+                self._models.popitem(last=False)
+                self.evictions += 1
+            return model
+
+    def resident(self) -> list[str]:
+        with self._lock:
+            return list(self._models.keys())
+
+    def info(self) -> dict:
+        return {
+            "capacity": self.capacity,
+            "resident": self.resident(),
+            "hits": self.hits,
+            "loads": self.loads,
+            "reloads": self.reloads,
+            "evictions": self.evictions,
+        }
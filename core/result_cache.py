@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+import hashlib
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+# Relative to the directory holding the model artifacts, not the working directory.
+RESULT_CACHE_NAME = Path("cache/results.sqlite")
+RESULT_CACHE_MB = 64
+
+# Bumped when the decoding loop changes in a way that changes outputs.
+_KEY_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    text TEXT NOT NULL,
+    bytes INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used);
+CREATE TABLE IF NOT EXISTS meta (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    total_bytes INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta (id, total_bytes) SELECT 0, COALESCE(SUM(bytes), 0) FROM results;
+"""
+
+
+def result_key(
+    fingerprint: str,
+    prompt_tail: bytes,
+    max_new_tokens: int,
+    temperature: float,
+    top_k: int,
+    seed: int,
+    stops: list[bytes] | None = None,
+    use_tables: bool = True,
+) -> str:
+    # Decoding is deterministic given these: the weights, the last CTX_LEN
+    # prompt bytes (nothing earlier reaches the model) and the sampling setup.
+    h = hashlib.blake2b(digest_size=20)
+    fields = (
+        str(_KEY_VERSION),
+        fingerprint,
+        prompt_tail.hex(),
+        str(int(max_new_tokens)),
+        repr(float(temperature)),
+        str(int(top_k)),
+        str(int(seed)),
+        ",".join(s.hex() for s in stops or []),
+        str(bool(use_tables)),
+    )
+    h.update("\x00".join(fields).encode("ascii"))
+    return h.hexdigest()
+
+
+class ResultCache:
+    """Persistent generate() results in SQLite, evicted least recently used first.
+
+    Entries are whole decoded texts keyed by result_key(). Once the stored
+    text exceeds `max_mb`, the least recently read or written rows are
+    deleted. The running total lives in a one-row meta table, updated in the
+    same transaction as each insert and eviction, so put() never scans the
+    table. WAL mode lets several processes share one file.
+    """
+
+    def __init__(self, path: str, max_mb: float = RESULT_CACHE_MB):
+        if max_mb <= 0:
+            raise SystemExit("[ERR] ResultCache max_mb must be > 0")
+        self.path = Path(path)
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path.as_posix(), timeout=10.0, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self._db.commit()
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            row = self._db.execute("SELECT text FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            with self._db:  # commits, or rolls back if the update raises
+                self._db.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, text: str) -> None:
+        size = len(text.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            # IMMEDIATE takes the write lock up front, so other processes cannot interleave.
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute("SELECT bytes FROM results WHERE key = ?", (key,)).fetchone()
+                self._db.execute(
+                    "INSERT OR REPLACE INTO results (key, text, bytes, last_used) VALUES (?, ?, ?, ?)",
+                    (key, text, size, time.time()),
+                )
+                self._db.execute("UPDATE meta SET total_bytes = total_bytes + ?", (size - (row[0] if row else 0),))
+                total = self._db.execute("SELECT total_bytes FROM meta").fetchone()[0]
+                drop = []
+                if total > self.max_bytes:
+                    for k, b in self._db.execute("SELECT key, bytes FROM results ORDER BY last_used"):
+                        if total <= self.max_bytes:
+                            break
+                        drop.append((k,))
+                        total -= b
+                    self._db.executemany("DELETE FROM results WHERE key = ?", drop)
+                    self._db.execute("UPDATE meta SET total_bytes = ?", (total,))
+                self._db.commit()
+            except BaseException:
+                # Leave the connection outside any transaction, or every later put would fail.
+                self._db.rollback()
+                raise
+            self.evictions += len(drop)
+
+    def clear(self) -> None:
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM results")
+            self._db.execute("UPDATE meta SET total_bytes = 0")
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def info(self) -> dict:
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+            stored = self._db.execute("SELECT total_bytes FROM meta").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "path": self.path.as_posix(),
+            "entries": int(entries),
+            "bytes": int(stored),
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+_DEFAULTS: dict[Path, ResultCache] = {}
+_DEFAULTS_LOCK = threading.Lock()
+
+
+def result_cache_path(model_path: str) -> Path:
+    # <artifact dir>/cache/results.sqlite, wherever the caller runs from.
+    return Path(model_path).resolve().parent / RESULT_CACHE_NAME
+
+
+def default_result_cache(model_path: str) -> ResultCache:
+    # Shared process-wide instance for the artifact's directory, opened on first use.
+    path = result_cache_path(model_path)
+    with _DEFAULTS_LOCK:
+        if path not in _DEFAULTS:
+            _DEFAULTS[path] = ResultCache(path.as_posix())
+        return _DEFAULTS[path]
@@ -1,9 +1,25 @@
-# core/run_train.py
+import sys
+
+from core.checkpoint import clear_checkpoints, list_checkpoints
 from core.train import train
 from core.utils import save_model_npz, save_history_json
 
+CHECKPOINT_DIR = "data/artifacts/checkpoints/filingpt_mlp_financial_v1"
+
+# Chunks kept out of training so core.evaluate --source val is held out (core.train.is_heldout).
+HOLDOUT = 0.1
+
+
+def run(resume: bool = False):
+    # resume=True continues from the latest checkpoint in CHECKPOINT_DIR, if any.
+    resume_from = CHECKPOINT_DIR if resume and list_checkpoints(CHECKPOINT_DIR) else None
+    if resume_from is None:
+        # A fresh run owns the directory: an older run's higher step numbers would
+        # otherwise survive keep-pruning and be picked up by a later --resume.
+        n = clear_checkpoints(CHECKPOINT_DIR)
+        if n:
+            print(f"[OK] Cleared {n} checkpoint(s) of a previous run in {CHECKPOINT_DIR}")
 
-def run():
     model, hist = train(
         batches_path="data/training/batches.jsonl",
         steps=int(100000),
@@ -11,6 +27,11 @@ def run():
         seed=42,
         log_every=10,
         batch_size=32,
+        checkpoint_dir=CHECKPOINT_DIR,
+        checkpoint_every=5000,
+        resume=resume_from,
+        metrics_path="data/artifacts/filingpt_mlp_financial_v1.metrics.bin",
+        holdout=HOLDOUT,
     )
 
     save_model_npz(model, "data/artifacts/filingpt_mlp_financial_v1.npz")
@@ -19,4 +40,4 @@ def run():
 
 
 if __name__ == "__main__":
-    run()
\ No newline at end of file
+    run(resume="--resume" in sys.argv[1:])
@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+from typing import Sequence
+
+import numpy as np
+
+
+class SamplingWorkspace:
+    """Preallocated buffers for temperature/top-k sampling of [B, V] score rows.
+
+    sample() reproduces, row for row, what rng.choice(V, p=probs) draws for the
+    same probabilities: one rng.random() per sampled row, mapped through the
+    normalized cumulative sum with searchsorted(side="right") semantics. It
+    skips choice()'s per-call validation and the per-token temporaries. Rows
+    with temperature <= 0 are greedy and draw nothing from their Generator.
+    Buffers grow on demand and are reused across calls.
+    """
+
+    def __init__(self, vocab_size: int, batch_size: int = 1):
+        self.vocab_size = int(vocab_size)
+        self.batch_size = 0
+        self._grow(max(1, int(batch_size)))
+
+    def _grow(self, b: int) -> None:
+        v = self.vocab_size
+        self.batch_size = b
+        self.probs = np.empty((b, v), dtype=np.float64)
+        self.kept = np.empty((b, v), dtype=np.float64)
+        self.cdf = np.empty((b, v), dtype=np.float64)
+        self.below = np.empty((b, v), dtype=bool)
+        self.row_stat = np.empty((b, 1), dtype=np.float64)
+        self.u = np.empty((b,), dtype=np.float64)
+
+    def sample(
+        self,
+        scores: np.ndarray,
+        temperature: float | Sequence[float] | np.ndarray,
+        top_k: int | Sequence[int] | np.ndarray,
+        rngs: Sequence[np.random.Generator],
+    ) -> np.ndarray:
+        # scores: [B, V] float64 logits (masking already applied); overwritten.
+        b, v = scores.shape
+        if b == 1 and np.ndim(temperature) == 0 and np.ndim(top_k) == 0:
+            return np.asarray([self.sample_row(scores[0], float(temperature), int(top_k), rngs[0])])
+        if b > self.batch_size:
+            self._grow(b)
+
+        temps = np.broadcast_to(np.asarray(temperature, dtype=np.float64), (b,))
+        ks = np.broadcast_to(np.asarray(top_k, dtype=np.int64), (b,))
+        out = np.empty((b,), dtype=np.int64)
+
+        greedy = temps <= 0
+        if greedy.all():
+            np.argmax(scores, axis=1, out=out)
+            return out
+
+        if greedy.any():
+            out[greedy] = np.argmax(scores[greedy], axis=1)
+            rows = np.flatnonzero(~greedy)
+            s = scores[rows]
+        else:
+            rows = None
+            s = scores
+        n = s.shape[0]
+
+        probs = self.probs[:n]
+        stat = self.row_stat[:n]
+        s /= temps[rows, None] if rows is not None else temps[:, None]
+        np.max(s, axis=1, keepdims=True, out=stat)
+        s -= stat
+        np.exp(s, out=probs)
+        np.sum(probs, axis=1, keepdims=True, out=stat)
+        stat += 1e-12
+        probs /= stat
+
+        self._top_k(probs, ks[rows] if rows is not None else ks)
+
+        cdf = self.cdf[:n]
+        below = self.below[:n]
+        u = self.u[:n]
+        np.cumsum(probs, axis=1, out=cdf)
+        cdf /= cdf[:, -1:]
+        for j, i in enumerate(rows if rows is not None else range(n)):
+            u[j] = rngs[i].random()
+        np.less_equal(cdf, u[:, None], out=below)
+        picked = np.count_nonzero(below, axis=1)
+
+        if rows is None:
+            out[...] = picked
+        else:
+            out[rows] = picked
+        return out
+
+    def sample_row(self, scores: np.ndarray, temperature: float, top_k: int, rng: np.random.Generator) -> int:
+        # Single-row decoding path: the same arithmetic on 1-D views, without
+        # the per-row bookkeeping of the batched path.
+        if temperature <= 0:
+            return int(np.argmax(scores))
+        return self.draw_row(self.probs_row(scores, temperature, top_k), rng)
+
+    def probs_row(self, scores: np.ndarray, temperature: float, top_k: int) -> np.ndarray:
+        # Filtered distribution of one row (temperature > 0); a view overwritten by the next call.
+        probs = self.probs[0]
+        scores /= temperature
+        scores -= scores.max()
+        np.exp(scores, out=probs)
+        probs /= probs.sum() + 1e-12
+
+        v = probs.shape[0]
+        if 0 < top_k < v:
+            idx = np.argpartition(probs, -top_k)[-top_k:]
+            kept = self.kept[0]
+            kept.fill(0.0)
+            kept[idx] = probs[idx]
+            total = kept.sum()
+            if total > 0:
+                np.divide(kept, total, out=probs)
+        return probs
+
+    def draw_row(self, probs: np.ndarray, rng: np.random.Generator) -> int:
+        # rng.choice(V, p=probs) without validation; probs need not sum to 1.
+        cdf = self.cdf[0]
+        np.cumsum(probs, out=cdf)
+        cdf /= cdf[-1]
+        return int(cdf.searchsorted(rng.random(), side="right"))
+
+    def _top_k(self, probs: np.ndarray, ks: np.ndarray) -> None:
+        # Keep each row's k largest probabilities (argpartition, like the
+        # single-row path) and renormalize in place. Rows are grouped by k.
+        n, v = probs.shape
+        for k in np.unique(ks):
+            k = int(k)
+            if not 0 < k < v:
+                continue
+            sel = None if n == 1 or bool((ks == k).all()) else np.flatnonzero(ks == k)
+            p = probs if sel is None else probs[sel]
+            m = p.shape[0]
+
+            idx = np.argpartition(p, -k, axis=1)[:, -k:]
+            kept = self.kept[:m]
+            kept.fill(0.0)
+            np.put_along_axis(kept, idx, np.take_along_axis(p, idx, axis=1), axis=1)
+            total = self.row_stat[:m]
+            np.sum(kept, axis=1, keepdims=True, out=total)
+
+            if sel is None:
+                np.divide(kept, total, out=probs, where=total > 0)
+            else:
+                np.divide(kept, total, out=p, where=total > 0)
+                probs[sel] = p
+
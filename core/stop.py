@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import re
+from typing import Sequence
+
+import numpy as np
+
+# Token ids the automaton accepts: 256 bytes plus BOS/EOS (never part of a stop sequence).
+_ALPHABET = 258
+
+_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "\\": "\\"}
+_ESCAPE_RE = re.compile(r"\\([ntr\\])")
+
+
+class StopSequences:
+    """Byte automaton that detects any of several stop sequences incrementally.
+
+    A KMP/Aho-Corasick automaton over the stop strings, with every
+    transition precomputed: the state is the longest suffix of the output
+    that is a prefix of some stop sequence, and each new token is a single
+    table lookup, however many sequences there are and however long they
+    are. match[state] > 0 when a stop sequence ends at the current token
+    (the length of the longest one ending there); depth[state] is how many
+    trailing bytes could still turn into a match, which a streaming caller
+    holds back.
+    """
+
+    def __init__(self, stops: Sequence[str | bytes]):
+        pats = [s.encode("utf-8") if isinstance(s, str) else bytes(s) for s in stops]
+        pats = sorted({p for p in pats if p})
+        if not pats:
+            raise SystemExit("[ERR] StopSequences needs at least one non-empty sequence")
+        self.stops = pats
+
+        # Trie of all prefixes; state 0 is the empty prefix.
+        goto: list[dict[int, int]] = [{}]
+        depth = [0]
+        match = [0]
+        for p in pats:
+            s = 0
+            for b in p:
+                if b not in goto[s]:
+                    goto.append({})
+                    depth.append(depth[s] + 1)
+                    match.append(0)
+                    goto[s][b] = len(goto) - 1
+                s = goto[s][b]
+            match[s] = len(p)
+
+        # Breadth-first failure links, folded into a full transition table.
+        n = len(goto)
+        delta = np.zeros((n, _ALPHABET), dtype=np.int32)
+        fail = [0] * n
+        queue = list(goto[0].values())
+        for b, s in goto[0].items():
+            delta[0, b] = s
+        for s in queue:
+            f = fail[s]
+            match[s] = max(match[s], match[f])
+            delta[s] = delta[f]
+            for b, t in goto[s].items():
+                delta[s, b] = t
+                fail[t] = int(delta[f, b])
+                queue.append(t)
+
+        self.table = delta
+        self.match = np.asarray(match, dtype=np.int32)
+        self.depth = np.asarray(depth, dtype=np.int32)
+        # Plain lists for the per-token path: list indexing beats NumPy scalar access.
+        self.delta = delta.tolist()
+        self.match_len = self.match.tolist()
+        self.pending = self.depth.tolist()
+
+    @property
+    def n_states(self) -> int:
+        return len(self.delta)
+
+    def find(self, data: bytes) -> int:
+        # End offset of the first stop sequence in data, or -1.
+        s = 0
+        for i, b in enumerate(data):
+            s = self.delta[s][b]
+            if self.match_len[s]:
+                return i + 1
+        return -1
+
+
+def stop_sequences(stop: StopSequences | Sequence[str] | str | None) -> StopSequences | None:
+    # Accepts a prebuilt automaton, one string, a list of strings, or None/empty.
+    if stop is None or isinstance(stop, StopSequences):
+        return stop
+    if isinstance(stop, (str, bytes)):
+        stop = [stop]
+    return StopSequences(stop) if any(stop) else None
+
+
+def unescape_stop(text: str) -> str:
+    # Expands \n, \t, \r and \\ typed on a command line; everything else (non-ASCII included) is kept.
+    return _ESCAPE_RE.sub(lambda m: _ESCAPES[m.group(1)], text)
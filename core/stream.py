@@ -0,0 +1,189 @@
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+import numpy as np
+
+from core.model import CTX_LEN, VOCAB_SIZE
+
+BOS = 256
+
+_CACHE_VERSION = 1
+
+
+def _iter_docs(path: Path):
+    # tokens.jsonl rows carry a full "tokens" list; batches.jsonl rows carry x/y,
+    # where y is x shifted by one, so x + [y[-1]] recovers the window.
+    with path.open("r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+
+            r = json.loads(line)
+            tokens = r.get("tokens")
+            if isinstance(tokens, list):
+                if len(tokens) >= 2:
+                    yield tokens
+                continue
+
+            x = r.get("x")
+            y = r.get("y")
+            if isinstance(x, list) and isinstance(y, list) and x and len(x) == len(y):
+                yield x + [y[-1]]
+
+
+def source_stamp(src: Path, version: int = _CACHE_VERSION) -> dict:
+    # Identifies a source file for derived caches; any field changing marks them stale.
+    st = src.stat()
+    return {
+        "version": version,
+        "source": src.as_posix(),
+        "size": int(st.st_size),
+        "mtime_ns": int(st.st_mtime_ns),
+    }
+
+
+def default_cache_dir(src_path: str) -> Path:
+    src = Path(src_path)
+    return src.parent / "stream" / src.stem
+
+
+def build_token_stream(src_path: str, out_dir: str | None = None) -> Path:
+    """Convert tokens.jsonl / batches.jsonl into a flat uint16 stream plus doc offsets."""
+    src = Path(src_path)
+    if not src.exists():
+        raise SystemExit(f"[ERR] Missing: {src.as_posix()}")
+
+    out = Path(out_dir) if out_dir else default_cache_dir(src_path)
+    out.mkdir(parents=True, exist_ok=True)
+
+    # Pass 1: lengths only, so the stream can be written straight into a memmap.
+    lengths = [len(doc) for doc in _iter_docs(src)]
+    if not lengths:
+        raise SystemExit(f"[ERR] No token sequences found in {src.as_posix()}")
+
+    offsets = np.zeros((len(lengths) + 1,), dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    tokens = np.lib.format.open_memmap(
+        out / "tokens.npy", mode="w+", dtype=np.uint16, shape=(int(offsets[-1]),)
+    )
+    for i, doc in enumerate(_iter_docs(src)):
+        arr = np.asarray(doc, dtype=np.int64)
+        if arr.min() < 0 or arr.max() >= VOCAB_SIZE:
+            raise SystemExit(f"[ERR] Token out of range in doc {i} of {src.as_posix()}")
+        tokens[offsets[i] : offsets[i + 1]] = arr
+    tokens.flush()
+    del tokens
+
+    np.save(out / "offsets.npy", offsets)
+
+    meta = source_stamp(src)
+    meta.update({"n_docs": len(lengths), "n_tokens": int(offsets[-1])})
+    (out / "meta.json").write_text(json.dumps(meta, indent=2), encoding="utf-8")
+
+    print(f"[OK] Token stream: {meta['n_tokens']} tokens / {meta['n_docs']} docs -> {out.as_posix()}")
+    return out
+
+
+class TokenStream:
+    """Read-only view over a memory-mapped token stream.
+
+    Docs are stored back to back; doc i spans tokens[offsets[i]:offsets[i+1]].
+    Every position except the first of each doc is a valid target.
+    """
+
+    def __init__(self, tokens: np.ndarray, offsets: np.ndarray):
+        if offsets.ndim != 1 or offsets.shape[0] < 2 or int(offsets[-1]) != tokens.shape[0]:
+            raise SystemExit("[ERR] Token stream offsets do not match the token buffer")
+
+        self.tokens = tokens
+        self.offsets = offsets.astype(np.int64, copy=False)
+
+        n_targets = np.diff(self.offsets) - 1
+        self.target_offsets = np.zeros_like(self.offsets)
+        np.cumsum(n_targets, out=self.target_offsets[1:])
+
+    @property
+    def n_docs(self) -> int:
+        return int(self.offsets.shape[0] - 1)
+
+    @property
+    def n_tokens(self) -> int:
+        return int(self.tokens.shape[0])
+
+    @property
+    def n_targets(self) -> int:
+        return int(self.target_offsets[-1])
+
+    def windows(self, pos: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        # Context = the CTX_LEN tokens before each target, BOS-padded at the doc start.
+        pos = np.asarray(pos, dtype=np.int64)
+        doc = np.searchsorted(self.offsets, pos, side="right") - 1
+        start = self.offsets[doc][:, None]
+
+        ctx_pos = pos[:, None] + np.arange(-CTX_LEN, 0, dtype=np.int64)
+        x_ctx = self.tokens[np.maximum(ctx_pos, start)].astype(np.int32)
+        x_ctx[ctx_pos < start] = BOS
+
+        targets = self.tokens[pos].astype(np.int32)
+        return x_ctx, targets
+
+    def sample(self, rng: np.random.Generator, batch_size: int, prof=None) -> tuple[np.ndarray, np.ndarray]:
+        u = rng.integers(0, self.n_targets, size=batch_size)
+        doc = np.searchsorted(self.target_offsets, u, side="right") - 1
+        pos = self.offsets[doc] + 1 + (u - self.target_offsets[doc])
+        if prof is not None:
+            prof.mark("sample")
+
+        out = self.windows(pos)
+        if prof is not None:
+            prof.mark("make_ctx")
+        return out
+
+    def sample_many(
+        self, rng: np.random.Generator, batch_size: int, n_steps: int, states: list | None = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        # Same draws as n_steps calls to sample(); the memmap gather is done once.
+        u = np.empty((n_steps, batch_size), dtype=np.int64)
+        for s in range(n_steps):
+            u[s] = rng.integers(0, self.n_targets, size=batch_size)
+            if states is not None:
+                states.append(rng.bit_generator.state)
+
+        u = u.reshape(-1)
+        doc = np.searchsorted(self.target_offsets, u, side="right") - 1
+        pos = self.offsets[doc] + 1 + (u - self.target_offsets[doc])
+        x_ctx, targets = self.windows(pos)
+        return x_ctx.reshape(n_steps, batch_size, -1), targets.reshape(n_steps, batch_size)
+
+    def info(self) -> dict:
+        return {"n_docs": self.n_docs, "n_tokens": self.n_tokens}
+
+
+def load_token_stream(src_path: str, cache_dir: str | None = None, rebuild: bool = False) -> TokenStream:
+    src = Path(src_path)
+    out = Path(cache_dir) if cache_dir else default_cache_dir(src_path)
+    meta_path = out / "meta.json"
+
+    stale = rebuild or not meta_path.exists()
+    if not stale:
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        if src.exists():
+            stamp = source_stamp(src)
+            stale = any(meta.get(k) != v for k, v in stamp.items())
+
+    if stale:
+        build_token_stream(src_path, out.as_posix())
+
+    tokens = np.load(out / "tokens.npy", mmap_mode="r")
+    offsets = np.load(out / "offsets.npy")
+    return TokenStream(tokens, offsets)
+
+
+if __name__ == "__main__":
+    import sys
+
+    build_token_stream(sys.argv[1] if len(sys.argv) > 1 else "data/training/tokens.jsonl")
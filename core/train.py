@@ -2,16 +2,31 @@
 from __future__ import annotations
 
 import json
+import zlib
 from pathlib import Path
 
 import numpy as np
 
-from core.model import CTX_LEN, VOCAB_SIZE, backward, forward, init_model
+from core.checkpoint import CheckpointWriter, load_checkpoint
+from core.metrics import MetricsWriter
+from core.model import CTX_LEN, VOCAB_SIZE, backward, embed_backward, forward, init_model
+from core.prefetch import BatchPrefetcher
+from core.profile import PhaseProfiler
+from core.stream import TokenStream, load_token_stream
 
 BOS = 256
 
 
-def load_batches(path: str) -> tuple[np.ndarray, np.ndarray]:
+def is_heldout(sample_id: str, chunk_id: int, val_frac: float) -> bool:
+    # Deterministic chunk-level validation split (stable across runs and machines).
+    if val_frac <= 0:
+        return False
+    h = zlib.crc32(f"{sample_id}:{chunk_id}".encode("utf-8"))
+    return (h % 10_000) < int(round(val_frac * 10_000))
+
+
+def load_batches(path: str, holdout: float = 0.0) -> tuple[np.ndarray, np.ndarray]:
+    # holdout > 0 drops the validation chunks (see is_heldout) from training.
     p = Path(path)
     if not p.exists():
         raise SystemExit(f"[ERR] Missing: {p.as_posix()}")
@@ -30,6 +45,8 @@ def load_batches(path: str) -> tuple[np.ndarray, np.ndarray]:
             y = r.get("y")
             if not isinstance(x, list) or not isinstance(y, list) or len(x) != len(y):
                 continue
+            if is_heldout(str(r.get("sample_id")), int(r.get("chunk_id", -1)), holdout):
+                continue
 
             xs.append(np.asarray(x, dtype=np.int32))
             ys.append(np.asarray(y, dtype=np.int32))
@@ -61,73 +78,367 @@ def sgd_step(model: dict, grads: dict, lr: float) -> None:
         model[k] -= lr * g
 
 
+class TrainWorkspace:
+    """Preallocated buffers for one forward/loss/backward/update at a fixed batch size.
+
+    Mirrors forward(), softmax_cross_entropy(), backward() and sgd_step() using out=
+    buffers and in-place ufuncs, so a steady-state step does not allocate the
+    activation, probability or gradient arrays. Returned arrays are owned by the
+    workspace and overwritten by the next step.
+    """
+
+    def __init__(self, model: dict[str, np.ndarray], batch_size: int, ctx_len: int = CTX_LEN):
+        v, d = model["W_embed"].shape
+        hidden = model["W1"].shape[1]
+        b = int(batch_size)
+        f32 = np.float32
+
+        self.batch_size = b
+        self.ctx_len = int(ctx_len)
+        self.vocab_size = int(v)
+
+        self.e = np.empty((b, ctx_len, d), dtype=f32)
+        self.x = self.e.reshape(b, ctx_len * d)
+        self.h_pre = np.empty((b, hidden), dtype=f32)
+        self.h = np.empty((b, hidden), dtype=f32)
+        self.active = np.empty((b, hidden), dtype=bool)
+        self.logits = np.empty((b, v), dtype=f32)
+        self.probs = np.empty((b, v), dtype=f32)
+        self.row_stat = np.empty((b, 1), dtype=f32)
+        self.picked = np.empty((b,), dtype=f32)
+        self.rows_flat = np.arange(b, dtype=np.int64) * v
+        self.flat_idx = np.empty((b,), dtype=np.int64)
+
+        self.dh = np.empty((b, hidden), dtype=f32)
+        self.dx = np.empty((b, ctx_len * d), dtype=f32)
+        self.token_ids = np.empty((b, ctx_len), dtype=np.int32)
+
+        self.grads = {k: np.empty_like(model[k]) for k in ("W_embed", "W1", "b1", "W2", "b2")}
+        self.update = {k: np.empty_like(g) for k, g in self.grads.items()}
+
+    def forward(self, model: dict[str, np.ndarray], token_ids: np.ndarray) -> np.ndarray:
+        np.copyto(self.token_ids, token_ids, casting="unsafe")
+        np.take(model["W_embed"], self.token_ids, axis=0, out=self.e)
+
+        np.matmul(self.x, model["W1"], out=self.h_pre)
+        self.h_pre += model["b1"]
+        np.maximum(self.h_pre, 0, out=self.h)
+
+        np.matmul(self.h, model["W2"], out=self.logits)
+        self.logits += model["b2"]
+        return self.logits
+
+    def softmax_cross_entropy(self, targets: np.ndarray) -> tuple[float, np.ndarray]:
+        probs = self.probs
+        np.max(self.logits, axis=1, keepdims=True, out=self.row_stat)
+        np.subtract(self.logits, self.row_stat, out=probs)
+        np.exp(probs, out=probs)
+        np.sum(probs, axis=1, keepdims=True, out=self.row_stat)
+        probs /= self.row_stat
+
+        flat = probs.reshape(-1)
+        np.add(self.rows_flat, targets, out=self.flat_idx)
+        np.take(flat, self.flat_idx, out=self.picked)
+        self.picked += 1e-12
+        np.log(self.picked, out=self.picked)
+        loss = -self.picked.mean()
+
+        flat[self.flat_idx] -= 1.0
+        probs /= self.batch_size
+        return float(loss), probs
+
+    def backward(self, model: dict[str, np.ndarray], dlogits: np.ndarray) -> dict[str, np.ndarray]:
+        g = self.grads
+
+        np.matmul(self.h.T, dlogits, out=g["W2"])
+        np.sum(dlogits, axis=0, out=g["b2"])
+        np.matmul(dlogits, model["W2"].T, out=self.dh)
+
+        np.greater(self.h_pre, 0, out=self.active)
+        np.multiply(self.dh, self.active, out=self.dh)
+
+        np.matmul(self.x.T, self.dh, out=g["W1"])
+        np.sum(self.dh, axis=0, out=g["b1"])
+        np.matmul(self.dh, model["W1"].T, out=self.dx)
+
+        de = self.dx.reshape(self.e.shape)
+        embed_backward(de, self.token_ids, self.vocab_size, out=g["W_embed"])
+        return g
+
+    def sgd_step(self, model: dict[str, np.ndarray], lr: float) -> None:
+        for k, g in self.grads.items():
+            np.multiply(g, lr, out=self.update[k])
+            model[k] -= self.update[k]
+
+
 def make_ctx_batch(X: np.ndarray, n_idx: np.ndarray, t_idx: np.ndarray) -> np.ndarray:
     # Builds a [B, CTX_LEN] context window with BOS left-padding.
-    b = n_idx.shape[0]
+    # Window i covers X[n_idx[i], t_idx[i]-CTX_LEN+1 : t_idx[i]+1]; negative positions become BOS.
     k = CTX_LEN
-    out = np.full((b, k), BOS, dtype=np.int32)
-
-    for i in range(b):
-        seq = X[n_idx[i]]
-        pos = int(t_idx[i])
-        start = max(0, pos - (k - 1))
-        ctx = seq[start : pos + 1]
-        out[i, k - len(ctx) :] = ctx
+    pos = np.asarray(t_idx, dtype=np.int64)[:, None] + np.arange(1 - k, 1, dtype=np.int64)
+    rows = np.asarray(n_idx, dtype=np.int64)[:, None]
 
+    out = X[rows, np.maximum(pos, 0)].astype(np.int32, copy=False)
+    out[pos < 0] = BOS
     return out
 
 
-def train_loop(
-    model: dict,
-    X: np.ndarray,
-    Y: np.ndarray,
-    steps: int = 50_000,
-    lr: float = 0.05,
-    seed: int = 42,
-    log_every: int = 500,
-    batch_size: int = 128,
-) -> tuple[dict, dict]:
-    if X.ndim != 2 or Y.ndim != 2 or X.shape != Y.shape:
-        raise SystemExit("[ERR] X/Y must be [N, T] with the same shape")
+class MatrixSampler:
+    """Samples (context, target) pairs from materialized [N, T] X/Y matrices."""
 
-    n, t = X.shape
-    rng = np.random.default_rng(seed)
+    def __init__(self, X: np.ndarray, Y: np.ndarray):
+        if X.ndim != 2 or Y.ndim != 2 or X.shape != Y.shape:
+            raise SystemExit("[ERR] X/Y must be [N, T] with the same shape")
+        self.X = X
+        self.Y = Y
 
-    losses: list[float] = []
-
-    for step in range(1, steps + 1):
+    def sample(
+        self, rng: np.random.Generator, batch_size: int, prof: PhaseProfiler | None = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        n, t = self.X.shape
         n_idx = rng.integers(0, n, size=batch_size)
         t_idx = rng.integers(0, t, size=batch_size)
-
-        x_ctx = make_ctx_batch(X, n_idx, t_idx)
-        targets = Y[n_idx, t_idx].astype(np.int32, copy=False)
+        if prof is not None:
+            prof.mark("sample")
+
+        x_ctx = make_ctx_batch(self.X, n_idx, t_idx)
+        targets = self.Y[n_idx, t_idx].astype(np.int32, copy=False)
+        if prof is not None:
+            prof.mark("make_ctx")
+        return x_ctx, targets
+
+    def sample_many(
+        self, rng: np.random.Generator, batch_size: int, n_steps: int, states: list | None = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        # Same draws, in the same order, as n_steps calls to sample(); only the
+        # window gather is batched. Returns [S, B, CTX_LEN] and [S, B].
+        # If `states` is given, the rng state after each step's draws is appended.
+        n, t = self.X.shape
+        n_idx = np.empty((n_steps, batch_size), dtype=np.int64)
+        t_idx = np.empty((n_steps, batch_size), dtype=np.int64)
+        for s in range(n_steps):
+            n_idx[s] = rng.integers(0, n, size=batch_size)
+            t_idx[s] = rng.integers(0, t, size=batch_size)
+            if states is not None:
+                states.append(rng.bit_generator.state)
+
+        x_ctx = make_ctx_batch(self.X, n_idx.reshape(-1), t_idx.reshape(-1))
+        targets = self.Y[n_idx, t_idx].astype(np.int32, copy=False)
+        return x_ctx.reshape(n_steps, batch_size, -1), targets
+
+    def info(self) -> dict:
+        n, t = self.X.shape
+        return {"n_sequences": int(n), "seq_len": int(t)}
+
+
+class LocalStep:
+    """Runs one training step in the current process."""
+
+    def __init__(self, model: dict, batch_size: int, use_workspace: bool = True):
+        self.ws = TrainWorkspace(model, batch_size) if use_workspace else None
+
+    def __call__(
+        self,
+        model: dict,
+        x_ctx: np.ndarray,
+        targets: np.ndarray,
+        lr: float,
+        prof: PhaseProfiler | None = None,
+    ) -> float:
+        ws = self.ws
+        if ws is not None:
+            ws.forward(model, x_ctx)
+            if prof is not None:
+                prof.mark("forward")
+            loss, dlogits = ws.softmax_cross_entropy(targets)
+            if prof is not None:
+                prof.mark("loss")
+            ws.backward(model, dlogits)
+            if prof is not None:
+                prof.mark("backward")
+            ws.sgd_step(model, lr)
+            if prof is not None:
+                prof.mark("sgd_step")
+            return loss
 
         logits, cache = forward(model, x_ctx)
+        if prof is not None:
+            prof.mark("forward")
         loss, dlogits = softmax_cross_entropy(logits, targets)
+        if prof is not None:
+            prof.mark("loss")
         grads = backward(model, cache, dlogits)
+        if prof is not None:
+            prof.mark("backward")
         sgd_step(model, grads, lr)
+        if prof is not None:
+            prof.mark("sgd_step")
+        return loss
 
-        losses.append(loss)
+    def close(self, model: dict) -> None:
+        pass
 
-        # percent-based logging
-        log_interval = max(1, int(steps * (log_every / 100.0)))
 
-        if step == 1 or step % log_interval == 0 or step == steps:
-            pct = (step / steps) * 100.0
-            print(f"[{pct:6.2f}%] {step}/{steps} loss={loss:.4f}")
+def train_loop(
+    model: dict,
+    X: np.ndarray | None = None,
+    Y: np.ndarray | None = None,
+    steps: int = 50_000,
+    lr: float = 0.05,
+    seed: int = 42,
+    log_every: int = 500,
+    batch_size: int = 128,
+    stream: TokenStream | None = None,
+    use_workspace: bool = True,
+    workers: int = 1,
+    prefetch: int = 0,
+    checkpoint_dir: str | None = None,
+    checkpoint_every: int = 0,
+    resume_state: dict | None = None,
+    metrics_path: str | None = None,
+    metrics_flush_every: int = 1000,
+    profile: bool = False,
+    trace_memory: bool = False,
+    checkpoint_meta: dict | None = None,
+) -> tuple[dict, dict]:
+    # checkpoint_meta: extra run settings recorded in every checkpoint (train() adds holdout).
+    if stream is not None:
+        sampler = stream
+    elif X is not None and Y is not None:
+        sampler = MatrixSampler(X, Y)
+    else:
+        raise SystemExit("[ERR] train_loop needs X/Y matrices or a token stream")
+
+    rng = np.random.default_rng(seed)
+
+    losses: list[float] = []
+    start_step = 1
+
+    # resume_state: {"step", "rng_state", "losses"} as saved by a checkpoint.
+    if resume_state is not None:
+        rng.bit_generator.state = resume_state["rng_state"]
+        losses = [float(x) for x in resume_state.get("losses", [])]
+        start_step = int(resume_state["step"]) + 1
+
+    # With metrics_path, per-step losses go to an append-only binary stream
+    # instead of the in-memory list (see core.metrics).
+    metrics = None
+    if metrics_path:
+        metrics = MetricsWriter(
+            metrics_path,
+            tokens_per_step=batch_size,
+            flush_every=metrics_flush_every,
+            info={"lr": float(lr), "seed": int(seed), "batch_size": int(batch_size), "steps": int(steps)},
+            resume_records=resume_state.get("metrics_records") if resume_state is not None else None,
+            wall_offset=resume_state.get("wall", 0.0) if resume_state is not None else 0.0,
+        )
+
+    checkpoints = bool(checkpoint_dir) and checkpoint_every > 0
+    writer = CheckpointWriter(checkpoint_dir) if checkpoints else None
+
+    if workers > 1:
+        from core.parallel import DataParallelStep
+
+        step_fn = DataParallelStep(model, batch_size, workers)
+    else:
+        step_fn = LocalStep(model, batch_size, use_workspace=use_workspace)
+
+    # prefetch > 0 builds batches on a background thread, at most `prefetch` steps ahead.
+    batches = None
+    if prefetch > 0:
+        batches = BatchPrefetcher(
+            sampler, rng, batch_size, steps - start_step + 1, depth=prefetch, track_rng=checkpoints
+        )
+
+    # profile=True records per-phase timings (core.profile); off, prof is None.
+    prof = PhaseProfiler(batch_size, trace_memory=trace_memory) if profile else None
+
+    try:
+        for step in range(start_step, steps + 1):
+            if prof is not None:
+                prof.begin()
+            if batches is not None:
+                x_ctx, targets = batches.get()
+                if prof is not None:
+                    prof.mark("wait_batch")
+            else:
+                x_ctx, targets = sampler.sample(rng, batch_size, prof=prof)
+            loss = step_fn(model, x_ctx, targets, lr, prof=prof)
+            if prof is not None:
+                prof.end_step()
+
+            if metrics is not None:
+                metrics.log(step, loss)
+            else:
+                losses.append(loss)
+
+            # percent-based logging
+            log_interval = max(1, int(steps * (log_every / 100.0)))
+
+            if step == 1 or step % log_interval == 0 or step == steps:
+                pct = (step / steps) * 100.0
+                line = f"[{pct:6.2f}%] {step}/{steps} loss={loss:.4f}"
+                if prof is not None:
+                    line += " " + prof.log_suffix()
+                print(line)
+
+            if writer is not None and step % checkpoint_every == 0:
+                rng_state = batches.rng_state if batches is not None else rng.bit_generator.state
+                meta = {
+                    "step": int(step),
+                    "steps": int(steps),
+                    "seed": int(seed),
+                    "batch_size": int(batch_size),
+                    "rng_state": rng_state,
+                    # Plain SGD keeps no per-parameter state; lr is all there is.
+                    "optimizer": {"name": "sgd", "lr": float(lr)},
+                    **sampler.info(),
+                    **(checkpoint_meta or {}),
+                }
+                if metrics is not None:
+                    metrics.flush()
+                    meta["metrics_records"] = metrics.n_records
+                    meta["wall"] = metrics.wall
+                writer.submit(model, meta, losses if metrics is None else None)
+
+            if prof is not None:
+                prof.mark("bookkeeping")
+    finally:
+        if batches is not None:
+            batches.close()
+        step_fn.close(model)
+        if writer is not None:
+            writer.close()
+        if metrics is not None:
+            metrics.close()
+        if prof is not None:
+            prof.close()
+
+    if metrics is not None:
+        final_loss = metrics.final_loss
+    else:
+        final_loss = float(losses[-1]) if losses else None
 
     history = {
         "losses": losses,
-        "final_loss": float(losses[-1]) if losses else None,
+        "final_loss": final_loss,
         "steps": int(steps),
         "lr": float(lr),
         "seed": int(seed),
         "batch_size": int(batch_size),
         "vocab_size": int(VOCAB_SIZE),
         "ctx_len": int(CTX_LEN),
-        "n_sequences": int(n),
-        "seq_len": int(t),
+        "workers": int(max(1, workers)),
     }
+    if metrics is not None:
+        del history["losses"]
+        history["metrics_path"] = Path(metrics_path).as_posix()
+        history["metrics_summary"] = metrics.summary()
+    if prof is not None:
+        history["profile"] = prof.summary()
+    if resume_state is not None:
+        history["resumed_from_step"] = int(resume_state["step"])
+    history.update(sampler.info())
 
     return model, history
 
@@ -139,9 +450,57 @@ def train(
     seed: int = 42,
     log_every: int = 50,
     batch_size: int = 32,
+    stream: bool = False,
+    workers: int = 1,
+    prefetch: int = 0,
+    checkpoint_dir: str | None = None,
+    checkpoint_every: int = 0,
+    resume: str | None = None,
+    metrics_path: str | None = None,
+    holdout: float = 0.0,
+    profile: bool = False,
 ) -> tuple[dict, dict]:
-    X, Y = load_batches(batches_path)
-    model = init_model(seed=seed)
+    # stream=True memory-maps a uint16 token stream built (once) from batches_path,
+    # which may be batches.jsonl or tokens.jsonl, instead of loading X/Y into RAM.
+    X = Y = None
+    token_stream = None
+    if stream:
+        if holdout > 0:
+            raise SystemExit("[ERR] holdout is only supported for the X/Y matrix mode")
+        token_stream = load_token_stream(batches_path)
+    else:
+        X, Y = load_batches(batches_path, holdout=holdout)
+
+    # resume: a checkpoint file, or a checkpoint directory (latest file wins).
+    resume_state = None
+    if resume:
+        model, meta, ckpt_losses = load_checkpoint(resume)
+        for key, want in (("seed", seed), ("batch_size", batch_size)):
+            if meta.get(key) != want:
+                raise SystemExit(f"[ERR] Checkpoint {key}={meta.get(key)!r} does not match {want!r}")
+        if meta["optimizer"]["lr"] != float(lr):
+            raise SystemExit(f"[ERR] Checkpoint lr={meta['optimizer']['lr']} does not match {lr}")
+        if int(meta["step"]) > steps:
+            raise SystemExit(f"[ERR] Checkpoint step {meta['step']} is past steps={steps}")
+        # Same training data: the holdout split and the sequences it leaves (older checkpoints: no holdout).
+        data = token_stream.info() if stream else MatrixSampler(X, Y).info()
+        for key, want in (("holdout", float(holdout)), *data.items()):
+            got = meta.get(key, 0.0 if key == "holdout" else None)
+            if got != want:
+                raise SystemExit(f"[ERR] Checkpoint {key}={got!r} does not match {want!r}")
+
+        resume_state = {
+            "step": meta["step"],
+            "rng_state": meta["rng_state"],
+            "losses": ckpt_losses,
+            "metrics_records": meta.get("metrics_records"),
+            "wall": meta.get("wall", 0.0),
+        }
+        if metrics_path and resume_state["metrics_records"] is None:
+            raise SystemExit("[ERR] Checkpoint was written without a metrics stream; cannot resume into one")
+        print(f"[OK] Resuming from {meta['path']} (step {meta['step']})")
+    else:
+        model = init_model(seed=seed)
 
     model, history = train_loop(
         model=model,
@@ -152,7 +511,18 @@ def train(
         seed=seed,
         log_every=log_every,
         batch_size=batch_size,
+        stream=token_stream,
+        workers=workers,
+        prefetch=prefetch,
+        checkpoint_dir=checkpoint_dir,
+        checkpoint_every=checkpoint_every,
+        resume_state=resume_state,
+        metrics_path=metrics_path,
+        profile=profile,
+        checkpoint_meta={"holdout": float(holdout)},
     )
 
     history["batches_path"] = batches_path
-    return model, history
\ No newline at end of file
+    history["data_mode"] = "stream" if stream else "matrix"
+    history["holdout"] = float(holdout)
+    return model, history
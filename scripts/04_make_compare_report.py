@@ -16,6 +16,10 @@ Assumes artifacts:
 - data/artifacts/filingpt_mlp_baseline_v1.history.json
 - data/artifacts/filingpt_mlp_financial_v1.json
 
+Either JSON may also be a history that points at a binary metrics stream
+("metrics_path", written by core.metrics) or the stream's .json sidecar itself;
+losses are then read from the binary records instead of a JSON list.
+
 Run:
   python scripts/make_comparison_report.py
 or:
@@ -31,13 +35,29 @@ from pathlib import Path
 from typing import Any, Dict, List, Tuple
 
 import matplotlib.pyplot as plt
+import numpy as np
+
+METRICS_FORMAT = "filingpt-metrics-v1"
 
 
 def _read_json(path: Path) -> Dict[str, Any]:
     return json.loads(path.read_text(encoding="utf-8"))
 
 
-def _get_losses(obj: Dict[str, Any]) -> List[float]:
+def _read_metrics_losses(sidecar: Path) -> List[float]:
+    # Binary stream layout is described by the sidecar (see core/metrics.py).
+    meta = _read_json(sidecar)
+    dtype = np.dtype([(name, t) for name, t in meta["dtype"]])
+    records = np.fromfile(sidecar.parent / meta["records"], dtype=dtype)
+    return records["loss"].astype(np.float64).tolist()
+
+
+def _get_losses(obj: Dict[str, Any], path: Path) -> List[float]:
+    if obj.get("format") == METRICS_FORMAT:
+        return _read_metrics_losses(path)
+    if isinstance(obj.get("metrics_path"), str):
+        return _read_metrics_losses(Path(obj["metrics_path"]).with_suffix(".json"))
+
     # We expect "losses" but keep it robust.
     for k in ("losses", "train_losses", "loss"):
         v = obj.get(k)
@@ -178,8 +198,12 @@ def main() -> None:
     b_obj = _read_json(baseline_path)
     f_obj = _read_json(financial_path)
 
-    b_losses = _get_losses(b_obj)
-    f_losses = _get_losses(f_obj)
+    b_losses = _get_losses(b_obj, baseline_path)
+    f_losses = _get_losses(f_obj, financial_path)
+
+    # A metrics sidecar keeps run settings under "info".
+    b_obj = {**b_obj.get("info", {}), **b_obj}
+    f_obj = {**f_obj.get("info", {}), **f_obj}
 
     b_sum = _summarize(b_obj, b_losses)
     f_sum = _summarize(f_obj, f_losses)
@@ -0,0 +1,826 @@
+#!/usr/bin/env python3
+"""
+05_bench.py
+
+Micro-benchmarks for the NumPy hot paths in core/.
+Each benchmark first checks that the fast path agrees with the reference
+implementation, then prints timings.
+
+Run:
+  python -m scripts.05_bench embed
+  python -m scripts.05_bench embed --batch 32 128 512
+  python -m scripts.05_bench parallel --workers 1 2 4 8 --batch 256
+  python -m scripts.05_bench infer --model data/artifacts/filingpt_mlp_financial_v1.npz
+  python -m scripts.05_bench session
+  python -m scripts.05_bench batch --batch 1 8 32 128
+  python -m scripts.05_bench sampling
+  python -m scripts.05_bench load
+  python -m scripts.05_bench quant
+  python -m scripts.05_bench spec --draft_len 2 4 8
+  python -m scripts.05_bench score --bytes 10000 1000000
+  python -m scripts.05_bench template --seeds 8
+  python -m scripts.05_bench cache --max_mb 4 64
+  python -m scripts.05_bench results
+  python -m scripts.05_bench stop --stop '###' '\n\n'
+  python -m scripts.05_bench compress --keep 128 112 96 64
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import re
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+
+from core.compress import activation_profile, compress_model, interleaved_median_us, profile_windows
+from core.evaluate import evaluate_model, load_corpus, token_nll
+from core.infer import (
+    BOS,
+    EOS,
+    SUMMARY_TONES,
+    InferenceSession,
+    LogitCache,
+    constrained_generate,
+    forward_tables,
+    generate,
+    generate_batch,
+    inference_weights,
+    load_model_npz,
+    model_fingerprint,
+    score_batch,
+    score_text,
+    text_to_tokens,
+)
+from core.model import (
+    CTX_LEN,
+    EMBED_DIM,
+    VOCAB_SIZE,
+    embed_backward,
+    embed_backward_scatter,
+    embed_backward_sorted,
+    forward,
+    init_model,
+)
+from core.ngram import build_ngram_draft
+from core.parallel import GRAD_SLOTS
+from core.quantize import forward_quantized, quantize_model, resident_bytes
+from core.registry import ModelRegistry, export_raw_weights, load_raw_weights
+from core.result_cache import ResultCache
+from core.sampling import SamplingWorkspace
+from core.stop import StopSequences, unescape_stop
+from core.stream import TokenStream
+from core.train import load_batches, train_loop
+
+PROMPT = "Net sales increased compared to the prior fiscal year, driven by"
+
+
+def _time_us(fn: Callable[[], object], repeat: int) -> float:
+    fn()  # warm-up
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - t0) / repeat * 1e6
+
+
+def _check_close(name: str, got: np.ndarray, ref: np.ndarray, atol: float = 1e-5) -> None:
+    err = float(np.abs(got.astype(np.float64) - ref.astype(np.float64)).max()) if ref.size else 0.0
+    if err > atol:
+        raise SystemExit(f"[FAIL] {name}: max abs error {err:.3e} > {atol:.1e}")
+
+
+def bench_embed(args: argparse.Namespace) -> None:
+    rng = np.random.default_rng(args.seed)
+
+    print(f"{'batch':>6} {'rows':>7} {'add.at us':>11} {'sorted us':>11} {'auto us':>11} {'speedup':>8}")
+    for b in args.batch:
+        ids = rng.integers(0, VOCAB_SIZE, size=(b, CTX_LEN)).astype(np.int32)
+        de = rng.normal(0.0, 1.0, size=(b, CTX_LEN, EMBED_DIM)).astype(np.float32)
+
+        ref = embed_backward_scatter(de, ids, VOCAB_SIZE)
+        _check_close(f"embed_backward_sorted b={b}", embed_backward_sorted(de, ids, VOCAB_SIZE), ref)
+        _check_close(f"embed_backward b={b}", embed_backward(de, ids, VOCAB_SIZE), ref)
+
+        t_ref = _time_us(lambda: embed_backward_scatter(de, ids, VOCAB_SIZE), args.repeat)
+        t_srt = _time_us(lambda: embed_backward_sorted(de, ids, VOCAB_SIZE), args.repeat)
+        t_auto = _time_us(lambda: embed_backward(de, ids, VOCAB_SIZE), args.repeat)
+        print(f"{b:>6} {b * CTX_LEN:>7} {t_ref:>11.1f} {t_srt:>11.1f} {t_auto:>11.1f} {t_ref / t_auto:>7.2f}x")
+
+    print("[OK] embed_backward matches np.add.at within float32 tolerance")
+
+
+def bench_parallel(args: argparse.Namespace) -> None:
+    X, Y = load_batches(args.batches)
+    cpus = os.cpu_count() or 1
+    if cpus < max(args.workers):
+        print(f"[WARN] {cpus} CPUs for up to {max(args.workers)} workers: scaling numbers are not meaningful")
+
+    runs = {}
+    for w in args.workers:
+        model = init_model(seed=args.seed)
+        t0 = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            model, _ = train_loop(
+                model, X, Y, steps=args.steps, lr=2e-2, seed=args.seed, batch_size=args.batch, workers=w
+            )
+        runs[w] = (model, args.steps / (time.perf_counter() - t0))
+
+    # Data-parallel runs share one slot layout (core.parallel.GRAD_SLOTS) and must match
+    # bit for bit; the single-process step computes the batch as one shard.
+    parallel = [w for w in args.workers if 1 < w <= GRAD_SLOTS]
+    ref = runs[parallel[0] if parallel else args.workers[0]][0]
+    base_sps = runs[args.workers[0]][1]
+    label = f"max |dW| vs {parallel[0] if parallel else args.workers[0]}"
+    print(f"{'workers':>7} {'steps/s':>9} {'tokens/s':>10} {'scaling':>8} {label:>14}")
+    for w, (model, sps) in runs.items():
+        dev = max(float(np.abs(model[k] - ref[k]).max()) for k in ref)
+        print(f"{w:>7} {sps:>9.1f} {sps * args.batch:>10.0f} {sps / base_sps:>7.2f}x {dev:>14.2e}")
+        if w in parallel and dev != 0.0:
+            raise SystemExit(f"[FAIL] workers={w} weights differ from workers={parallel[0]}")
+
+    print(f"[OK] data-parallel weights bit-identical for workers in {parallel}; workers=1 differs by float32 rounding")
+
+
+def bench_infer(args: argparse.Namespace) -> None:
+    model = load_model_npz(args.model)
+    rng = np.random.default_rng(args.seed)
+
+    t0 = time.perf_counter()
+    weights = inference_weights(model)
+    print(f"[OK] position tables {weights['tables'].shape} built in {(time.perf_counter() - t0) * 1e3:.1f} ms")
+
+    x = rng.integers(0, VOCAB_SIZE, size=(256, CTX_LEN)).astype(np.int32)
+    ref, _ = forward(model, x)
+    _check_close("forward_tables vs forward", forward_tables(weights, x), ref, atol=1e-4)
+
+    x1 = x[:1]
+    t_fwd = _time_us(lambda: forward(model, x1), args.repeat)
+    t_tab = _time_us(lambda: forward_tables(weights, x1), args.repeat)
+    print(f"B=1 logits: forward {t_fwd:.1f} us, tables {t_tab:.1f} us ({t_fwd / t_tab:.2f}x)")
+
+    for temp in (0.0, 0.9):
+        kw = dict(max_new_tokens=args.tokens, temperature=temp, top_k=80, seed=123)
+        out_ref = generate(model, PROMPT, use_tables=False, **kw)
+        out_tab = generate(model, PROMPT, **kw)
+        t_ref = _time_us(lambda: generate(model, PROMPT, use_tables=False, **kw), 5) / args.tokens
+        t_new = _time_us(lambda: generate(model, PROMPT, **kw), 5) / args.tokens
+        same = "identical" if out_ref == out_tab else "DIFFERENT"
+        print(f"generate T={temp}: {t_ref:.1f} -> {t_new:.1f} us/token ({t_ref / t_new:.2f}x), output {same}")
+
+
+def _legacy_generate(model: dict[str, np.ndarray], prompt: str, max_new_tokens: int) -> list[int]:
+    # The pre-InferenceSession greedy loop: list-based context, fresh arrays per token.
+    ctx = [BOS] * CTX_LEN
+    for t in text_to_tokens(prompt):
+        ctx = (ctx + [int(t)])[-CTX_LEN:]
+
+    out: list[int] = []
+    for _ in range(max_new_tokens):
+        logits, _ = forward(model, np.array([ctx], dtype=np.int32))
+        scores = logits[0].astype(np.float64)
+        scores[BOS] = -1e9
+        nxt = int(np.argmax(scores))
+        out.append(nxt)
+        ctx = (ctx + [nxt])[-CTX_LEN:]
+    return out
+
+
+def bench_session(args: argparse.Namespace) -> None:
+    model = load_model_npz(args.model)
+    text = "".join(p.read_text(encoding="utf-8") for p in sorted(Path("data/gold").glob("*.txt")))
+    session = InferenceSession(model)
+
+    print(f"{'prompt bytes':>12} {'legacy ms':>10} {'session ms':>11} {'session us/tok':>15} {'speedup':>8}")
+    for n in args.prompt_bytes:
+        prompt = text[:n]
+        t_old = _time_us(lambda: _legacy_generate(model, prompt, args.tokens), 3) / 1e3
+        t_new = _time_us(lambda: session.generate(prompt, max_new_tokens=args.tokens, temperature=0.0), 3) / 1e3
+        print(f"{n:>12} {t_old:>10.1f} {t_new:>11.2f} {t_new * 1e3 / args.tokens:>15.1f} {t_old / t_new:>7.1f}x")
+
+
+def bench_batch(args: argparse.Namespace) -> None:
+    model = load_model_npz(args.model)
+    text = "".join(p.read_text(encoding="utf-8") for p in sorted(Path("data/gold").glob("*.txt")))
+    rng = np.random.default_rng(args.seed)
+
+    print(f"{'batch':>6} {'T':>4} {'loop tok/s':>11} {'batch tok/s':>12} {'speedup':>8}")
+    for b in args.batch:
+        starts = rng.integers(0, max(1, len(text) - 64), size=b)
+        prompts = [text[s : s + 64] for s in starts]
+        seeds = list(range(b))
+        for temp in (0.0, 0.9):
+            kw = dict(max_new_tokens=args.tokens, temperature=temp, top_k=80)
+            t0 = time.perf_counter()
+            ref = [generate(model, p, seed=s, **kw) for p, s in zip(prompts, seeds)]
+            t_loop = time.perf_counter() - t0
+            t0 = time.perf_counter()
+            got = generate_batch(model, prompts, seed=seeds, **kw)
+            t_batch = time.perf_counter() - t0
+
+            if got != ref:
+                bad = sum(g != r for g, r in zip(got, ref))
+                raise SystemExit(f"[FAIL] generate_batch b={b} T={temp}: {bad} outputs differ from generate")
+            n_tok = sum(len(o.encode("utf-8", errors="replace")) for o in ref) or 1
+            print(f"{b:>6} {temp:>4} {n_tok / t_loop:>11.0f} {n_tok / t_batch:>12.0f} {t_loop / t_batch:>7.2f}x")
+
+    print("[OK] generate_batch outputs identical to per-prompt generate")
+
+
+def _legacy_sample(scores: np.ndarray, temperature: float, top_k: int, rng: np.random.Generator) -> int:
+    # The pre-SamplingWorkspace per-token path: fresh arrays and rng.choice.
+    if temperature <= 0:
+        return int(np.argmax(scores))
+    scores = scores / float(temperature)
+    scores = scores - scores.max()
+    probs = np.exp(scores)
+    probs = probs / (probs.sum() + 1e-12)
+    if 0 < top_k < probs.shape[0]:
+        idx = np.argpartition(probs, -top_k)[-top_k:]
+        kept = np.zeros_like(probs)
+        kept[idx] = probs[idx]
+        if kept.sum() > 0:
+            probs = kept / kept.sum()
+    return int(rng.choice(probs.shape[0], p=probs))
+
+
+def _chi_square_z(counts: np.ndarray, probs: np.ndarray) -> tuple[float, int]:
+    # Pearson chi-square over cells with expected count >= 5 (rest pooled),
+    # turned into a z-score with the Wilson-Hilferty approximation.
+    n = counts.sum()
+    exp = probs * n
+    big = exp >= 5
+    obs_c = np.append(counts[big], counts[~big].sum())
+    exp_c = np.append(exp[big], exp[~big].sum())
+    keep = exp_c > 0
+    obs_c, exp_c = obs_c[keep], exp_c[keep]
+    stat = float(((obs_c - exp_c) ** 2 / exp_c).sum())
+    df = int(obs_c.shape[0]) - 1
+    z = ((stat / df) ** (1 / 3) - (1 - 2 / (9 * df))) / math.sqrt(2 / (9 * df))
+    return z, df
+
+
+def bench_sampling(args: argparse.Namespace) -> None:
+    rng = np.random.default_rng(args.seed)
+    v = VOCAB_SIZE
+    configs = [(0.0, 80), (0.5, 5), (0.9, 80), (1.3, 0), (2.0, v)]
+
+    # 1) Same draws as rng.choice for identically seeded generators.
+    logits = rng.normal(0.0, 3.0, size=(args.rows, v))
+    ws = SamplingWorkspace(v, args.rows)
+    for temp, k in configs:
+        ref_rngs = [np.random.default_rng(i) for i in range(args.rows)]
+        new_rngs = [np.random.default_rng(i) for i in range(args.rows)]
+        for _ in range(3):
+            ref = [_legacy_sample(row, temp, k, r) for row, r in zip(logits, ref_rngs)]
+            got = ws.sample(logits.copy(), temp, k, new_rngs)
+            if not np.array_equal(got, ref):
+                raise SystemExit(f"[FAIL] sampling T={temp} k={k}: {int((got != ref).sum())} rows differ from rng.choice")
+    print(f"[OK] SamplingWorkspace draws match rng.choice on {args.rows} rows x {len(configs)} configs")
+
+    # 2) Empirical frequencies of one row against its filtered softmax.
+    row = logits[0]
+    for temp, k in configs[1:]:
+        z = row / temp
+        p = np.exp(z - z.max())
+        p /= p.sum()
+        if 0 < k < v:
+            p[np.argsort(p)[:-k]] = 0.0
+            p /= p.sum()
+        rr = np.random.default_rng(args.seed + 1)
+        draws = np.concatenate(
+            [ws.sample(np.tile(row, (args.rows, 1)), temp, k, [rr] * args.rows) for _ in range(args.draws // args.rows)]
+        )
+        zscore, df = _chi_square_z(np.bincount(draws, minlength=v).astype(np.float64), p)
+        status = "ok" if abs(zscore) < 4.0 else "FAIL"
+        print(f"chi-square T={temp} k={k}: n={draws.size} df={df} z={zscore:+.2f} {status}")
+        if status != "ok":
+            raise SystemExit("[FAIL] sampled frequencies do not match the target distribution")
+
+    # 3) Timing: one row per call, then a whole batch per call.
+    r1 = np.random.default_rng(0)
+    r2 = np.random.default_rng(0)
+    one = SamplingWorkspace(v)
+    rngs = [np.random.default_rng(i) for i in range(args.rows)]
+    print(f"{'T':>4} {'k':>4} {'choice us/row':>14} {'ws us/row':>10} {'batch us/row':>13}")
+    for temp, k in configs:
+        t_old = _time_us(lambda: _legacy_sample(logits[0], temp, k, r1), args.repeat)
+        t_one = _time_us(lambda: one.sample(logits[:1].copy(), temp, k, (r2,)), args.repeat)
+        t_b = _time_us(lambda: ws.sample(logits.copy(), temp, k, rngs), max(1, args.repeat // 10)) / args.rows
+        print(f"{temp:>4} {k:>4} {t_old:>14.1f} {t_one:>10.1f} {t_b:>13.1f}")
+
+
+def bench_load(args: argparse.Namespace) -> None:
+    export_raw_weights(args.model)
+    ref = load_model_npz(args.model)
+    raw = load_raw_weights(args.model)
+    if model_fingerprint(raw) != model_fingerprint(ref):
+        raise SystemExit("[FAIL] raw weights differ from the .npz")
+    if generate(raw, PROMPT, max_new_tokens=100) != generate(
+        ref, PROMPT, max_new_tokens=100
+    ):
+        raise SystemExit("[FAIL] generate differs between raw and .npz weights")
+
+    t_npz = _time_us(lambda: load_model_npz(args.model), 20) / 1e3
+    t_raw = _time_us(lambda: load_raw_weights(args.model), 20) / 1e3
+    registry = ModelRegistry(Path(args.model).parent.as_posix())
+    registry.get(args.model)
+    t_hit = _time_us(lambda: registry.get(args.model), 200)
+    print(f"load_model_npz {t_npz:.2f} ms, load_raw_weights (mmap) {t_raw:.2f} ms ({t_npz / t_raw:.1f}x)")
+    print(f"ModelRegistry.get on a resident model: {t_hit:.1f} us")
+    print("[OK] raw weights match the .npz and generate identical text")
+
+
+def bench_quant(args: argparse.Namespace) -> None:
+    model = load_model_npz(args.model)
+    qmodel = quantize_model(model)
+    weights = inference_weights(model)
+    qweights = inference_weights(qmodel)
+    rng = np.random.default_rng(args.seed)
+
+    x = rng.integers(0, VOCAB_SIZE, size=(256, CTX_LEN)).astype(np.int32)
+    ref, _ = forward(model, x)
+    err = float(np.abs(forward_quantized(qmodel, x) - ref).max())
+    print(f"max |logit error| int8 vs float over 256 random contexts: {err:.4f}")
+    err_t = float(np.abs(forward_tables(qweights, x) - forward_quantized(qmodel, x)).max())
+    print(f"max |logit error| int8 tables vs forward_quantized: {err_t:.2e}")
+
+    table_bytes = sum(v.nbytes for v in weights.values())
+    print(f"resident: float {resident_bytes(model) / 1024:.0f} KB (+{table_bytes / 1024:.0f} KB tables), "
+          f"int8 {resident_bytes(qmodel) / 1024:.0f} KB (+{sum(v.nbytes for v in qweights.values()) / 1024:.0f} KB tables)")
+
+    print(f"{'batch':>6} {'forward us':>11} {'tables us':>10} {'int8 us':>10} {'int8 tables us':>15}")
+    for b in args.batch:
+        xb = x[:b]
+        t_f = _time_us(lambda: forward(model, xb), args.repeat)
+        t_t = _time_us(lambda: forward_tables(weights, xb), args.repeat)
+        t_q = _time_us(lambda: forward_quantized(qmodel, xb), args.repeat)
+        t_qt = _time_us(lambda: forward_tables(qweights, xb), args.repeat)
+        print(f"{b:>6} {t_f:>11.1f} {t_t:>10.1f} {t_q:>10.1f} {t_qt:>15.1f}")
+
+    kw = dict(max_new_tokens=args.tokens, temperature=0.9, top_k=80, seed=123)
+    t_float = _time_us(lambda: generate(model, PROMPT, **kw), 3) / args.tokens
+    t_int8 = _time_us(lambda: generate(qmodel, PROMPT, **kw), 3) / args.tokens
+    print(f"generate: float {t_float:.1f} us/token, int8 {t_int8:.1f} us/token")
+
+
+def bench_spec(args: argparse.Namespace) -> None:
+    model = load_model_npz(args.model)
+    draft = build_ngram_draft(args.tokens_path, order=args.order)
+    session = InferenceSession(model)
+    text = "".join(p.read_text(encoding="utf-8") for p in sorted(Path("data/gold").glob("*.txt")))
+    rng = np.random.default_rng(args.seed)
+    prompts = [text[s : s + 48] for s in rng.integers(0, max(1, len(text) - 48), size=args.prompts)]
+    print(f"[OK] n-gram draft: {draft.info()}")
+
+    # Greedy: identical text; sampling: first-token marginal equals the model's distribution.
+    for p in prompts:
+        got, _ = session.speculative(p, draft, max_new_tokens=args.tokens, temperature=0.0)
+        if got != session.generate(p, max_new_tokens=args.tokens, temperature=0.0):
+            raise SystemExit("[FAIL] greedy speculative output differs from generate")
+
+    # Use the prompt whose next-token distribution is widest, so the test has many cells.
+    ws = SamplingWorkspace(VOCAB_SIZE)
+    best = (-1.0, PROMPT, None)
+    for p in prompts:
+        session.reset(p)
+        scores = session.logits().astype(np.float64)
+        scores[BOS] = -1e9
+        probs = ws.probs_row(scores, 0.9, 80).copy()
+        ent = float(-(probs[probs > 0] * np.log(probs[probs > 0])).sum())
+        if ent > best[0]:
+            best = (ent, p, probs)
+    _, prompt, probs = best
+
+    first = np.zeros((VOCAB_SIZE,), dtype=np.float64)
+    for s in range(args.draws):
+        _, st = session.speculative(prompt, draft, max_new_tokens=2, temperature=0.9, top_k=80, seed=s)
+        first[st["first_token"]] += 1
+    z, df = _chi_square_z(first, probs)
+    if abs(z) >= 4.0:
+        raise SystemExit(f"[FAIL] first-token distribution under speculative sampling: z={z:+.2f}")
+    print(f"[OK] greedy output identical on {len(prompts)} prompts; first-token chi-square z={z:+.2f} (df={df})")
+
+    print(f"{'T':>4} {'draft':>5} {'accept':>7} {'tok/fwd':>8} {'base tok/s':>11} {'spec tok/s':>11} {'speedup':>8}")
+    for temp in (0.0, 0.9):
+        for g in args.draft_len:
+            n_tok = proposed = accepted = forwards = 0
+            t_base = t_spec = 0.0
+            for i, p in enumerate(prompts):
+                t0 = time.perf_counter()
+                out, st = session.speculative(p, draft, max_new_tokens=args.tokens, temperature=temp, seed=i, draft_len=g)
+                t1 = time.perf_counter()
+                session.generate(p, max_new_tokens=args.tokens, temperature=temp, seed=i)
+                t2 = time.perf_counter()
+                t_spec += t1 - t0
+                t_base += t2 - t1
+                n_tok += st["tokens"]
+                proposed += st["proposed"]
+                accepted += st["accepted"]
+                forwards += st["forwards"]
+            rate = accepted / proposed if proposed else 0.0
+            print(
+                f"{temp:>4} {g:>5} {rate:>7.2f} {n_tok / forwards:>8.2f} "
+                f"{n_tok / t_base:>11.0f} {n_tok / t_spec:>11.0f} {t_base / t_spec:>7.2f}x"
+            )
+
+
+def bench_score(args: argparse.Namespace) -> None:
+    model = load_model_npz(args.model)
+    texts = [p.read_text(encoding="utf-8") for p in sorted(Path("data/gold").glob("*.txt"))]
+
+    # Reference: core.evaluate's token_nll (core.model.forward) over each [BOS, bytes, EOS] document.
+    got = score_batch(model, texts)
+    for text, r in zip(texts, got):
+        d = np.asarray([BOS, *text_to_tokens(text), EOS], dtype=np.uint16)
+        ts = TokenStream(d, np.asarray([0, d.shape[0]], dtype=np.int64))
+        x_ctx, targets = ts.windows(np.arange(1, d.shape[0]))
+        _check_close("score_batch logprobs", r["logprobs"], -token_nll(model, x_ctx, targets), atol=1e-4)
+    print(f"[OK] score_batch matches token_nll on {len(texts)} gold documents")
+
+    text = "".join(texts)
+    session = InferenceSession(model)
+    body = text_to_tokens(text)[: args.loop_tokens]
+
+    def per_token() -> None:
+        session.reset()
+        for t in body:
+            session.logits()
+            session.push(t)
+
+    t_loop = _time_us(per_token, 3) / len(body)
+    print(f"per-token InferenceSession.logits: {t_loop:.1f} us/token")
+
+    print(f"{'bytes':>9} {'us/token':>9} {'speedup':>8} {'peak MB':>8} {'ppl':>8}")
+    for n in args.bytes:
+        big = (text * (n // max(1, len(text)) + 1))[:n]
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        r = score_text(model, big, memory_mb=args.memory_mb)
+        dt = time.perf_counter() - t0
+        peak = tracemalloc.get_traced_memory()[1] / 1e6
+        tracemalloc.stop()
+        us = dt * 1e6 / r["n_tokens"]
+        print(f"{n:>9} {us:>9.2f} {t_loop / us:>7.1f}x {peak:>8.1f} {r['ppl']:>8.3f}")
+
+
+def bench_template(args: argparse.Namespace) -> None:
+    model = load_model_npz(args.model)
+    with open(args.samples, "r", encoding="utf-8") as f:
+        texts = [json.loads(line)["text"] for line in f if line.strip()]
+    inputs = [t[: t.index("\n<END_INPUT>")] for t in texts if "\n<END_INPUT>" in t]
+    if not inputs:
+        raise SystemExit(f"[ERR] No <END_INPUT> in {args.samples}")
+    # Training samples end "Tone: X\n###\n\n<END_OUTPUT>"; check the pattern on them, not on our template.
+    tone = re.compile(r"(?m)^Tone: (" + "|".join(SUMMARY_TONES) + r")\n###\n\n<END_OUTPUT>\n")
+    if not all(tone.search(t) for t in texts):
+        raise SystemExit(f"[FAIL] scaffold pattern does not match the samples in {args.samples}")
+
+    # Every full input ends in the same bytes, so cut inputs at sentence ends and
+    # keep prompts whose last CTX_LEN bytes (all the model sees) differ.
+    rng = np.random.default_rng(args.seed)
+    prompts: list[str] = []
+    windows: set[bytes] = set()
+    for i in rng.permutation(len(inputs) * 64):
+        body = inputs[i % len(inputs)]
+        ends = [m.end() for m in re.finditer(r"\. ", body)]
+        if not ends:
+            continue
+        p = body[: ends[rng.integers(len(ends))]].rstrip() + "\n<END_INPUT>\n"
+        w = p.encode("utf-8")[-CTX_LEN:]
+        if w not in windows:
+            windows.add(w)
+            prompts.append(p)
+        if len(prompts) == args.prompts:
+            break
+
+    runs = [(p, seed) for p in prompts for seed in range(args.seeds)]
+    n_tok = n_fwd = n_forced = ok_free = 0
+    t_con = t_free = 0.0
+    for p, seed in runs:
+        t0 = time.perf_counter()
+        text, st = constrained_generate(
+            model, p, temperature=args.temperature, seed=seed, max_line_tokens=args.max_line_tokens
+        )
+        t_con += time.perf_counter() - t0
+        if not tone.search(text):
+            raise SystemExit(f"[FAIL] constrained output is off-format:\n{text}")
+        n_tok += st["tokens"]
+        n_fwd += st["forwards"]
+        n_forced += st["forced"]
+
+        # Free decoding with the same byte budget: how often does it close the scaffold?
+        t0 = time.perf_counter()
+        free = generate(
+            model, p, max_new_tokens=st["tokens"], temperature=args.temperature, seed=seed
+        )
+        t_free += time.perf_counter() - t0
+        ok_free += bool(tone.search(free))
+
+    n = len(runs)
+    print(f"[OK] {n} constrained summaries ({len(prompts)} distinct contexts) all match the training scaffold; "
+          f"free decoding: {ok_free}/{n}")
+    print(f"per summary: {n_tok / n:.0f} bytes, {n_fwd / n:.0f} forwards, "
+          f"{n_forced / n:.0f} forced bytes = forwards saved ({100 * n_forced / n_tok:.1f}%)")
+    print(f"constrained {n_tok / t_con:.0f} bytes/s, free {n_tok / t_free:.0f} bytes/s")
+
+
+def bench_cache(args: argparse.Namespace) -> None:
+    model = load_model_npz(args.model)
+    text = "".join(p.read_text(encoding="utf-8") for p in sorted(Path("data/gold").glob("*.txt")))
+    rng = np.random.default_rng(args.seed)
+    # Sentence openings from the filings, each asked several times (as app.chat
+    # does with its fixed seed), half greedy and half sampled.
+    starts = [m.end() for m in re.finditer(r"\. ", text)]
+    picks = rng.choice(len(starts), size=args.prompts, replace=False)
+    prompts = [text[starts[i] : starts[i] + 32] for i in picks]
+    jobs = [(p, t) for p in prompts for t in (0.0, 0.9)] * args.repeats
+    order = rng.permutation(len(jobs))
+    jobs = [jobs[i] for i in order]
+
+    plain = InferenceSession(model)
+    t0 = time.perf_counter()
+    ref = [plain.generate(p, max_new_tokens=args.tokens, temperature=t) for p, t in jobs]
+    t_plain = time.perf_counter() - t0
+    n_tok = args.tokens * len(jobs)
+    print(f"{len(jobs)} requests x {args.tokens} tokens; no cache: {t_plain * 1e6 / n_tok:.1f} us/token")
+
+    print(f"{'max MB':>7} {'us/token':>9} {'speedup':>8} {'hit rate':>9} {'entries':>8} {'MB used':>8} {'evicted':>8}")
+    for mb in args.max_mb:
+        cache = LogitCache(mb)
+        session = InferenceSession(model, cache=cache)
+        t0 = time.perf_counter()
+        got = [session.generate(p, max_new_tokens=args.tokens, temperature=t) for p, t in jobs]
+        dt = time.perf_counter() - t0
+        if got != ref:
+            raise SystemExit(f"[FAIL] cached decoding differs (max_mb={mb})")
+        c = cache.info()
+        print(
+            f"{mb:>7g} {dt * 1e6 / n_tok:>9.1f} {t_plain / dt:>7.2f}x {100 * c['hit_rate']:>8.1f}% "
+            f"{c['entries']:>8} {c['bytes'] / 1e6:>8.2f} {c['evictions']:>8}"
+        )
+    print("[OK] cached decoding output identical")
+
+
+def bench_results(args: argparse.Namespace) -> None:
+    model = load_model_npz(args.model)
+    text = "".join(p.read_text(encoding="utf-8") for p in sorted(Path("data/gold").glob("*.txt")))
+    rng = np.random.default_rng(args.seed)
+    starts = rng.integers(0, max(1, len(text) - 64), size=args.prompts)
+    prompts = [text[s : s + 64] for s in starts]
+    kw = dict(max_new_tokens=args.tokens, temperature=0.9, top_k=80, seed=123)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = ResultCache(f"{tmp}/results.sqlite", max_mb=args.max_mb)
+        ref = [generate(model, p, **kw) for p in prompts]
+
+        t0 = time.perf_counter()
+        cold = [generate(model, p, result_cache=cache, **kw) for p in prompts]
+        t_cold = (time.perf_counter() - t0) / len(prompts)
+        t0 = time.perf_counter()
+        warm = [generate(model, p, result_cache=cache, **kw) for p in prompts]
+        t_warm = (time.perf_counter() - t0) / len(prompts)
+        if cold != ref or warm != ref:
+            raise SystemExit("[FAIL] cached generate output differs")
+        if generate_batch(model, prompts, result_cache=cache, **kw) != ref:
+            raise SystemExit("[FAIL] generate_batch disagrees with the cached generate results")
+        c = cache.info()
+        print(f"[OK] {len(prompts)} prompts: cached replies identical; {c['entries']} entries, {c['bytes']} bytes")
+        print(f"generate: miss {t_cold * 1e3:.2f} ms/request (decode + store), hit {t_warm * 1e3:.2f} ms "
+              f"({t_cold / t_warm:.0f}x)")
+
+        # Size cap: keep only what fits, dropping the least recently used first.
+        small = ResultCache(f"{tmp}/small.sqlite", max_mb=c["bytes"] / 4 / (1024 * 1024))
+        for p in prompts:
+            generate(model, p, result_cache=small, **kw)
+        s = small.info()
+        print(f"cap {s['max_bytes']} bytes: {s['entries']} entries kept ({s['bytes']} bytes), {s['evictions']} evicted")
+        if s["bytes"] > s["max_bytes"] or generate(model, prompts[-1], result_cache=small, **kw) != ref[-1]:
+            raise SystemExit("[FAIL] size-capped cache misbehaves")
+        if small.info()["hits"] != 1:
+            raise SystemExit("[FAIL] most recent reply was evicted")
+        cache.close()
+        small.close()
+
+
+def bench_stop(args: argparse.Namespace) -> None:
+    model = load_model_npz(args.model)
+    stops = [unescape_stop(x) for x in args.stop]
+    matcher = StopSequences(stops)
+    session = InferenceSession(model)
+    prompts = [PROMPT, "Risks:\n- ", "<BEGIN_OUTPUT>\nBusiness:\n", "Tone: ", "Highlights:\n- "]
+    kw = dict(max_new_tokens=args.tokens, temperature=0.9, top_k=80)
+
+    # Stopped output must be the unstopped output cut before the first stop sequence.
+    for p in prompts:
+        for seed in range(args.seeds):
+            full = session.generate(p, seed=seed, **kw).encode("utf-8")
+            got = session.generate(p, seed=seed, stop=matcher, **kw)
+            end = matcher.find(full)
+            ref = full if end < 0 else full[: end - max(len(x) for x in matcher.stops if full[:end].endswith(x))]
+            if got.encode("utf-8") != ref or "".join(session.stream(p, seed=seed, stop=matcher, **kw)) != got:
+                raise SystemExit(f"[FAIL] stop output differs for prompt {p!r} seed {seed}")
+    print(f"[OK] generate/stream with stop {stops} match the truncated full output ({matcher.n_states} states)")
+
+    batch = [p for p in prompts for _ in range(args.seeds)]
+    seeds = [s for _ in prompts for s in range(args.seeds)]
+    t0 = time.perf_counter()
+    full = generate_batch(model, batch, seed=seeds, **kw)
+    t_full = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    cut = generate_batch(model, batch, seed=seeds, stop=matcher, **kw)
+    t_cut = time.perf_counter() - t0
+    n_full = sum(len(t.encode("utf-8")) for t in full)
+    n_cut = sum(len(t.encode("utf-8")) for t in cut)
+    print(f"generate_batch B={len(batch)}: {n_full} -> {n_cut} bytes, {t_full * 1e3:.0f} -> {t_cut * 1e3:.0f} ms "
+          f"({t_full / t_cut:.2f}x)")
+
+    never = StopSequences(["\x00\x01never"])
+    t_plain = _time_us(lambda: session.generate(PROMPT, seed=0, **kw), 5) / args.tokens
+    t_check = _time_us(lambda: session.generate(PROMPT, seed=0, stop=never, **kw), 5) / args.tokens
+    print(f"per-token cost: no stop {t_plain:.1f} us, non-matching stop {t_check:.1f} us")
+
+
+def bench_compress(args: argparse.Namespace) -> None:
+    model = load_model_npz(args.model)
+    x_ctx = profile_windows(args.tokens_path, args.profile_rows, seed=args.seed, val_frac=args.val_frac)
+    corpus = load_corpus("val", args.batches, args.val_frac)
+    probe = x_ctx[:256]
+    ref, _ = forward(model, probe)
+
+    prof = activation_profile(model, x_ctx)
+    print(f"[OK] profile over {x_ctx.shape[0]} windows: dead units={int((prof['active_frac'] == 0).sum())}, "
+          f"active fraction min={prof['active_frac'].min():.3f}, impact min/median="
+          f"{prof['impact'].min():.3f}/{np.median(prof['impact']):.3f}")
+
+    # Keeping every unit must be lossless; a saved artifact must load back with its own shapes.
+    same, _ = compress_model(model, x_ctx, keep=None)
+    _check_close("prune keep=all", forward(same, probe)[0], ref, atol=1e-4)
+
+    # Low-rank factors are multiplied back on load, so ranks change the file size, not latency.
+    base_ppl = evaluate_model(model, corpus)["ppl"]
+    rows = [("orig", model, "-", (0, 0), Path(args.model).stat().st_size, base_ppl)]
+    with tempfile.TemporaryDirectory() as tmp:
+        for keep in args.keep:
+            for refit, ranks in ((False, (0, 0)), (True, (0, 0)), (True, tuple(args.ranks))):
+                if (not refit or ranks != (0, 0)) and keep >= model["b1"].shape[0]:
+                    continue
+                comp, info = compress_model(model, x_ctx, keep=keep, refit=refit, rank_w1=ranks[0], rank_w2=ranks[1])
+                if ranks != (0, 0) and not any(info["low_rank"].values()):
+                    continue  # factors would not be smaller; low_rank() kept the dense weights
+                ranks = (info["low_rank"]["W1"], info["low_rank"]["W2"])
+                path = Path(tmp) / f"h{keep}.npz"
+                np.savez(path, **comp)
+                loaded = load_model_npz(path.as_posix())
+                if loaded["b1"].shape[0] != keep:
+                    raise SystemExit(f"[FAIL] reloaded hidden size {loaded['b1'].shape[0]} != {keep}")
+                _check_close("reloaded artifact vs tables", forward_tables(inference_weights(loaded), probe),
+                             forward(loaded, probe)[0], atol=1e-3)
+                ppl = evaluate_model(loaded, corpus)["ppl"]
+                rows.append((str(keep), loaded, "yes" if refit else "no", ranks, path.stat().st_size, ppl))
+
+    # Median over interleaved rounds: the hidden-layer share of a call is small next to timer noise.
+    kw = dict(max_new_tokens=args.tokens, temperature=0.9, top_k=80, seed=123)
+    xb = probe[:256]
+    tok_fns, row_fns, gen_fns = {}, {}, {}
+    for i, m in enumerate(row[1] for row in rows):
+        session = InferenceSession(m)
+        session.reset(PROMPT)
+        weights = inference_weights(m)
+        tok_fns[i] = session.logits
+        row_fns[i] = lambda w=weights: forward_tables(w, xb)
+        gen_fns[i] = lambda m=m: generate(m, PROMPT, **kw)
+    t_tok = interleaved_median_us(tok_fns, args.repeat)
+    t_row = interleaved_median_us(row_fns, max(1, args.repeat // 10))
+    t_gen = interleaved_median_us(gen_fns, 1, rounds=5)
+
+    print(f"{'hidden':>6} {'refit':>5} {'ranks':>7} {'file KB':>8} {'ppl':>8} {'dppl %':>7} "
+          f"{'token us':>9} {'batch us/row':>13} {'generate us/tok':>16}")
+    for i, (label, _, refit, ranks, size, ppl) in enumerate(rows):
+        print(f"{label:>6} {refit:>5} {'%d/%d' % ranks:>7} "
+              f"{size / 1024:>8.0f} {ppl:>8.3f} {100 * (ppl / base_ppl - 1):>+7.1f} "
+              f"{t_tok[i]:>9.1f} {t_row[i] / xb.shape[0]:>13.2f} {t_gen[i] / args.tokens:>16.1f}")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--repeat", type=int, default=200)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("embed", help="embedding gradient accumulation")
+    p.add_argument("--batch", type=int, nargs="+", default=[1, 8, 32, 128, 512])
+    p.set_defaults(fn=bench_embed)
+
+    p = sub.add_parser("parallel", help="data-parallel training throughput")
+    p.add_argument("--batches", type=str, default="data/training/batches.jsonl")
+    p.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    p.add_argument("--batch", type=int, default=256)
+    p.add_argument("--steps", type=int, default=200)
+    p.set_defaults(fn=bench_parallel)
+
+    p = sub.add_parser("infer", help="single-prompt generation latency")
+    p.add_argument("--model", type=str, default="data/artifacts/filingpt_mlp_financial_v1.npz")
+    p.add_argument("--tokens", type=int, default=300)
+    p.set_defaults(fn=bench_infer)
+
+    p = sub.add_parser("session", help="InferenceSession vs list-context decoding by prompt length")
+    p.add_argument("--model", type=str, default="data/artifacts/filingpt_mlp_financial_v1.npz")
+    p.add_argument("--tokens", type=int, default=100)
+    p.add_argument("--prompt_bytes", type=int, nargs="+", default=[16, 1_000, 10_000, 100_000])
+    p.set_defaults(fn=bench_session)
+
+    p = sub.add_parser("batch", help="generate_batch vs one generate call per prompt")
+    p.add_argument("--model", type=str, default="data/artifacts/filingpt_mlp_financial_v1.npz")
+    p.add_argument("--tokens", type=int, default=200)
+    p.add_argument("--batch", type=int, nargs="+", default=[1, 8, 32, 128])
+    p.set_defaults(fn=bench_batch)
+
+    p = sub.add_parser("sampling", help="SamplingWorkspace vs rng.choice: exactness, chi-square, timing")
+    p.add_argument("--rows", type=int, default=64)
+    p.add_argument("--draws", type=int, default=200_000)
+    p.set_defaults(fn=bench_sampling)
+
+    p = sub.add_parser("load", help="npz vs memory-mapped raw weight loading")
+    p.add_argument("--model", type=str, default="data/artifacts/filingpt_mlp_financial_v1.npz")
+    p.set_defaults(fn=bench_load)
+
+    p = sub.add_parser("quant", help="int8 vs float32 inference latency and memory")
+    p.add_argument("--model", type=str, default="data/artifacts/filingpt_mlp_financial_v1.npz")
+    p.add_argument("--batch", type=int, nargs="+", default=[1, 16, 256])
+    p.add_argument("--tokens", type=int, default=200)
+    p.set_defaults(fn=bench_quant)
+
+    p = sub.add_parser("spec", help="speculative decoding with the n-gram draft")
+    p.add_argument("--model", type=str, default="data/artifacts/filingpt_mlp_financial_v1.npz")
+    p.add_argument("--tokens_path", type=str, default="data/training/tokens.jsonl")
+    p.add_argument("--order", type=int, default=6)
+    p.add_argument("--draft_len", type=int, nargs="+", default=[2, 4, 8])
+    p.add_argument("--tokens", type=int, default=300)
+    p.add_argument("--prompts", type=int, default=8)
+    p.add_argument("--draws", type=int, default=4000)
+    p.set_defaults(fn=bench_spec)
+
+    p = sub.add_parser("score", help="score_text vs per-token logits: agreement, throughput, memory")
+    p.add_argument("--model", type=str, default="data/artifacts/filingpt_mlp_financial_v1.npz")
+    p.add_argument("--bytes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    p.add_argument("--loop_tokens", type=int, default=2000)
+    p.add_argument("--memory_mb", type=float, default=64)
+    p.set_defaults(fn=bench_score)
+
+    p = sub.add_parser("template", help="scaffold-constrained summaries: forwards saved, format rate")
+    p.add_argument("--model", type=str, default="data/artifacts/filingpt_mlp_financial_v1.npz")
+    p.add_argument("--samples", type=str, default="data/training/samples.jsonl")
+    p.add_argument("--prompts", type=int, default=8)
+    p.add_argument("--seeds", type=int, default=2)
+    p.add_argument("--temperature", type=float, default=0.9)
+    p.add_argument("--max_line_tokens", type=int, default=200)
+    p.set_defaults(fn=bench_template)
+
+    p = sub.add_parser("cache", help="LogitCache on repeated prompts: hit rate, speed, memory")
+    p.add_argument("--model", type=str, default="data/artifacts/filingpt_mlp_financial_v1.npz")
+    p.add_argument("--max_mb", type=float, nargs="+", default=[1, 8, 64])
+    p.add_argument("--prompts", type=int, default=16)
+    p.add_argument("--repeats", type=int, default=3)
+    p.add_argument("--tokens", type=int, default=200)
+    p.set_defaults(fn=bench_cache)
+
+    p = sub.add_parser("results", help="on-disk ResultCache: miss vs hit latency, size-capped eviction")
+    p.add_argument("--model", type=str, default="data/artifacts/filingpt_mlp_financial_v1.npz")
+    p.add_argument("--prompts", type=int, default=32)
+    p.add_argument("--tokens", type=int, default=300)
+    p.add_argument("--max_mb", type=float, default=64)
+    p.set_defaults(fn=bench_results)
+
+    p = sub.add_parser("stop", help="stop sequences: truncation exactness, bytes and time saved")
+    p.add_argument("--model", type=str, default="data/artifacts/filingpt_mlp_financial_v1.npz")
+    p.add_argument("--stop", type=str, nargs="+", default=["###", "<END_OUTPUT>", "\\n"])
+    p.add_argument("--tokens", type=int, default=300)
+    p.add_argument("--seeds", type=int, default=4)
+    p.set_defaults(fn=bench_stop)
+
+    p = sub.add_parser("compress", help="hidden-unit pruning / low-rank factors: perplexity vs latency")
+    p.add_argument("--model", type=str, default="data/artifacts/filingpt_mlp_financial_v1.npz")
+    p.add_argument("--tokens_path", type=str, default="data/training/tokens.jsonl")
+    p.add_argument("--batches", type=str, default="data/training/batches.jsonl")
+    p.add_argument("--val_frac", type=float, default=0.1)
+    p.add_argument("--profile_rows", type=int, default=200_000)
+    p.add_argument("--keep", type=int, nargs="+", default=[128, 120, 112, 96, 64])
+    p.add_argument("--ranks", type=int, nargs=2, default=[0, 64], metavar=("W1", "W2"))
+    p.add_argument("--tokens", type=int, default=300)
+    p.set_defaults(fn=bench_compress)
+
+    args = ap.parse_args()
+    args.fn(args)
+
+
+if __name__ == "__main__":
+    main()